@@ -64,6 +64,12 @@ FADING_CONFIG = {
     "default_target_ages": [10, 20, 40, 60, 80],
 }
 
+# 變老前處理：偵測人臉、裁成含 margin 的正方形並縮放為 image_size，
+# 之後存檔、反演都只處理小圖，構圖也一致（偵測不到人臉時取中央正方形）
+PREPROCESS_ENABLED = os.getenv("SAGE_PREPROCESS", "true").lower() == "true"
+PREPROCESS_METHOD = os.getenv("SAGE_PREPROCESS_METHOD", "cascade")  # cascade（OpenCV Haar）或 align（MediaPipe FaceAligner）
+PREPROCESS_MARGIN = float(os.getenv("SAGE_PREPROCESS_MARGIN", "0.6"))  # 人臉框每邊外擴的比例（保留頭髮與輪廓）
+
 # 年齡範圍
 AGE_MIN = 0
 AGE_MAX = 100
@@ -4,6 +4,8 @@ SAGE API Server - FastAPI Remote Access
 """
 import sys
 import base64
+import hashlib
+import time
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Dict
@@ -13,7 +15,7 @@ from contextlib import asynccontextmanager
 sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import cv2
@@ -21,9 +23,11 @@ import numpy as np
 
 from config.settings import (
     CAPTURED_DIR, AGED_DIR,
-    AUTO_MOCK, MOCK_MODE, DEFAULT_TARGET_AGE
+    AUTO_MOCK, MOCK_MODE, DEFAULT_TARGET_AGE,
+    FADING_CONFIG, PREPROCESS_ENABLED, PREPROCESS_METHOD, PREPROCESS_MARGIN
 )
 from src.aging import age_photo
+from src.utils import prepare_face_image
 
 
 # ============== Pydantic Models ==============
@@ -151,19 +155,57 @@ async def get_status():
     )
 
 
+def resolve_mock(mock: bool) -> bool:
+    """如果 GPU 不可用且未明確指定使用真實模型，自動使用 mock 模式"""
+    from config.settings import has_cuda
+    if mock is False and not has_cuda():
+        print(f"[SAGE API] GPU 不可用，自動切換到 Mock 模式")
+        return True
+    return mock or AUTO_MOCK
+
+
+def preprocess_upload(image: np.ndarray) -> np.ndarray:
+    """變老前處理（SAGE_PREPROCESS=true）：裁出人臉並縮放為模型輸入大小，之後的存檔與反演都只處理小圖"""
+    if not PREPROCESS_ENABLED:
+        return image
+    started = time.perf_counter()
+    size = FADING_CONFIG["image_size"]
+    processed, face_found = prepare_face_image(
+        image, size=size, margin=PREPROCESS_MARGIN, align=PREPROCESS_METHOD == "align"
+    )
+    h, w = image.shape[:2]
+    print(f"[SAGE API] 前處理: {w}x{h} -> {size}x{size}, 人臉: {'有' if face_found else '無（取中央）'}, "
+          f"{(time.perf_counter() - started) * 1000:.0f} ms")
+    return processed
+
+
+def read_aged_jpeg(aged_path: Path) -> bytes:
+    """讀取結果影像的 JPEG 位元組（已經是 JPEG 時直接讀檔，不重新編碼）"""
+    if Path(aged_path).suffix.lower() in (".jpg", ".jpeg"):
+        return Path(aged_path).read_bytes()
+    aged_image = cv2.imread(str(aged_path))
+    _, buffer = cv2.imencode('.jpg', aged_image)
+    return buffer.tobytes()
+
+
 @app.post("/age/upload", response_model=AgePhotoResponse)
 async def age_upload(
     file: UploadFile = File(...),
     target_age: int = Form(default=DEFAULT_TARGET_AGE),
-    mock: bool = Form(default=True)
+    mock: bool = Form(default=True),
+    response_format: str = Form(default="json")
 ):
     """
     Upload and age a photo
 
     - **file**: Image file (JPEG/PNG)
     - **target_age**: Target age (default: 75)
-    - **mock**: Use mock mode (default: True)
+    - **mock**: Use mock mode (default: True; falls back to mock when no GPU is available)
+    - **response_format**: "json" (base64 image in AgePhotoResponse) or "binary"
+      (raw image/jpeg body with an ETag, no base64 overhead)
     """
+    if response_format not in ("json", "binary"):
+        raise HTTPException(status_code=400, detail="response_format must be 'json' or 'binary'")
     try:
         # Read uploaded file
         contents = await file.read()
@@ -172,6 +214,7 @@ async def age_upload(
 
         if image is None:
             raise HTTPException(status_code=400, detail="Invalid image file")
+        image = preprocess_upload(image)
 
         # Save original
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -180,16 +223,24 @@ async def age_upload(
         cv2.imwrite(str(original_path), image)
 
         # Process aging
-        use_mock = mock or AUTO_MOCK
+        use_mock = resolve_mock(mock)
         aged_path = age_photo(str(original_path), target_age, mock=use_mock)
 
         if aged_path is None:
             raise HTTPException(status_code=500, detail="Aging process failed")
 
-        # Read aged image and convert to base64
-        aged_image = cv2.imread(str(aged_path))
-        _, buffer = cv2.imencode('.jpg', aged_image)
-        aged_base64 = base64.b64encode(buffer).decode('utf-8')
+        aged_jpeg = read_aged_jpeg(aged_path)
+        if response_format == "binary":
+            return Response(
+                content=aged_jpeg,
+                media_type="image/jpeg",
+                headers={
+                    "ETag": f'"{hashlib.sha256(aged_jpeg).hexdigest()}"',
+                    "X-Aged-Path": Path(aged_path).name,
+                    "X-Mock": str(use_mock).lower(),
+                },
+            )
+        aged_base64 = base64.b64encode(aged_jpeg).decode('utf-8')
 
         return AgePhotoResponse(
             success=True,
@@ -222,6 +273,7 @@ async def age_photo_base64(request: AgePhotoRequest):
 
         if image is None:
             raise HTTPException(status_code=400, detail="Invalid base64 image")
+        image = preprocess_upload(image)
 
         # Save original
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -230,17 +282,8 @@ async def age_photo_base64(request: AgePhotoRequest):
         cv2.imwrite(str(original_path), image)
 
         # Process aging
-        # 如果 GPU 不可用且未明確指定使用真實模型，自動使用 mock 模式
-        from config.settings import has_cuda
-        gpu_available = has_cuda()
-        
-        if request.mock is False and not gpu_available:
-            print(f"[SAGE API] GPU 不可用，自動切換到 Mock 模式")
-            use_mock = True
-        else:
-            use_mock = request.mock or AUTO_MOCK
-        
-        print(f"[SAGE API] 開始變老處理: target_age={request.target_age}, mock={use_mock}, gpu_available={gpu_available}")
+        use_mock = resolve_mock(request.mock)
+        print(f"[SAGE API] 開始變老處理: target_age={request.target_age}, mock={use_mock}")
         
         try:
             aged_path = age_photo(str(original_path), request.target_age, mock=use_mock)
@@ -254,10 +297,7 @@ async def age_photo_base64(request: AgePhotoRequest):
             print("[SAGE API] 變老處理返回 None")
             raise HTTPException(status_code=500, detail="Aging process failed: age_photo returned None")
 
-        # Read aged image and convert to base64
-        aged_image = cv2.imread(str(aged_path))
-        _, buffer = cv2.imencode('.jpg', aged_image)
-        aged_base64 = base64.b64encode(buffer).decode('utf-8')
+        aged_base64 = base64.b64encode(read_aged_jpeg(aged_path)).decode('utf-8')
 
         return AgePhotoResponse(
             success=True,
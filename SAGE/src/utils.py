@@ -32,13 +32,25 @@ def center_crop(image: np.ndarray, size: int) -> np.ndarray:
     return image[start_y:start_y+size, start_x:start_x+size]
 
 
+_face_cascade = None
+_face_aligner = None
+_ALIGNER_UNAVAILABLE = object()  # FaceAligner 載入失敗的標記，之後直接改用 Haar cascade
+
+
+def _get_face_cascade():
+    """Haar cascade 只載入一次（每次建立都要重新解析 XML）"""
+    global _face_cascade
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+        )
+    return _face_cascade
+
+
 def detect_face(image: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
     """偵測人臉位置"""
-    face_cascade = cv2.CascadeClassifier(
-        cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-    )
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(100, 100))
+    faces = _get_face_cascade().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(100, 100))
     
     if len(faces) == 0:
         return None
@@ -65,6 +77,72 @@ def crop_face(image: np.ndarray, padding: float = 0.3) -> Optional[np.ndarray]:
     return image[y1:y2, x1:x2]
 
 
+def face_crop_box(face: Tuple[int, int, int, int], image_shape: Tuple[int, ...],
+                  margin: float = 0.6) -> Tuple[int, int, int, int]:
+    """
+    以人臉為中心的正方形裁切範圍 (x1, y1, x2, y2)
+    邊長為人臉較長邊 × (1 + 2 × margin)，不超過影像短邊；超出影像時平移回影像內（不縮小）
+    """
+    x, y, w, h = face
+    img_h, img_w = image_shape[:2]
+    side = min(int(round(max(w, h) * (1 + 2 * margin))), img_w, img_h)
+    x1 = int(round(x + w / 2 - side / 2))
+    y1 = int(round(y + h / 2 - side / 2))
+    x1 = min(max(0, x1), img_w - side)
+    y1 = min(max(0, y1), img_h - side)
+    return x1, y1, x1 + side, y1 + side
+
+
+def _align_face(image: np.ndarray, size: int) -> Optional[np.ndarray]:
+    """使用 MediaPipe FaceAligner 對齊人臉；無法使用或偵測不到時回傳 None"""
+    global _face_aligner
+    if _face_aligner is _ALIGNER_UNAVAILABLE:
+        return None
+    if _face_aligner is None:
+        try:
+            from src.models.face_align import FaceAligner
+            _face_aligner = FaceAligner()
+        except Exception as e:
+            # 只在第一次失敗時嘗試與記錄，之後不再重複載入
+            print(f"FaceAligner 無法使用，改用 Haar cascade: {e}")
+            _face_aligner = _ALIGNER_UNAVAILABLE
+            return None
+    try:
+        aligned, _ = _face_aligner.align_face(image, output_size=size)
+        return aligned
+    except Exception as e:
+        print(f"FaceAligner 對齊失敗，改用 Haar cascade: {e}")
+        return None
+
+
+def prepare_face_image(image: np.ndarray, size: int = 512, margin: float = 0.6,
+                       align: bool = False) -> Tuple[np.ndarray, bool]:
+    """
+    變老前處理：偵測人臉、裁成含 margin 的正方形並縮放為 size × size
+
+    偵測不到人臉時與 FADING 的 load_512 相同，取中央正方形
+    align=True 時先嘗試 FaceAligner（五點對齊），失敗再使用 Haar cascade
+
+    Returns:
+        (處理後影像, 是否偵測到人臉)
+    """
+    if align:
+        aligned = _align_face(image, size)
+        if aligned is not None:
+            return aligned, True
+
+    face = detect_face(image)
+    if face is not None:
+        x1, y1, x2, y2 = face_crop_box(face, image.shape, margin)
+        cropped = image[y1:y2, x1:x2]
+    else:
+        cropped = center_crop(image, min(image.shape[:2]))
+
+    # 縮小用 INTER_AREA（避免鋸齒），放大用 LANCZOS4
+    interpolation = cv2.INTER_AREA if cropped.shape[0] > size else cv2.INTER_LANCZOS4
+    return cv2.resize(cropped, (size, size), interpolation=interpolation), face is not None
+
+
 def show_comparison(original: np.ndarray, aged: np.ndarray, window_name: str = "SAGE Comparison"):
     """並排顯示原圖和變老結果"""
     h1, w1 = original.shape[:2]
@@ -130,3 +130,11 @@ class TestSettings:
         from config.settings import AGING_ENGINE
 
         assert AGING_ENGINE in ["fading", "mock"]
+
+    def test_preprocess_settings(self):
+        """測試變老前處理設定"""
+        from config.settings import PREPROCESS_ENABLED, PREPROCESS_METHOD, PREPROCESS_MARGIN
+
+        assert isinstance(PREPROCESS_ENABLED, bool)
+        assert PREPROCESS_METHOD in ["cascade", "align"]
+        assert PREPROCESS_MARGIN >= 0
@@ -139,6 +139,92 @@ class TestCropFace:
             assert result.shape[2] == 3
 
 
+class TestFaceCropBox:
+    """face_crop_box 函數測試"""
+
+    def test_square_box_with_margin(self):
+        """測試裁切範圍為含 margin 的正方形，且以人臉為中心"""
+        from src.utils import face_crop_box
+
+        x1, y1, x2, y2 = face_crop_box((500, 250, 200, 200), (720, 1280, 3), margin=0.5)
+
+        assert x2 - x1 == y2 - y1 == 400
+        assert (x1 + x2) // 2 == 600
+        assert (y1 + y2) // 2 == 350
+
+    def test_box_shifted_inside_image(self):
+        """測試人臉靠近邊緣時，裁切範圍平移回影像內而不縮小"""
+        from src.utils import face_crop_box
+
+        x1, y1, x2, y2 = face_crop_box((0, 0, 100, 100), (480, 640, 3), margin=0.5)
+
+        assert (x1, y1) == (0, 0)
+        assert x2 - x1 == y2 - y1 == 200
+
+    def test_box_limited_to_short_side(self):
+        """測試裁切邊長不超過影像短邊"""
+        from src.utils import face_crop_box
+
+        x1, y1, x2, y2 = face_crop_box((200, 100, 300, 300), (480, 640, 3), margin=1.0)
+
+        assert y2 - y1 == x2 - x1 == 480
+        assert 0 <= x1 and x2 <= 640
+        assert 0 <= y1 and y2 <= 480
+
+
+class TestPrepareFaceImage:
+    """prepare_face_image 函數測試"""
+
+    def test_crops_detected_face(self):
+        """測試偵測到人臉時裁切人臉區域並縮放"""
+        from src.utils import prepare_face_image
+
+        image = np.zeros((720, 1280, 3), dtype=np.uint8)
+        image[250:450, 500:700] = 255  # 人臉框內為白色
+
+        with patch('src.utils.detect_face', return_value=(500, 250, 200, 200)):
+            result, face_found = prepare_face_image(image, size=512, margin=0.0)
+
+        assert face_found is True
+        assert result.shape == (512, 512, 3)
+        assert result.mean() > 250  # 只剩下人臉框
+
+    def test_no_face_center_crop(self, sample_image):
+        """測試偵測不到人臉時取中央正方形"""
+        from src.utils import prepare_face_image
+
+        with patch('src.utils.detect_face', return_value=None):
+            result, face_found = prepare_face_image(sample_image, size=512)
+
+        assert face_found is False
+        assert result.shape == (512, 512, 3)
+
+    def test_align_falls_back_to_cascade(self, sample_image):
+        """測試 FaceAligner 無法使用時改用 Haar cascade"""
+        from src.utils import prepare_face_image
+
+        with patch('src.utils._align_face', return_value=None) as mock_align:
+            with patch('src.utils.detect_face', return_value=(220, 140, 200, 200)) as mock_detect:
+                result, face_found = prepare_face_image(sample_image, size=256, align=True)
+
+        mock_align.assert_called_once()
+        mock_detect.assert_called_once()
+        assert face_found is True
+        assert result.shape == (256, 256, 3)
+
+    def test_aligner_load_failure_is_remembered(self, sample_image):
+        """測試 FaceAligner 載入失敗後不再重複嘗試載入"""
+        import src.utils as utils
+
+        failing = MagicMock(side_effect=RuntimeError("mediapipe 未安裝"))
+        with patch.object(utils, '_face_aligner', None):
+            with patch('src.models.face_align.FaceAligner', failing):
+                assert utils._align_face(sample_image, 256) is None
+                assert utils._align_face(sample_image, 256) is None
+
+        failing.assert_called_once()
+
+
 class TestShowComparison:
     """show_comparison 函數測試"""
 
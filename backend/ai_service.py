@@ -1,19 +1,21 @@
+import asyncio
+import functools
+import math
 import os
-from typing import Optional, List, Dict
-import google.generativeai as genai
+import re
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Optional, List, Dict, Set, Tuple
 
-# Gemini API 配置
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
-
-# 配置 Gemini API
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+from dedup import SimHashIndex, simhash
+from tracing import inc, span, traced
+from llm_providers import router as llm_router, RateLimitError, ProviderNotConfiguredError
 
 
+@functools.lru_cache(maxsize=32)
 def build_system_prompt(role_name: str, role_description: str = None) -> str:
     """
-    根據角色設定構建 System Prompt
+    根據角色設定構建 System Prompt（同一組角色設定只組一次）
 
     對應產品設定：
     - 你是「使用者變老後、住在療養院的自己」
@@ -49,17 +51,77 @@ def build_system_prompt(role_name: str, role_description: str = None) -> str:
 # Gemini 2.5 Flash-Lite 免費額度限制
 # 限制：每天 20 次請求，每分鐘 10 次請求
 # Token 限制：每分鐘 250K tokens（輸入+輸出）
-# 為了安全，限制每次請求最多 15K 字符（約 7.5K-15K tokens，保守估計）
+# 以 token 而非字符計算每次請求的輸入預算（可用環境變數調整）
 # 輸出限制：最多 512 tokens（約 1K 字符）
-MAX_CONTEXT_CHARS = 15000  # 15K 字符（約 7.5K-15K tokens）
-MAX_DOCUMENTS = 5  # 最多處理 5 個來源
-MAX_SINGLE_DOC_CHARS = 2000  # 單個文檔最多 2K 字符
+MAX_INPUT_TOKENS = int(os.getenv("MAX_INPUT_TOKENS", "12000"))  # 每次請求輸入上限（系統提示 + 問題 + 資料）
+MAX_DOCUMENTS = 5  # 舊版關鍵詞篩選最多處理 5 個來源
+MAX_CHUNK_TOKENS = 400  # 單個資料片段最多約 400 tokens
+MIN_CONTEXT_TOKENS = 200  # 至少保留約 200 tokens 的資料，避免整段資料被丟棄
+TOKEN_DEBUG = os.getenv("TOKEN_DEBUG", "false").lower() == "true"  # 逐次輸出提示的 token 用量（除錯用）
 MAX_OUTPUT_TOKENS = 512  # 最多輸出 512 tokens
+CHUNK_NEAR_DUP_DISTANCE = int(os.getenv("CHUNK_NEAR_DUP_DISTANCE", "3"))  # 片段近似重複的 SimHash 距離門檻（負數停用）
+
+# CJK-aware token 估算參數（依 Gemini tokenizer 對繁體中文逐字稿的實測校正，可用環境變數覆寫）
+CJK_TOKENS_PER_CHAR = float(os.getenv("CJK_TOKENS_PER_CHAR", "1.0"))  # 中日韓文字與全形標點：約 1 字 = 1 token
+OTHER_CHARS_PER_TOKEN = float(os.getenv("OTHER_CHARS_PER_TOKEN", "4.0"))  # 英數與半形符號：約 4 字符 = 1 token
+
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+_WHITESPACE_PATTERN = re.compile(r"\s+")
+
 
 def estimate_tokens(text: str) -> int:
-    """估算 token 數量（中文約 1-2 字符 = 1 token）"""
-    return len(text) // 1.5
+    """
+    估算 token 數量（CJK-aware）
+
+    - 中日韓文字與全形標點：每字約 CJK_TOKENS_PER_CHAR 個 token
+    - 其他字符（英數、半形符號）：每 OTHER_CHARS_PER_TOKEN 個字符約 1 個 token
+    - 空白不計入
+    """
+    if not text:
+        return 0
+    cjk_chars = len(_CJK_PATTERN.findall(text))
+    other_chars = len(_WHITESPACE_PATTERN.sub("", text)) - cjk_chars
+    return int(math.ceil(cjk_chars * CJK_TOKENS_PER_CHAR + max(other_chars, 0) / OTHER_CHARS_PER_TOKEN))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截斷文字，使估算的 token 數不超過 max_tokens"""
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # 二分搜尋最長可用前綴
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low]
+
 
+def extract_keywords(question: str) -> List[str]:
+    """提取問題中的關鍵詞（中文詞，2-4字），排除常見停用詞"""
+    if not question:
+        return []
+    stop_words = {'什麼', '如何', '怎樣', '為何', '為什麼', '何時', '哪裡', '哪個', '多少',
+                  '的', '了', '是', '在', '有', '會', '要', '可以', '能夠', '這個', '那個'}
+    keywords = re.findall(r'[\u4e00-\u9fff]{2,4}', question)
+    return [kw for kw in keywords if kw not in stop_words]
+
+
+def keyword_score(keywords: List[str], title: str, content: str) -> int:
+    """計算關鍵詞匹配分數（標題匹配權重更高）"""
+    score = 0
+    for keyword in keywords[:5]:  # 只使用前 5 個關鍵詞
+        if keyword in title:
+            score += 3
+        if keyword in content:
+            score += 1
+    return score
+
+@traced("ai.filter_relevant_documents")
 def filter_relevant_documents(question: str, documents: List[Dict], max_docs: int = MAX_DOCUMENTS) -> List[Dict]:
     """
     根據問題篩選相關文檔（簡單關鍵詞匹配）
@@ -75,39 +137,17 @@ def filter_relevant_documents(question: str, documents: List[Dict], max_docs: in
     if not documents or not question:
         return documents[:max_docs] if documents else []
     
-    import re
-    
-    # 提取問題中的關鍵詞（中文詞，2-4字）
-    # 排除常見停用詞
-    stop_words = {'什麼', '如何', '怎樣', '為何', '為什麼', '何時', '哪裡', '哪個', '多少', 
-                  '的', '了', '是', '在', '有', '會', '要', '可以', '能夠', '這個', '那個'}
-    
-    # 提取中文詞（2-4字）
-    keywords = re.findall(r'[\u4e00-\u9fff]{2,4}', question)
-    keywords = [kw for kw in keywords if kw not in stop_words]
+    keywords = extract_keywords(question)
     
     if not keywords:
         # 如果沒有關鍵詞，返回前 N 個文檔
         return documents[:max_docs]
     
     # 為每個文檔計算相關度分數
-    scored_docs = []
-    for doc in documents:
-        title = doc.get('title', '')
-        content = doc.get('content', '')
-        text = f"{title} {content}"
-        
-        # 計算關鍵詞匹配分數
-        score = 0
-        for keyword in keywords[:5]:  # 只使用前 5 個關鍵詞
-            # 標題匹配權重更高
-            if keyword in title:
-                score += 3
-            # 內容匹配
-            if keyword in content:
-                score += 1
-        
-        scored_docs.append((score, doc))
+    scored_docs = [
+        (keyword_score(keywords, doc.get('title', ''), doc.get('content', '')), doc)
+        for doc in documents
+    ]
     
     # 按分數排序（降序）
     scored_docs.sort(key=lambda x: x[0], reverse=True)
@@ -129,169 +169,495 @@ def filter_relevant_documents(question: str, documents: List[Dict], max_docs: in
     
     return result[:max_docs]
 
-def truncate_documents(documents: List[Dict], max_chars: int = MAX_CONTEXT_CHARS) -> List[Dict]:
+def split_into_chunks(content: str, max_tokens: int = MAX_CHUNK_TOKENS) -> List[str]:
     """
-    截斷文檔列表，確保總字符數不超過限制
-    
+    將文檔內容切成不超過 max_tokens 的片段（優先按段落，其次按句子，最後硬切）
+    """
+    content = (content or "").strip()
+    if not content:
+        return []
+
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", content):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        # 段落太長：按句子切分
+        for sentence in re.split(r"(?<=[。！？!?\n])", paragraph):
+            sentence = sentence.strip()
+            while sentence:
+                head = truncate_to_tokens(sentence, max_tokens) or sentence[:1]
+                pieces.append(head)
+                sentence = sentence[len(head):].strip()
+
+    # 合併相鄰的小片段，減少片段數量
+    chunks: List[str] = []
+    buf = ""
+    for piece in pieces:
+        candidate = f"{buf}\n{piece}" if buf else piece
+        if buf and estimate_tokens(candidate) > max_tokens:
+            chunks.append(buf)
+            buf = piece
+        else:
+            buf = candidate
+    if buf:
+        chunks.append(buf)
+    return chunks
+
+
+def _format_source_header(source_id: str, title: str) -> str:
+    header = f"\n【來源：{source_id}】"
+    if title:
+        header += f"\n標題：{title}"
+    return header
+
+
+def chunk_documents(documents: List[Dict], near_duplicate_distance: int = CHUNK_NEAR_DUP_DISTANCE) -> List[Tuple[int, int, str]]:
+    """
+    將所有來源切成片段，回傳 [(來源序號, 片段序號, 片段文字), ...]
+
+    與先前片段 SimHash 漢明距離 <= near_duplicate_distance 的片段視為近似重複並略過
+    （片段序號保持原值，只是不出現在結果中）；設為負數則不去重
+    """
+    index_by_hash = SimHashIndex(near_duplicate_distance) if near_duplicate_distance >= 0 else None
+    chunks: List[Tuple[int, int, str]] = []
+    for rank, doc in enumerate(documents):
+        for index, chunk in enumerate(split_into_chunks(doc.get('content', ''))):
+            if index_by_hash is not None:
+                fingerprint = simhash(chunk)
+                if fingerprint is not None:
+                    if index_by_hash.find(fingerprint) is not None:
+                        continue
+                    index_by_hash.add(fingerprint, (rank, index))
+            chunks.append((rank, index, chunk))
+    return chunks
+
+
+@traced("ai.pack_context")
+def pack_context(
+    question: str,
+    documents: List[Dict],
+    token_budget: int,
+    chunks: Optional[List[Tuple[int, int, str]]] = None,
+    exclude: Optional[Set[Tuple[int, int]]] = None,
+    keep_at_least_one: bool = True,
+) -> Tuple[str, Dict]:
+    """
+    在 token 預算內打包最相關的資料片段
+
+    1. 將每個來源切成片段，並以關鍵詞匹配計分（來源順序作為同分時的次序）
+    2. 依分數由高到低放入預算，放不下的片段略過、改試下一個
+    3. 若一個片段都放不下，保留最高分片段的開頭（截斷到剩餘預算，含來源標頭仍不超過 token_budget）
+    4. 輸出時依來源與原始片段順序排列，維持閱讀順序
+
     Args:
-        documents: 文檔列表
-        max_chars: 最大字符數限制
-    
+        chunks: 預先切好的片段（chunk_documents 的結果），不提供時現場切分
+        exclude: 不要重複放入的片段 (來源序號, 片段序號)，例如已在快取前綴中的片段
+        keep_at_least_one: 預算不足時是否仍保留一個截斷片段
+
     Returns:
-        截斷後的文檔列表
+        (context_text, stats)：stats 包含 context_tokens、chunks_used、chunks_total、sources_used、selected
     """
+    stats = {"context_tokens": 0, "chunks_used": 0, "chunks_total": 0, "sources_used": 0, "selected": set()}
     if not documents:
-        return []
-    
-    # 先限制文檔數量
-    limited_docs = documents[:MAX_DOCUMENTS]
-    
-    total_chars = 0
-    result = []
-    
-    for doc in limited_docs:
-        source_id = doc.get('source', '未知來源')
-        title = doc.get('title', '')
-        content = doc.get('content', '')
-        
-        # 先截斷單個文檔的內容（如果太長）
-        if len(content) > MAX_SINGLE_DOC_CHARS:
-            content = content[:MAX_SINGLE_DOC_CHARS] + "...（內容已截斷）"
-        
-        # 計算這個文檔需要的字符數
-        doc_text = f"\n【來源：{source_id}】\n標題：{title}\n內容：{content}"
-        doc_chars = len(doc_text)
-        
-        # 如果加上這個文檔會超過限制，截斷內容或停止
-        if total_chars + doc_chars > max_chars:
-            remaining_chars = max_chars - total_chars - len(f"\n【來源：{source_id}】\n標題：{title}\n內容：")
-            if remaining_chars > 200:  # 至少保留 200 字符
-                truncated_content = content[:remaining_chars] + "...（內容已截斷）"
-                result.append({
-                    "source": source_id,
-                    "title": title,
-                    "content": truncated_content
-                })
-            # 無論如何都停止，因為已經達到限制
-            break
-        
-        result.append({
-            "source": source_id,
-            "title": title,
-            "content": content
-        })
-        total_chars += doc_chars
-    
-    return result
+        return "", stats
 
-async def generate_answer_with_ai(
+    if chunks is None:
+        chunks = chunk_documents(documents)
+    keywords = extract_keywords(question)
+
+    # (score, source_rank, chunk_index, text)
+    candidates: List[Tuple[int, int, int, str]] = []
+    for rank, index, chunk in chunks:
+        if exclude and (rank, index) in exclude:
+            continue
+        score = 0
+        if keywords:
+            score = keyword_score(keywords, documents[rank].get('title', ''), "") + keyword_score(keywords, "", chunk)
+        candidates.append((score, rank, index, chunk))
+    stats["chunks_total"] = len(chunks)
+    if not candidates:
+        return "", stats
+
+    candidates.sort(key=lambda c: (-c[0], c[1], c[2]))
+
+    selected: Dict[int, List[Tuple[int, str]]] = {}
+    used = 0
+    for score, rank, index, chunk in candidates:
+        header_cost = 0 if rank in selected else estimate_tokens(
+            _format_source_header(documents[rank].get('source', '未知來源'), documents[rank].get('title', ''))
+        )
+        cost = header_cost + estimate_tokens(chunk) + 2
+        if used + cost > token_budget:
+            continue
+        selected.setdefault(rank, []).append((index, chunk))
+        used += cost
+
+    if not selected:
+        if not keep_at_least_one:
+            return "", stats
+        # 預算不足以放入任何完整片段：保留最高分片段的開頭（扣掉來源標頭與截斷標記後的預算）
+        score, rank, index, chunk = candidates[0]
+        marker = "...（內容已截斷）"
+        header = _format_source_header(documents[rank].get('source', '未知來源'), documents[rank].get('title', ''))
+        keep = token_budget - estimate_tokens(f"{header}\n內容：{marker}")
+        if keep <= 0:
+            return "", stats
+        selected[rank] = [(index, truncate_to_tokens(chunk, keep) + marker)]
+
+    parts: List[str] = []
+    for rank in sorted(selected):
+        doc = documents[rank]
+        parts.append(_format_source_header(doc.get('source', '未知來源'), doc.get('title', '')))
+        doc_chunks = sorted(selected[rank])
+        parts.append("內容：" + "\n...\n".join(chunk for _, chunk in doc_chunks))
+        stats["chunks_used"] += len(doc_chunks)
+        stats["selected"].update((rank, index) for index, _ in doc_chunks)
+
+    context_text = "\n".join(parts)
+    stats["context_tokens"] = estimate_tokens(context_text)
+    stats["sources_used"] = len(selected)
+    return context_text, stats
+
+
+# ============== 靜態提示前綴快取 ==============
+# 提示分成兩段：
+# - 前綴：角色設定（PREFIX_CONTEXT_RATIO > 0 時另含與問題無關的資料內容），只隨 (角色設定, 文檔世代) 改變，可重複使用
+# - 後綴：依問題計分挑選的資料片段 + 對話歷史 + 問題本身
+# 前綴在本地記憶化（連同切好的片段）；若供應商支援前綴快取（例如 Gemini context caching），
+# 也會由 llm_providers 註冊到供應商端，重複提問時只需送出後綴。
+#
+# 取捨：放進前綴的資料是在不知道問題的情況下挑選的，會佔用依問題挑選的預算，
+# 最相關的片段可能因此被擠掉。預設（0）前綴只放角色設定，資料全部依問題挑選；
+# 調高 PREFIX_CONTEXT_RATIO 可換取供應商端快取的延遲與計費優勢（前綴需達供應商的最小長度），但會降低檢索相關性。
+
+PROMPT_PREFIX_CACHE = os.getenv("PROMPT_PREFIX_CACHE", "true").lower() == "true"  # 是否啟用前綴快取
+PREFIX_CONTEXT_RATIO = float(os.getenv("PREFIX_CONTEXT_RATIO", "0"))  # 輸入預算中分給靜態前綴資料的比例（見上方取捨）
+PREFIX_CACHE_SIZE = 8  # 本地最多保留的前綴數
+PROVIDER_PREFIX_CACHE = os.getenv("PROVIDER_PREFIX_CACHE", "true").lower() == "true"  # 是否使用供應商端前綴快取
+
+
+class PromptPrefix:
+    """可重複使用的靜態提示前綴（角色設定，以及 PREFIX_CONTEXT_RATIO > 0 時與問題無關的資料內容）"""
+
+    def __init__(self, key: Tuple, system_prompt: str, context_text: str,
+                 chunks: List[Tuple[int, int, str]], included: Set[Tuple[int, int]]):
+        self.key = key
+        self.system_prompt = system_prompt
+        self.context_text = context_text
+        self.chunks = chunks  # 所有片段（供後綴挑選補充片段，避免每次重新切分）
+        self.included = included  # 已放入前綴的片段
+        self.text = f"{system_prompt}\n{context_text}" if context_text else system_prompt
+        self.tokens = estimate_tokens(self.text)
+        self.provider_caches: Dict[str, object] = {}  # 各供應商的前綴快取 handle（由 llm_providers 管理）
+
+
+_prefix_cache: "OrderedDict[Tuple, PromptPrefix]" = OrderedDict()
+_prefix_cache_lock = threading.Lock()
+
+
+def _documents_fingerprint(documents: Optional[List[Dict]]) -> Tuple:
+    """未提供文檔世代時，以來源與內容長度作為前綴快取的 key"""
+    return tuple((doc.get('source', ''), len(doc.get('content', '') or '')) for doc in documents or [])
+
+
+def get_prompt_prefix(
+    role_name: str,
+    role_description: Optional[str],
+    documents: Optional[List[Dict]],
+    max_input_tokens: int = MAX_INPUT_TOKENS,
+    corpus_generation: Optional[int] = None,
+) -> Tuple[PromptPrefix, bool]:
+    """
+    取得 (角色設定, 文檔世代) 對應的靜態前綴
+
+    Returns:
+        (prefix, hit)：hit 表示是否命中本地快取
+    """
+    generation = corpus_generation if corpus_generation is not None else _documents_fingerprint(documents)
+    key = (role_name, role_description or "", generation, max_input_tokens)
+    if PROMPT_PREFIX_CACHE:
+        with _prefix_cache_lock:
+            prefix = _prefix_cache.get(key)
+            if prefix is not None:
+                _prefix_cache.move_to_end(key)
+                return prefix, True
+
+    system_prompt = build_system_prompt(role_name, role_description)
+    chunks: List[Tuple[int, int, str]] = []
+    context_text = ""
+    included: Set[Tuple[int, int]] = set()
+    if documents:
+        chunks = chunk_documents(documents)
+    if documents and PREFIX_CONTEXT_RATIO > 0:
+        heading = f"=== 歷史資料庫內容（共 {len(documents)} 個來源） ==="
+        budget = int(max_input_tokens * PREFIX_CONTEXT_RATIO) - estimate_tokens(system_prompt) - estimate_tokens(heading)
+        budget = max(budget, MIN_CONTEXT_TOKENS)  # 角色設定很長時仍保留少量資料，避免整段資料被丟棄
+        # 不帶問題打包：只依來源與片段順序，結果與問題無關，才能重複使用
+        packed, stats = pack_context("", documents, budget, chunks=chunks)
+        context_text = f"{heading}\n{packed}"
+        included = stats["selected"]
+
+    prefix = PromptPrefix(key, system_prompt, context_text, chunks, included)
+    if PROMPT_PREFIX_CACHE:
+        with _prefix_cache_lock:
+            _prefix_cache[key] = prefix
+            while len(_prefix_cache) > PREFIX_CACHE_SIZE:
+                _prefix_cache.popitem(last=False)
+    return prefix, False
+
+
+def clear_prompt_prefix_cache():
+    """清空本地前綴快取"""
+    with _prefix_cache_lock:
+        _prefix_cache.clear()
+
+
+@traced("ai.build_prompt")
+def build_prompt(
+    question: str,
+    documents: Optional[List[Dict]],
+    role_name: str,
+    role_description: str = None,
+    max_input_tokens: int = MAX_INPUT_TOKENS,
+    history: str = "",
+    corpus_generation: Optional[int] = None,
+) -> Tuple[PromptPrefix, str, Dict]:
+    """
+    構建完整提示（靜態前綴 + 後綴），並回報 token 使用量
+
+    history 為 session_store 輸出的歷史區塊（長度有上限），放在後綴中問題之前
+
+    Returns:
+        (prefix, suffix, usage)：完整提示為 prefix.text + suffix；
+        usage 包含 input_tokens（估算）、prefix_tokens、prefix_cache_hit 與打包統計
+    """
+    prefix, hit = get_prompt_prefix(role_name, role_description, documents, max_input_tokens, corpus_generation)
+    history_block = f"\n\n{history}" if history else ""
+
+    if documents:
+        question_block = f"\n\n=== 問題 ===\n{question}\n\n請根據以上資料回答問題。**務必確保回答的是問題中問到的人本人的信息，而不是其他人的信息。**如果資料中有相關內容，請在回答中明確指出來源（來源 ID）。如果資料中沒有相關內容，請使用你的知識庫來回答。"
+        if prefix.context_text:
+            supplement_heading = "\n\n=== 與問題較相關的其他資料片段 ==="
+        else:
+            supplement_heading = f"\n\n=== 歷史資料庫內容（共 {len(documents)} 個來源，依與問題的相關性挑選） ==="
+
+        # 前綴與固定部分先扣除，剩下的預算放入與問題相關、且不在前綴中的片段
+        fixed_tokens = prefix.tokens + estimate_tokens(history_block) + estimate_tokens(question_block) + estimate_tokens(supplement_heading)
+        budget = max_input_tokens - fixed_tokens
+        if not prefix.context_text:
+            budget = max(budget, MIN_CONTEXT_TOKENS)  # 角色設定或歷史很長時仍保留少量資料
+        supplement, stats = pack_context(
+            question, documents, budget,
+            chunks=prefix.chunks, exclude=prefix.included, keep_at_least_one=not prefix.context_text,
+        )
+        supplement_block = f"{supplement_heading}\n{supplement}" if supplement else ""
+        suffix = f"{supplement_block}{history_block}{question_block}"
+        usage: Dict = {
+            "chunks_used": len(prefix.included) + stats["chunks_used"],
+            "chunks_total": len(prefix.chunks),
+            "context_tokens": estimate_tokens(prefix.context_text) + stats["context_tokens"],
+        }
+    else:
+        # 沒有上傳資料，只使用模型知識
+        suffix = f"{history_block}\n\n問題：{question}\n\n請回答這個問題。"
+        usage = {}
+
+    usage.update({
+        "budget": max_input_tokens,
+        "history_tokens": estimate_tokens(history),
+        "prefix_tokens": prefix.tokens,
+        "prefix_cache_hit": hit,
+        "input_tokens": prefix.tokens + estimate_tokens(suffix),
+    })
+    return prefix, suffix, usage
+
+
+def record_prompt_usage(usage: Dict):
+    """把估算的 token 用量計入 /metrics（TOKEN_DEBUG=true 時另外逐次輸出）"""
+    cache = "hit" if usage.get("prefix_cache_hit") else "miss"
+    inc("llm_prompt_tokens_total", usage.get("input_tokens", 0), help_text="Estimated LLM input tokens", prefix_cache=cache)
+    inc("llm_context_tokens_total", usage.get("context_tokens", 0), help_text="Estimated document context tokens in prompts")
+    if TOKEN_DEBUG:
+        print(
+            f"[TOKENS] input≈{usage['input_tokens']} budget={usage['budget']} "
+            f"prefix={usage['prefix_tokens']}({cache}) "
+            f"context={usage.get('context_tokens', 0)} chunks={usage.get('chunks_used', 0)}/{usage.get('chunks_total', 0)}"
+        )
+
+
+async def generate_answer_with_usage(
     question: str, 
     documents: Optional[List[Dict]] = None,
     role_name: str = "你是使用者本人在未來變老後的樣子，現在住在一間療養院。你以第一人稱『我』來說話，就像在跟年輕時的自己聊天。",
-    role_description: str = None
-) -> str:
+    role_description: str = None,
+    history: str = "",
+    corpus_generation: Optional[int] = None
+) -> Tuple[str, Dict]:
     """
-    使用 Gemini API 生成答案
+    使用 LLM（預設 Gemini，見 llm_providers）生成答案，並回報本次請求的 token 使用量
     
     Args:
         question: 使用者問題
         documents: 相關文檔列表，格式：[{"source": "來源ID", "title": "標題", "content": "內容"}, ...]
+        history: 多輪對話的歷史區塊（可為空）
+        corpus_generation: 文檔世代戳記（用於前綴快取；不提供時以文檔內容長度判斷）
     
     Returns:
-        AI 生成的答案
+        (AI 生成的答案, usage)；usage["input_tokens"] 為估算值，
+        若供應商回報用量，則 usage["prompt_token_count"] 為實際值，usage["provider"] 為實際使用的供應商
     """
-    if not GEMINI_API_KEY:
-        return "錯誤：未設定 GEMINI_API_KEY 環境變數。請在 .env 檔案中設定您的 Gemini API Key。"
-    
+    usage: Dict = {}
     try:
-        # 構建上下文
-        context_parts = []
-        
-        if documents:
-            # 先根據問題篩選相關文檔（只選擇相關的，不發送全部）
-            relevant_docs = filter_relevant_documents(question, documents, MAX_DOCUMENTS)
-            
-            # 再限制文檔大小
-            limited_docs = truncate_documents(relevant_docs, MAX_CONTEXT_CHARS)
-            
-            if len(limited_docs) < len(documents):
-                context_parts.append(f"=== 歷史資料庫內容（已限制為前 {len(limited_docs)} 個來源，共 {len(documents)} 個來源） ===")
-            else:
-                context_parts.append("=== 歷史資料庫內容 ===")
-            
-            for doc in limited_docs:
-                source_id = doc.get('source', '未知來源')
-                title = doc.get('title', '')
-                content = doc.get('content', '')
-                
-                context_parts.append(f"\n【來源：{source_id}】")
-                if title:
-                    context_parts.append(f"標題：{title}")
-                if content:
-                    context_parts.append(f"內容：{content}")
-        
-        # 構建 System Prompt
-        system_prompt = build_system_prompt(role_name, role_description)
-        
-        # 構建完整提示
-        if context_parts:
-            context_text = "\n".join(context_parts)
-            
-            # 檢查總長度，確保不超過限制
-            user_prompt_base = f"\n\n=== 問題 ===\n{question}\n\n請根據以上資料回答問題。**務必確保回答的是問題中問到的人本人的信息，而不是其他人的信息。**如果資料中有相關內容，請在回答中明確指出來源（來源 ID）。如果資料中沒有相關內容，請使用你的知識庫來回答。"
-            
-            # 計算可用於資料的字符數
-            system_prompt_len = len(system_prompt)
-            user_prompt_base_len = len(user_prompt_base)
-            available_chars = MAX_CONTEXT_CHARS - system_prompt_len - user_prompt_base_len - 100  # 保留100字符緩衝
-            
-            # 如果資料太長，截斷
-            if len(context_text) > available_chars:
-                context_text = context_text[:available_chars] + "\n\n（資料過多，已截斷部分內容）"
-            
-            prompt_text = f"{system_prompt}{user_prompt_base}\n\n{context_text}"
-        else:
-            # 沒有上傳資料，只使用模型知識
-            system_prompt = build_system_prompt(role_name, role_description)
-            prompt_text = f"{system_prompt}\n\n問題：{question}\n\n請回答這個問題。"
-        
-        # 調用 Gemini API（添加重試機制和更好的錯誤處理）
-        model = genai.GenerativeModel(GEMINI_MODEL)
+        prefix, suffix, usage = build_prompt(
+            question, documents, role_name, role_description,
+            history=history, corpus_generation=corpus_generation,
+        )
+        record_prompt_usage(usage)
         
+        # 調用 LLM（供應商之間會自動切換；全部被限速時等待後重試一次）
         max_retries = 2  # 減少重試次數，避免過多請求
         retry_delay = 3  # 增加等待時間
         
-        # 最後檢查：如果 prompt 還是太長，只保留系統提示和問題
-        if len(prompt_text) > MAX_CONTEXT_CHARS:
-            system_prompt = build_system_prompt(role_name, role_description)
-            prompt_text = f"{system_prompt}\n\n問題：{question}\n\n請回答這個問題。"
-        
         for attempt in range(max_retries):
             try:
-                response = model.generate_content(
-                    prompt_text,
-                    generation_config=genai.types.GenerationConfig(
+                # 供應商 SDK 多為同步呼叫，放到執行緒中避免阻塞事件迴圈
+                with span("llm"):
+                    response = await asyncio.to_thread(
+                        llm_router.generate,
+                        prefix,
+                        suffix,
                         temperature=0.7,
                         max_output_tokens=MAX_OUTPUT_TOKENS,  # 使用設定的輸出長度限制
+                        use_prefix_cache=PROMPT_PREFIX_CACHE and PROVIDER_PREFIX_CACHE,
                     )
-                )
-                return response.text
-            except Exception as retry_error:
-                error_msg = str(retry_error).lower()
-                # 如果是配額錯誤，等待後重試
-                if ("quota" in error_msg or "rate limit" in error_msg or "429" in error_msg) and attempt < max_retries - 1:
-                    import time
-                    wait_time = retry_delay * (attempt + 1)  # 指數退避：3秒、6秒
-                    time.sleep(wait_time)
+                usage["provider"] = response.provider
+                usage["cached_tokens"] = response.cached_tokens
+                if response.prompt_tokens is not None:
+                    usage["prompt_token_count"] = response.prompt_tokens
+                if response.output_tokens is not None:
+                    usage["output_token_count"] = response.output_tokens
+                return response.text, usage
+            except RateLimitError:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(retry_delay * (attempt + 1))  # 指數退避：3秒、6秒
                     continue
-                else:
-                    raise retry_error
+                raise
     
+    except ProviderNotConfiguredError as e:
+        if any(p.name == "gemini" for p in llm_router.providers):
+            return "錯誤：未設定 GEMINI_API_KEY 環境變數。請在 .env 檔案中設定您的 Gemini API Key。", usage
+        return f"錯誤：{e}", usage
     except Exception as e:
         error_msg = str(e)
         if "API_KEY" in error_msg or "api key" in error_msg.lower():
-            return f"錯誤：Gemini API Key 無效或未設定。請檢查 .env 檔案中的 GEMINI_API_KEY。"
-        elif "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-            return "錯誤：已達到 API 使用配額或速率限制。請稍後再試。"
+            return f"錯誤：Gemini API Key 無效或未設定。請檢查 .env 檔案中的 GEMINI_API_KEY。", usage
+        elif isinstance(e, RateLimitError) or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
+            return "錯誤：已達到 API 使用配額或速率限制。請稍後再試。", usage
         else:
-            return f"錯誤：無法生成答案。{error_msg}"
+            return f"錯誤：無法生成答案。{error_msg}", usage
+
+
+async def generate_answer_with_ai(
+    question: str, 
+    documents: Optional[List[Dict]] = None,
+    role_name: str = "你是使用者本人在未來變老後的樣子，現在住在一間療養院。你以第一人稱『我』來說話，就像在跟年輕時的自己聊天。",
+    role_description: str = None,
+    history: str = "",
+    corpus_generation: Optional[int] = None
+) -> str:
+    """
+    使用 LLM 生成答案（只回傳答案文字）
+    
+    Args:
+        question: 使用者問題
+        documents: 相關文檔列表，格式：[{"source": "來源ID", "title": "標題", "content": "內容"}, ...]
+    
+    Returns:
+        AI 生成的答案
+    """
+    answer, _ = await generate_answer_with_usage(
+        question, documents, role_name, role_description,
+        history=history, corpus_generation=corpus_generation,
+    )
+    return answer
+
+
+# 答案中的來源標註（與前端 removeSourceInfo 相同的規則），語音不需要唸出來
+_SOURCE_INFO_PATTERNS = [
+    re.compile(r"【來源[：:]\s*[^】]+】"),
+    re.compile(r"\(來源[：:]\s*[^)]+\)"),
+    re.compile(r"（來源[：:]\s*[^）]+）"),
+    re.compile(r"^.*來源[：:].*$", re.MULTILINE),
+]
+
+
+def strip_source_info(text: str) -> str:
+    """移除答案中的來源標註（用於語音合成）"""
+    for pattern in _SOURCE_INFO_PATTERNS:
+        text = pattern.sub("", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+async def stream_answer(
+    question: str,
+    documents: Optional[List[Dict]] = None,
+    role_name: str = "你是使用者本人在未來變老後的樣子，現在住在一間療養院。你以第一人稱『我』來說話，就像在跟年輕時的自己聊天。",
+    role_description: str = None,
+    history: str = "",
+    corpus_generation: Optional[int] = None,
+    usage: Optional[Dict] = None,
+) -> AsyncIterator[str]:
+    """
+    串流生成答案，逐段回傳文字（供 /api/ask/speak 邊生成邊合成語音）
+
+    與 generate_answer_with_usage 使用相同的提示與供應商切換；錯誤直接拋出（由呼叫端回報）
+    usage 若有提供，會填入估算的 token 用量與實際使用的供應商
+    """
+    prefix, suffix, prompt_usage = build_prompt(
+        question, documents, role_name, role_description,
+        history=history, corpus_generation=corpus_generation,
+    )
+    record_prompt_usage(prompt_usage)
+    if usage is not None:
+        usage.update(prompt_usage)
+
+    # 全部供應商都被限速時等待後重試（只在開始輸出前）
+    max_retries = 2
+    retry_delay = 3
+    for attempt in range(max_retries):
+        try:
+            with span("llm.first_token"):
+                provider, chunks = await asyncio.to_thread(
+                    llm_router.open_stream,
+                    prefix,
+                    suffix,
+                    temperature=0.7,
+                    max_output_tokens=MAX_OUTPUT_TOKENS,
+                    use_prefix_cache=PROMPT_PREFIX_CACHE and PROVIDER_PREFIX_CACHE,
+                )
+            break
+        except RateLimitError:
+            if attempt < max_retries - 1:
+                await asyncio.sleep(retry_delay * (attempt + 1))
+                continue
+            raise
+    if usage is not None:
+        usage["provider"] = provider
+
+    # 供應商 SDK 是同步的 iterator，每次取下一段都放到執行緒中
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # 客戶端中斷或呼叫端提早停止時也關閉供應商的串流（釋放 HTTP 連線），同樣在執行緒中執行
+        try:
+            await asyncio.to_thread(chunks.close)
+        except ValueError:
+            pass  # 被取消時前一次 next 仍在執行緒中執行，generator 結束後會被回收
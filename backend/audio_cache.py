@@ -0,0 +1,184 @@
+"""
+合成語音的磁碟快取（內容定址 + 容量上限 LRU）
+
+- key 為 (text, lang, voice_name, rate, pitch, sr, 音訊格式, TTS engine) 的 SHA-256，
+  同樣的文字與聲音參數只會向 Google TTS 請求一次（常見問答、打招呼語）
+- 檔案存放在 TTS_CACHE_DIR，總大小超過 TTS_CACHE_MAX_BYTES 時淘汰最久未使用的檔案
+- 命中時更新檔案的 mtime，重啟後以 mtime 還原 LRU 順序
+- key 同時作為 HTTP ETag，瀏覽器重複請求時可直接回傳 304
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from tracing import inc
+
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", str(Path(__file__).resolve().parent / "output" / "tts_cache")))
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "200")) * 1024 * 1024  # 快取總大小上限
+
+
+def audio_cache_key(text: str, lang: str, voice_name: Optional[str], rate: float, pitch: float,
+                    sr: int, audio_format: str = "wav", engine: str = "google") -> str:
+    """合成參數的內容雜湊（參數相同的請求一定得到相同的音訊）"""
+    payload = json.dumps(
+        [text, lang, voice_name or "", float(rate), float(pitch), int(sr), audio_format, engine],
+        ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match 是否符合 etag（RFC 9110 弱比較）
+
+    標頭可為 "*" 或以逗號分隔的多個 entity-tag，每個可帶 W/ 前綴；逐一去掉 W/ 後與 etag 完全比對
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class AudioCache:
+    """以檔案大小計算容量的 LRU 磁碟快取（執行緒安全）"""
+
+    def __init__(self, directory: Path = TTS_CACHE_DIR, max_bytes: int = TTS_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # 檔名 -> 大小，最久未使用的在前
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _load(self):
+        """第一次使用時掃描快取目錄（依 mtime 還原 LRU 順序），並清掉中斷寫入留下的暫存檔"""
+        if self._loaded:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.directory.iterdir():
+            if not path.is_file():
+                continue
+            if path.name.endswith(".tmp"):
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            files.append((stat.st_mtime, path.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+        self._loaded = True
+        self._evict()
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            try:
+                (self.directory / name).unlink(missing_ok=True)
+            except PermissionError:
+                pass  # Windows 上檔案仍被 read 開啟時無法刪除；已移出索引，重啟掃描時再淘汰
+            self._total_bytes -= size
+            self._evictions += 1
+
+    def _lookup(self, name: str) -> Optional[Path]:
+        """在持有鎖時查詢並更新 LRU 順序，回傳檔案路徑；沒有快取時回傳 None（並計為未命中）"""
+        self._load()
+        if name in self._entries:
+            path = self.directory / name
+            if path.exists():
+                self._entries.move_to_end(name)
+                self._hits += 1
+                now = time.time()
+                os.utime(path, (now, now))
+                inc("tts_cache_requests_total", help_text="TTS audio cache lookups", result="hit")
+                return path
+            # 檔案被外部刪除
+            self._total_bytes -= self._entries.pop(name)
+        self._misses += 1
+        inc("tts_cache_requests_total", help_text="TTS audio cache lookups", result="miss")
+        return None
+
+    def get(self, key: str, extension: str = "wav") -> Optional[Path]:
+        """
+        回傳快取檔案路徑；沒有快取時回傳 None（並計為未命中）
+        注意：回傳後檔案仍可能被其他寫入淘汰，要回傳給客戶端的內容請改用 read
+        """
+        with self._lock:
+            return self._lookup(f"{key}.{extension}")
+
+    def read(self, key: str, extension: str = "wav") -> Optional[bytes]:
+        """
+        讀出快取內容；沒有快取時回傳 None
+        只在鎖內查詢並開啟檔案，讀取在鎖外進行（不會擋住其他命中與寫入）：
+        開啟後即使被淘汰刪除，POSIX 上已開啟的 handle 仍可讀完
+        """
+        with self._lock:
+            path = self._lookup(f"{key}.{extension}")
+            if path is None:
+                return None
+            try:
+                handle = open(path, "rb")
+            except FileNotFoundError:
+                # 檔案被外部刪除（_lookup 之後、開啟之前）
+                self._total_bytes -= self._entries.pop(path.name, 0)
+                return None
+        with handle:
+            return handle.read()
+
+    def temp_path(self, extension: str = "wav") -> Path:
+        """在快取目錄中產生暫存檔路徑（寫完後用 put_file 移入快取，同一檔案系統內 rename 不需複製）"""
+        with self._lock:
+            self._load()
+        return self.directory / f"{uuid.uuid4().hex}.{extension}.tmp"
+
+    def put_file(self, key: str, source: Path, extension: str = "wav") -> Path:
+        """把已寫好的檔案移入快取，回傳快取中的路徑"""
+        name = f"{key}.{extension}"
+        path = self.directory / name
+        with self._lock:
+            self._load()
+            os.replace(source, path)
+            size = path.stat().st_size
+            self._total_bytes += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict()
+        return path
+
+    def put_bytes(self, key: str, data: bytes, extension: str = "wav") -> Path:
+        """寫入快取（先寫暫存檔再 rename，其他請求不會讀到寫一半的檔案）"""
+        tmp = self.temp_path(extension)
+        tmp.write_bytes(data)
+        return self.put_file(key, tmp, extension)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+            }
+
+
+audio_cache = AudioCache()
+
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+SQLite 讀寫併發基準測試
+
+模擬「CSV 匯入（持續小批次寫入）」與「/api/ask（讀取訪談文檔）」同時進行，
+比較 SQLite 預設設定（rollback journal）與調校後設定（WAL、synchronous=NORMAL、
+mmap、cache_size、busy_timeout）的吞吐量與鎖衝突次數。
+
+每個模式使用獨立的暫存資料庫檔案，不會動到 history_qa.db。
+
+用法：
+python bench_db_concurrency.py
+python bench_db_concurrency.py --seconds 10 --readers 8 --writers 2
+"""
+import argparse
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, Document, make_engine
+
+
+def seed(Session, rows: int):
+    db = Session()
+    try:
+        for i in range(rows):
+            db.add(Document(title=f"段落{i}", content="我年輕的時候在糖廠做工。" * 50,
+                            category="elderly_interview", source=f"interview_{i % 10}.pdf"))
+        db.commit()
+    finally:
+        db.close()
+
+
+def run_mode(label: str, tuned: bool, seconds: float, readers: int, writers: int, batch: int):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        engine = make_engine(f"sqlite:///{Path(tmpdir) / 'bench.db'}", tuned=tuned)
+        Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        seed(Session, 500)
+
+        stop = threading.Event()
+        lock = threading.Lock()
+        counts = {"reads": 0, "writes": 0, "locked": 0}
+        read_latencies = []
+
+        def reader():
+            while not stop.is_set():
+                db = Session()
+                start = time.perf_counter()
+                try:
+                    db.query(Document.source, Document.title, Document.content).filter(
+                        Document.category == "elderly_interview"
+                    ).all()
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        counts["reads"] += 1
+                        read_latencies.append(elapsed * 1000)
+                except OperationalError:
+                    with lock:
+                        counts["locked"] += 1
+                finally:
+                    db.close()
+
+        def writer(worker: int):
+            n = 0
+            while not stop.is_set():
+                db = Session()
+                try:
+                    for _ in range(batch):
+                        db.add(Document(title=f"w{worker}-{n}", content="匯入的資料內容。" * 20,
+                                        category="CSV導入", source=f"upload_{worker}"))
+                        n += 1
+                    db.commit()
+                    with lock:
+                        counts["writes"] += batch
+                except OperationalError:
+                    db.rollback()
+                    with lock:
+                        counts["locked"] += 1
+                finally:
+                    db.close()
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+        for t in threads:
+            t.start()
+        time.sleep(seconds)
+        stop.set()
+        for t in threads:
+            t.join()
+        engine.dispose()
+
+    p95 = sorted(read_latencies)[int(len(read_latencies) * 0.95) - 1] if read_latencies else float("nan")
+    print(f"[{label}]")
+    print(f"  reads/s:  {counts['reads'] / seconds:8.1f}   read p50: {statistics.median(read_latencies) if read_latencies else float('nan'):6.1f} ms   p95: {p95:6.1f} ms")
+    print(f"  writes/s: {counts['writes'] / seconds:8.1f}   lock errors: {counts['locked']}")
+    return counts["reads"] / seconds, counts["writes"] / seconds
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--seconds", type=float, default=5.0, help="Duration per mode")
+    ap.add_argument("--readers", type=int, default=4, help="Concurrent reader threads")
+    ap.add_argument("--writers", type=int, default=1, help="Concurrent writer threads")
+    ap.add_argument("--batch", type=int, default=20, help="Rows per write transaction")
+    args = ap.parse_args()
+
+    base_r, base_w = run_mode("sqlite defaults", False, args.seconds, args.readers, args.writers, args.batch)
+    tuned_r, tuned_w = run_mode("WAL + tuned pragmas", True, args.seconds, args.readers, args.writers, args.batch)
+    print()
+    print(f"reads/s:  {base_r:.1f} -> {tuned_r:.1f}  ({tuned_r / max(base_r, 1e-6):.2f}x)")
+    print(f"writes/s: {base_w:.1f} -> {tuned_w:.1f}  ({tuned_w / max(base_w, 1e-6):.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
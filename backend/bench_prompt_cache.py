@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+提示前綴快取基準測試（使用 llm_providers.StubProvider，不需網路與 API Key）
+
+比較「每次重建完整提示」與「前綴快取 + 供應商前綴快取」兩種模式下，
+重複提問時的平均延遲與實際計費的輸入 token 數。
+
+模擬供應商（StubProvider）：
+- 每 1K 個未快取的輸入 token 延遲 --ms_per_1k 毫秒
+- 已快取的前綴不計入延遲與計費
+
+預設前綴只含角色設定（PREFIX_CONTEXT_RATIO=0，資料全部依問題挑選），供應商端快取幾乎不生效；
+把資料放進前綴的效果（以檢索相關性為代價）請以 PREFIX_CONTEXT_RATIO 比較
+
+用法：
+python bench_prompt_cache.py
+python bench_prompt_cache.py --rounds 50 --sources 10 --ms_per_1k 20
+PREFIX_CONTEXT_RATIO=0.6 python bench_prompt_cache.py
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import statistics
+import sys
+import time
+
+import ai_service
+from llm_providers import ProviderRouter, StubProvider
+
+
+def make_corpus(num_sources: int, paragraphs: int):
+    """產生合成的訪談逐字稿"""
+    docs = []
+    for i in range(num_sources):
+        body = "\n\n".join(
+            f"第{p}段：我年輕的時候在台南的糖廠做工，那時候生活很辛苦，每天天還沒亮就要出門。" * 4
+            for p in range(paragraphs)
+        )
+        docs.append({"source": f"interview_{i}.pdf", "title": f"受訪者{i}", "content": body})
+    return docs
+
+
+async def run_mode(label: str, enabled: bool, documents, questions, rounds: int):
+    ai_service.PROMPT_PREFIX_CACHE = enabled
+    ai_service.clear_prompt_prefix_cache()
+
+    latencies = []
+    billed_tokens = []
+    for r in range(rounds):
+        question = questions[r % len(questions)]
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # 關閉每次請求的 token 日誌
+            _, usage = await ai_service.generate_answer_with_usage(
+                question, documents, role_name="測試角色", corpus_generation=1
+            )
+        latencies.append((time.perf_counter() - start) * 1000)
+        billed_tokens.append(usage["prompt_token_count"] - usage["cached_tokens"])
+
+    # 第一次請求包含建立快取的成本，另外列出
+    steady = latencies[1:] or latencies
+    billed = billed_tokens[1:] or billed_tokens
+    print(f"[{label}]")
+    print(f"  first request: {latencies[0]:8.1f} ms   billed input tokens: {billed_tokens[0]}")
+    print(f"  repeat mean:   {statistics.mean(steady):8.1f} ms   billed input tokens: {statistics.mean(billed):.0f}")
+    print(f"  repeat p95:    {sorted(steady)[int(len(steady) * 0.95) - 1]:8.1f} ms")
+    return statistics.mean(steady), statistics.mean(billed)
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=30, help="Requests per mode")
+    ap.add_argument("--sources", type=int, default=10, help="Number of synthetic transcript sources")
+    ap.add_argument("--paragraphs", type=int, default=30, help="Paragraphs per source")
+    ap.add_argument("--ms_per_1k", type=float, default=15.0, help="Simulated provider latency per 1K uncached input tokens")
+    args = ap.parse_args()
+
+    ai_service.llm_router = ProviderRouter([StubProvider(ms_per_1k=args.ms_per_1k)])
+
+    documents = make_corpus(args.sources, args.paragraphs)
+    questions = ["你年輕的時候在哪裡工作？", "糖廠的生活辛苦嗎？", "你還記得台南的樣子嗎？"]
+
+    base_ms, base_tokens = await run_mode("no prefix cache", False, documents, questions, args.rounds)
+    cached_ms, cached_tokens = await run_mode("prefix cache", True, documents, questions, args.rounds)
+
+    print()
+    print(f"latency:      {base_ms:.1f} ms -> {cached_ms:.1f} ms  ({base_ms / max(cached_ms, 1e-6):.1f}x)")
+    print(f"input tokens: {base_tokens:.0f} -> {cached_tokens:.0f}  ({base_tokens / max(cached_tokens, 1):.1f}x)")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except BrokenPipeError:
+        sys.exit(0)
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+後端啟動時間分析
+
+1. 導入時間：以 python -X importtime 導入 main，依頂層套件彙總耗時，列出最慢的套件
+2. lifespan 啟動時間：從導入 main 到開始接受請求（lifespan yield）的時間，
+   以及所有背景啟動工作完成（/api/ready 的 warm=true）的時間
+   分別量測 FAST_START=true（背景執行）與 FAST_START=false（舊行為，全部完成才接受請求）
+
+每次量測都在新的子行程與空的暫存目錄中執行（全新資料庫，相當於冷啟動；
+訪談 PDF 會完整導入一次），不會影響 backend/ 下的資料庫。
+
+用法：
+python bench_startup.py
+python bench_startup.py --top 30 --skip_lifespan
+python bench_startup.py --mode fast
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+LIFESPAN_SCRIPT = r"""
+import asyncio, json, time
+t0 = time.perf_counter()
+import main
+from startup import readiness
+t1 = time.perf_counter()
+
+async def go():
+    async with main.lifespan(main.app):
+        t2 = time.perf_counter()
+        while not readiness.is_warm():
+            await asyncio.sleep(0.01)
+        t3 = time.perf_counter()
+        print("@@RESULT@@" + json.dumps({
+            "import_seconds": t1 - t0,
+            "accepting_requests_seconds": t2 - t0,
+            "warm_seconds": t3 - t0,
+            "subsystems": readiness.snapshot()["subsystems"],
+        }))
+
+asyncio.run(go())
+"""
+
+
+def _env(extra=None):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(BACKEND_DIR) + os.pathsep + env.get("PYTHONPATH", "")
+    env.setdefault("EMBEDDING_WORKER", "false")  # 量測啟動時不呼叫 Ollama
+    env.update(extra or {})
+    return env
+
+
+def profile_imports(top: int):
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=workdir, env=_env(), capture_output=True, text=True,
+        )
+    by_package = defaultdict(int)
+    total_us = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        by_package[name.split(".")[0]] += int(self_us)
+        if name == "main":
+            total_us = int(cumulative_us)
+
+    print("=" * 60)
+    print(f"  導入 main 總耗時：{total_us / 1000:.1f} ms")
+    print("=" * 60)
+    print(f"  {'套件':<32}{'耗時 (ms)':>12}{'佔比':>8}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        share = self_us / total_us * 100 if total_us else 0
+        print(f"  {package:<32}{self_us / 1000:>12.1f}{share:>7.1f}%")
+    print()
+
+
+def profile_lifespan(fast_start: bool):
+    label = "FAST_START=true" if fast_start else "FAST_START=false"
+    with tempfile.TemporaryDirectory() as workdir:
+        proc = subprocess.run(
+            [sys.executable, "-c", LIFESPAN_SCRIPT],
+            cwd=workdir, env=_env({"FAST_START": "true" if fast_start else "false"}),
+            capture_output=True, text=True,
+        )
+    result_line = next((line for line in proc.stdout.splitlines() if line.startswith("@@RESULT@@")), None)
+    if result_line is None:
+        print(f"  {label}: 執行失敗\n{proc.stderr[-2000:]}")
+        return
+
+    result = json.loads(result_line[len("@@RESULT@@"):])
+    print("=" * 60)
+    print(f"  {label}")
+    print("=" * 60)
+    print(f"  導入 main：           {result['import_seconds'] * 1000:>9.1f} ms")
+    print(f"  開始接受請求：        {result['accepting_requests_seconds'] * 1000:>9.1f} ms")
+    print(f"  背景工作全部完成：    {result['warm_seconds'] * 1000:>9.1f} ms")
+    for name, state in result["subsystems"].items():
+        seconds = f"{state['seconds'] * 1000:.1f} ms" if state["seconds"] is not None else "-"
+        print(f"    {name:<20}{state['status']:<10}{seconds:>12}  {state['detail'] or ''}")
+    print()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--top", type=int, default=15, help="列出最慢的前 N 個套件")
+    ap.add_argument("--mode", choices=["fast", "full", "both"], default="both", help="量測的啟動模式")
+    ap.add_argument("--skip_lifespan", action="store_true", help="只分析導入時間")
+    args = ap.parse_args()
+
+    profile_imports(args.top)
+    if args.skip_lifespan:
+        return
+    if args.mode in ("fast", "both"):
+        profile_lifespan(True)
+    if args.mode in ("full", "both"):
+        profile_lifespan(False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+語音路徑負載測試（/api/tts 與 /api/tts/stream）
+
+未指定 --url 時，會在暫存目錄啟動一個 uvicorn 子行程，使用離線的 local TTS engine
+（TTS_ENGINE=local，不需 Google 憑證與網路），以 --base_ms / --ms_per_char 模擬合成延遲。
+指定 --url 時直接對既有服務送出請求（使用該服務設定的 engine）。
+
+回報：吞吐量（請求/秒、音訊秒數/秒）、延遲與首位元組時間（TTFB）的 p50/p95/p99、快取命中數
+
+用法：
+python bench_tts.py
+python bench_tts.py --requests 200 --concurrency 16 --endpoint stream
+python bench_tts.py --distinct 5            # 只有 5 種文字，測試快取命中
+python bench_tts.py --url http://localhost:8000 --requests 20
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent
+SAMPLE_RATE = 24000
+
+SENTENCES = [
+    "我年輕的時候在台南的糖廠做工，那時候生活很辛苦。",
+    "每天天還沒亮就要出門，走路去工廠要一個多小時。",
+    "後來結婚生了三個孩子，日子才慢慢好起來。",
+    "那個年代大家都很節儉，一件衣服要穿好幾年。",
+    "過年的時候全家人一起包粽子，是我最懷念的事情。",
+]
+
+
+def make_text(index: int, sentences: int) -> str:
+    """產生第 index 種回答（前面加上編號，讓不同 index 的文字不會命中同一個快取）"""
+    body = "".join(SENTENCES[(index + i) % len(SENTENCES)] for i in range(sentences))
+    return f"第{index}個回答。{body}"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, workdir: str):
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": str(BACKEND_DIR) + os.pathsep + env.get("PYTHONPATH", ""),
+        "TTS_ENGINE": "local",
+        "TTS_LOCAL_BASE_MS": str(args.base_ms),
+        "TTS_LOCAL_MS_PER_CHAR": str(args.ms_per_char),
+        "TTS_CACHE_DIR": str(Path(workdir) / "tts_cache"),
+        "EMBEDDING_WORKER": "false",
+    })
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    return proc, f"http://127.0.0.1:{port}"
+
+
+async def wait_until_warm(client: httpx.AsyncClient, base_url: str, timeout: float = 180.0):
+    """等背景啟動工作（訪談資料導入等）完成，避免與量測互相搶 CPU"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(f"{base_url}/api/ready")
+            if response.status_code == 200 and response.json().get("warm"):
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("服務沒有在時限內就緒")
+
+
+async def one_request(client: httpx.AsyncClient, base_url: str, endpoint: str, text: str):
+    payload = {"text": text, "lang": "zh-TW", "rate": 0.9, "pitch": -2.0}
+    path = "/api/tts/stream" if endpoint == "stream" else "/api/tts"
+    start = time.perf_counter()
+    ttfb = None
+    size = 0
+    async with client.stream("POST", f"{base_url}{path}", json=payload) as response:
+        async for chunk in response.aiter_raw():
+            if ttfb is None:
+                ttfb = time.perf_counter() - start
+            size += len(chunk)
+        status = response.status_code
+    return {
+        "status": status,
+        "seconds": time.perf_counter() - start,
+        "ttfb": ttfb if ttfb is not None else time.perf_counter() - start,
+        "audio_seconds": max(0, size - 44) / (SAMPLE_RATE * 2),
+    }
+
+
+def _percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "mean": statistics.mean(ordered)}
+
+
+async def run_bench(args, base_url: str):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=300.0, limits=limits) as client:
+        await wait_until_warm(client, base_url)
+        semaphore = asyncio.Semaphore(args.concurrency)
+        distinct = args.distinct or args.requests
+
+        async def task(i: int):
+            async with semaphore:
+                return await one_request(client, base_url, args.endpoint, make_text(i % distinct, args.sentences))
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(task(i) for i in range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        metrics_text = (await client.get(f"{base_url}/metrics")).text
+
+    ok = [r for r in results if r["status"] == 200]
+    latency = _percentiles([r["seconds"] for r in ok])
+    ttfb = _percentiles([r["ttfb"] for r in ok])
+    audio_seconds = sum(r["audio_seconds"] for r in ok)
+    hits = next((line.split()[-1] for line in metrics_text.splitlines()
+                 if line.startswith('tts_cache_requests_total{result="hit"}')), "0")
+
+    print("=" * 60)
+    print(f"  端點：{args.endpoint}  請求數：{args.requests}  並行：{args.concurrency}  "
+          f"文字種類：{distinct}  每段句數：{args.sentences}")
+    print("=" * 60)
+    print(f"  成功 / 失敗：       {len(ok)} / {len(results) - len(ok)}")
+    print(f"  總耗時：            {elapsed:.2f} s")
+    print(f"  吞吐量：            {len(ok) / elapsed:.1f} req/s，{audio_seconds / elapsed:.1f} 秒音訊/秒")
+    if latency:
+        print(f"  延遲 (ms)：         p50 {latency['p50'] * 1000:.0f}  p95 {latency['p95'] * 1000:.0f}  "
+              f"p99 {latency['p99'] * 1000:.0f}  平均 {latency['mean'] * 1000:.0f}")
+        print(f"  TTFB (ms)：         p50 {ttfb['p50'] * 1000:.0f}  p95 {ttfb['p95'] * 1000:.0f}  "
+              f"p99 {ttfb['p99'] * 1000:.0f}  平均 {ttfb['mean'] * 1000:.0f}")
+    print(f"  快取命中：          {hits}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--url", type=str, default=None, help="既有服務的網址（不指定則啟動 local engine 的測試服務）")
+    ap.add_argument("--endpoint", choices=["tts", "stream"], default="tts", help="測試的端點")
+    ap.add_argument("--requests", type=int, default=100, help="總請求數")
+    ap.add_argument("--concurrency", type=int, default=8, help="同時進行的請求數")
+    ap.add_argument("--distinct", type=int, default=0, help="文字種類數（0 = 每個請求都不同，不命中快取）")
+    ap.add_argument("--sentences", type=int, default=6, help="每個回答的句數")
+    ap.add_argument("--base_ms", type=float, default=150, help="local engine：每個合成請求的固定延遲")
+    ap.add_argument("--ms_per_char", type=float, default=3, help="local engine：每個字增加的延遲")
+    args = ap.parse_args()
+
+    if args.url:
+        asyncio.run(run_bench(args, args.url.rstrip("/")))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, base_url = start_server(args, workdir)
+        try:
+            asyncio.run(run_bench(args, base_url))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+if __name__ == "__main__":
+    main()
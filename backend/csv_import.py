@@ -0,0 +1,197 @@
+"""
+串流 CSV 匯入與匯入工作（job）狀態
+
+- 以固定大小分塊讀取上傳檔案，經過增量 UTF-8-sig 解碼器逐行交給 csv 模組解析
+- 每一行立即驗證，通過的資料以產生器交給 bulk_insert_documents 分批寫入
+- 整份檔案在同一個交易中匯入（任何一行驗證失敗就全部回滾，與舊版行為一致），
+  但記憶體中最多只保留一個批次的資料，與檔案大小無關；寫入端只更新來源彙總的筆數
+  （合併內容讀取時才產生），匯入時間隨筆數線性成長
+  （實測單一來源：2 萬筆 15MB 約 7 秒、4 萬筆約 16 秒、20 萬筆 151MB 約 88 秒，tracemalloc 峰值約 3MB）
+- 匯入期間一直持有 SQLite 的寫入鎖：其他寫入（/api/ask 的對話紀錄、embedding worker 寫回）
+  最多等待 DB_BUSY_TIMEOUT_MS 後失敗，大型檔案請在離峰時匯入
+- 進度記錄在 ImportJob，透過 GET /api/jobs/{job_id} 查詢
+
+注意：工作狀態存在行程記憶體中，多個 uvicorn worker 時只能在處理該上傳的 worker 查到
+"""
+import codecs
+import csv
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import BinaryIO, Dict, Iterator, Optional
+
+from database import bulk_insert_documents
+
+CSV_READ_CHUNK_BYTES = int(os.getenv("CSV_READ_CHUNK_BYTES", str(256 * 1024)))  # 每次從上傳檔讀取的位元組數
+CSV_IMPORT_BATCH_SIZE = int(os.getenv("CSV_IMPORT_BATCH_SIZE", "500"))  # 每批寫入的筆數
+MAX_TRACKED_JOBS = 100  # 記憶體中保留最近幾個匯入工作
+
+# 解析過程中允許的單一欄位長度（預設 128KB 不夠放長篇逐字稿）
+csv.field_size_limit(16 * 1024 * 1024)
+
+
+class CSVValidationError(ValueError):
+    """CSV 格式或內容不符規定（對應 HTTP 400）"""
+
+
+class ImportJob:
+    """單一匯入工作的進度"""
+
+    def __init__(self, source: str, filename: str):
+        self.job_id = uuid.uuid4().hex
+        self.source = source
+        self.filename = filename
+        self.status = "pending"  # pending / running / done / failed
+        self.rows_read = 0
+        self.inserted = 0
+        self.bytes_read = 0
+        self.error: Optional[str] = None
+        self.stats: Optional[Dict] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+
+    @property
+    def duplicates(self) -> int:
+        """與既有文檔（或同檔案中較早的列）內容重複而略過的筆數"""
+        return (self.stats or {}).get("duplicates", 0)
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.job_id,
+            "source": self.source,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_read": self.rows_read,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "bytes_read": self.bytes_read,
+            "error": self.error,
+            "stats": self.stats,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobStore:
+    """保留最近 MAX_TRACKED_JOBS 個匯入工作"""
+
+    def __init__(self, max_jobs: int = MAX_TRACKED_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, ImportJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, source: str, filename: str) -> ImportJob:
+        job = ImportJob(source, filename)
+        with self._lock:
+            self._jobs[job.job_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+
+job_store = JobStore()
+
+
+def iter_decoded_lines(fileobj: BinaryIO, job: Optional[ImportJob] = None,
+                       chunk_bytes: int = CSV_READ_CHUNK_BYTES) -> Iterator[str]:
+    """
+    分塊讀取位元組並增量解碼（處理 BOM 與被切斷的多位元組字元），逐行輸出（保留換行符號）
+
+    只以 "\\n" 切行，讓 csv 模組自行處理 "\\r\\n" 與引號內的換行
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    while True:
+        chunk = fileobj.read(chunk_bytes)
+        final = not chunk
+        if job is not None and chunk:
+            job.bytes_read += len(chunk)
+        try:
+            pending += decoder.decode(chunk, final=final)
+        except UnicodeDecodeError as e:
+            raise CSVValidationError(f"CSV 文件必須是 UTF-8 編碼（第 {job.bytes_read if job else '?'} 位元組附近：{e.reason}）")
+        start = 0
+        while True:
+            end = pending.find("\n", start)
+            if end < 0:
+                break
+            yield pending[start:end + 1]
+            start = end + 1
+        pending = pending[start:]
+        if final:
+            break
+    if pending:
+        yield pending
+
+
+def iter_csv_documents(lines: Iterator[str], source_id: str, job: ImportJob,
+                       max_title_length: int, max_content_length: int) -> Iterator[Dict]:
+    """逐行解析並驗證 CSV，輸出 bulk_insert_documents 使用的文檔 dict"""
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None or "id" not in reader.fieldnames or "text" not in reader.fieldnames:
+        raise CSVValidationError("CSV 文件必須包含 'id' 和 'text' 兩個欄位")
+
+    for idx, row in enumerate(reader, 1):
+        job.rows_read = idx
+        # id 作為資料名稱，source 使用文件名
+        doc_id = (row.get("id") or "").strip()
+        if not doc_id:
+            raise CSVValidationError(f"CSV 文件第 {idx} 行的 'id' 欄位不能為空")
+
+        text_content = (row.get("text") or "").strip()
+
+        # 驗證數據上限
+        if len(doc_id) > max_title_length:
+            raise CSVValidationError(
+                f"CSV 文件第 {idx} 行的標題過長，最多 {max_title_length} 字符（目前：{len(doc_id)} 字符）"
+            )
+        if len(text_content) > max_content_length:
+            raise CSVValidationError(
+                f"CSV 文件第 {idx} 行的內容過長，最多 {max_content_length} 字符（目前：{len(text_content)} 字符）"
+            )
+
+        # 與舊版相同：沒有內容的行略過
+        if not text_content:
+            continue
+        yield {
+            "title": doc_id,  # CSV 中的 id 作為資料名稱（title）
+            "content": text_content,
+            "category": "CSV導入",
+            "source": source_id,  # 文件名作為來源 ID
+        }
+
+
+def run_csv_import(fileobj: BinaryIO, job: ImportJob, max_title_length: int, max_content_length: int,
+                   batch_size: int = CSV_IMPORT_BATCH_SIZE) -> ImportJob:
+    """
+    執行串流匯入（同步函數，請在執行緒中呼叫）；錯誤會記錄在 job 並重新拋出
+    """
+    job.status = "running"
+
+    def on_chunk(inserted: int):
+        job.inserted = inserted
+
+    try:
+        lines = iter_decoded_lines(fileobj, job)
+        docs = iter_csv_documents(lines, job.source, job, max_title_length, max_content_length)
+        stats = bulk_insert_documents(docs, chunk_size=batch_size, atomic=True, on_chunk=on_chunk)
+        if stats["inserted"] + stats["duplicates"] == 0:
+            raise CSVValidationError("CSV 文件為空或格式錯誤")
+        stats.pop("chunks", None)  # 分塊明細可能很長，工作狀態只保留總計
+        job.stats = stats
+        job.status = "done"
+    except Exception as e:
+        # 整份檔案同一個交易，失敗時已全部回滾
+        job.inserted = 0
+        job.status = "failed"
+        job.error = str(e)
+        raise
+    finally:
+        job.finished_at = time.time()
+    return job
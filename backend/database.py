@@ -1,14 +1,67 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, delete, event, func, insert, or_, select, text, tuple_, update, Column, Float, Index, Integer, String, Text, DateTime, UniqueConstraint
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, List, Dict
+from itertools import islice
+from typing import Callable, Iterable, Optional, List, Dict, Tuple
+import asyncio
+import contextvars
+import functools
 import json
+import os
+import threading
+import time
+
+from dedup import content_hash
+from tracing import traced
 
 # SQLite 資料庫路徑
 DATABASE_URL = "sqlite:///./history_qa.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# 連線池與 SQLite 調校參數
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # 連線池大小（同時也是 DB 執行緒池大小）
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))  # 遇到寫入鎖時最多等待的毫秒數
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # 記憶體映射讀取（bytes）
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))  # 每個連線的 page cache（KB）
+BOT_CONFIG_CHECK_SECONDS = float(os.getenv("BOT_CONFIG_CHECK_SECONDS", "2"))  # 配置快取多久確認一次世代戳記
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))  # 批量匯入每個交易寫入的筆數
+BULK_REBUILD_INDEX_THRESHOLD = int(os.getenv("BULK_REBUILD_INDEX_THRESHOLD", "50000"))  # 超過此筆數時先移除 title/source 索引，匯入後重建
+
+def configure_sqlite_connection(dbapi_connection, connection_record=None):
+    """
+    每個新連線建立時套用的 PRAGMA
+    - WAL：讀取不會被寫入擋住，CSV 匯入時 /api/ask 仍可讀
+    - synchronous=NORMAL：WAL 模式下安全，且每次 commit 不必 fsync 主資料庫
+    - busy_timeout：寫入衝突時等待而不是立刻丟出 "database is locked"
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+
+def make_engine(url: str = DATABASE_URL, tuned: bool = True):
+    """建立 SQLite engine；tuned=False 時使用 SQLite 預設值（供基準測試比較）"""
+    new_engine = create_engine(
+        url,
+        connect_args={"check_same_thread": False},
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+    )
+    if tuned:
+        event.listen(new_engine, "connect", configure_sqlite_connection)
+    return new_engine
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -23,13 +76,19 @@ class QAPair(Base):
 class Document(Base):
     """歷史資料文檔表"""
     __tablename__ = "documents"
+    __table_args__ = (
+        # 同一分類內正規化內容唯一（content_hash 為 NULL 的文檔不受限制）
+        Index("ux_documents_category_content_hash", "category", "content_hash", unique=True),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)  # 文檔標題
     content = Column(Text)  # 文檔內容
-    category = Column(String, default="general")  # 分類（如：台灣史、中國史等）
+    category = Column(String, default="general", index=True)  # 分類（如：台灣史、中國史等）
     source = Column(String, index=True)  # 來源 ID（CSV 中的 id 欄位）
     embedding = Column(Text, nullable=True)  # 向量嵌入（JSON 格式）
+    content_hash = Column(String, nullable=True)  # 正規化內容的 SHA-1（見 dedup.py），用於去重
+    embedding_model = Column(String, nullable=True)  # 產生 embedding 的模型（與 EMBEDDING_MODEL 不同時會重新嵌入）
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
@@ -43,6 +102,95 @@ class BotConfig(Base):
     created_at = Column(DateTime, default=datetime.now)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
+class AppState(Base):
+    """全域狀態表（世代戳記等），用來讓多個 worker 判斷快取是否過期"""
+    __tablename__ = "app_state"
+    
+    key = Column(String, primary_key=True)
+    generation = Column(Integer, default=0)  # 每次相關資料變更時 +1
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+# 世代戳記名稱
+CORPUS_GENERATION = "corpus"  # 文檔內容（新增/刪除文檔時遞增）
+BOT_CONFIG_GENERATION = "bot_config"  # 機器人配置（更新角色設定、啟動重置時遞增）
+
+class ChatSession(Base):
+    """多輪對話 Session 表（近期對話 + 較早對話的摘要）"""
+    __tablename__ = "chat_sessions"
+    
+    session_id = Column(String, primary_key=True, index=True)
+    summary = Column(Text, default="")  # 較早對話壓縮後的摘要
+    turns = Column(Text, default="[]")  # 近期對話（JSON 格式）：[{"question": ..., "answer": ...}, ...]
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, index=True)
+
+class SourceAggregate(Base):
+    """
+    來源彙總表：每個 (category, source) 一列
+    - doc_count / total_chars 在文檔新增、刪除的同一個交易內增量更新
+    - titles / content 為合併後的標題列表與內容；來源有變動時設為 NULL（寫入端不讀回整個來源），
+      下次讀取時重新產生，並以 updated_at 作為版本戳記寫回（期間有其他寫入時放棄寫回）
+    """
+    __tablename__ = "sources"
+    __table_args__ = (UniqueConstraint("category", "source", name="uq_sources_category_source"),)
+    
+    id = Column(Integer, primary_key=True)
+    category = Column(String, nullable=False)
+    source = Column(String, nullable=False)  # 沒有來源的文檔記為空字串
+    doc_count = Column(Integer, default=0)
+    total_chars = Column(Integer, default=0)  # 所有文檔 content 的字元數總和
+    titles = Column(Text, nullable=True)  # JSON 標題列表（依文檔 id 排序）
+    content = Column(Text, nullable=True)  # 合併內容（"標題\n內容" 以空行串接）
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class EmbeddingQueue(Base):
+    """
+    待產生 embedding 的文檔佇列（由 documents 上的觸發器在新增/修改時寫入，見 EMBEDDING_QUEUE_TRIGGERS）
+    - version：文檔每次變更 +1；寫回 embedding 時比對 version，避免覆蓋掉處理期間的新內容
+    - not_before：重試退避或處理中租約到期的時間（epoch 秒），之前不會被其他 worker 取走
+    """
+    __tablename__ = "embedding_queue"
+    
+    doc_id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=1)
+    attempts = Column(Integer, default=0)
+    not_before = Column(Float, default=0)
+    last_error = Column(String, nullable=True)
+
+# documents 變更時自動排入 embedding 佇列（在同一個交易中，任何寫入路徑都不會漏掉）
+EMBEDDING_QUEUE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS documents_embedding_enqueue_insert AFTER INSERT ON documents
+    BEGIN
+        INSERT INTO embedding_queue (doc_id, version, attempts, not_before) VALUES (NEW.id, 1, 0, 0)
+        ON CONFLICT(doc_id) DO UPDATE SET version = version + 1, attempts = 0, not_before = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS documents_embedding_enqueue_update AFTER UPDATE OF title, content ON documents
+    WHEN OLD.title IS NOT NEW.title OR OLD.content IS NOT NEW.content
+    BEGIN
+        INSERT INTO embedding_queue (doc_id, version, attempts, not_before) VALUES (NEW.id, 1, 0, 0)
+        ON CONFLICT(doc_id) DO UPDATE SET version = version + 1, attempts = 0, not_before = 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS documents_embedding_dequeue_delete AFTER DELETE ON documents
+    BEGIN
+        DELETE FROM embedding_queue WHERE doc_id = OLD.id;
+    END
+    """,
+)
+
+# DB 專用執行緒池：async 端點透過 run_db 呼叫同步的資料庫函數，避免阻塞事件迴圈
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+async def run_db(func, *args, **kwargs):
+    """在 DB 執行緒池中執行同步的資料庫函數（保留 contextvars，追蹤 span 不會遺失）"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(DB_EXECUTOR, functools.partial(context.run, func, *args, **kwargs))
+
 def get_db():
     db = SessionLocal()
     try:
@@ -50,9 +198,118 @@ def get_db():
     finally:
         db.close()
 
+@traced("db.get_generation")
+def get_generation(key: str) -> int:
+    """讀取世代戳記（不存在時為 0）"""
+    db = SessionLocal()
+    try:
+        state = db.query(AppState).filter(AppState.key == key).first()
+        return state.generation if state else 0
+    finally:
+        db.close()
+
+def bump_generation(key: str, db=None) -> None:
+    """遞增世代戳記；傳入 db 時加入該交易（由呼叫端 commit），否則自行 commit"""
+    own_session = db is None
+    if own_session:
+        db = SessionLocal()
+    try:
+        # 以單一 UPSERT 原子遞增，避免多個 worker 同時寫入時互相覆蓋（同一交易內多次呼叫也安全）
+        now = datetime.now()
+        stmt = sqlite_insert(AppState.__table__).values(key=key, generation=1, updated_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[AppState.__table__.c.key],
+            set_={"generation": AppState.__table__.c.generation + 1, "updated_at": now},
+        )
+        db.execute(stmt)
+        if own_session:
+            db.commit()
+    finally:
+        if own_session:
+            db.close()
+
+def _add_column_if_missing(table: str, column: str, ddl_type: str) -> bool:
+    """舊資料庫遷移：欄位不存在時 ALTER TABLE 新增，回傳是否有新增"""
+    with engine.begin() as conn:
+        columns = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+        if column in columns:
+            return False
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+        return True
+
+def _migrate_embedding_model():
+    """
+    舊資料庫遷移：新增 documents.embedding_model
+    既有的 embedding 視為由目前設定的 EMBEDDING_MODEL 產生（之後換模型時會自動重新嵌入）
+    """
+    if not _add_column_if_missing("documents", "embedding_model", "VARCHAR"):
+        return
+    from embedding_service import EMBEDDING_MODEL
+    with engine.begin() as conn:
+        conn.execute(
+            update(Document).where(Document.embedding.isnot(None)).values(embedding_model=EMBEDDING_MODEL)
+        )
+
+def _migrate_content_hash(batch_size: int = 1000):
+    """
+    舊資料庫遷移：新增 documents.content_hash 欄位並回填
+    同分類中內容重複的文檔只有最早的一筆會寫入 hash，其餘維持 NULL（不刪除既有資料）
+    """
+    if not _add_column_if_missing("documents", "content_hash", "VARCHAR"):
+        return
+
+    seen = set()
+    duplicates = 0
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(Document.id, Document.category, Document.content)
+                .where(Document.id > last_id)
+                .order_by(Document.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            updates = []
+            for row in rows:
+                digest = content_hash(row.content)
+                if digest is None:
+                    continue
+                key = (row.category, digest)
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+                updates.append({"doc_id": row.id, "digest": digest})
+            if updates:
+                conn.execute(text("UPDATE documents SET content_hash = :digest WHERE id = :doc_id"), updates)
+            last_id = rows[-1].id
+    if duplicates:
+        print(f"⚠️  發現 {duplicates} 筆同分類內容重複的既有文檔（保留原資料，之後的匯入會自動略過重複內容）")
+
 def init_db():
     """初始化資料庫，建立表格並遷移現有表結構"""
     Base.metadata.create_all(bind=engine)
+    _migrate_content_hash()
+    _migrate_embedding_model()
+    with engine.begin() as conn:
+        for trigger in EMBEDDING_QUEUE_TRIGGERS:
+            conn.execute(text(trigger))
+    # create_all 不會替既有的表補上新索引（例如 ix_documents_category），這裡逐一補齊
+    with engine.begin() as conn:
+        for index in Document.__table__.indexes:
+            index.create(conn, checkfirst=True)
+    # 來源彙總表與文檔數不一致時（例如升級前已有的資料）整個重建
+    db = SessionLocal()
+    try:
+        doc_total = db.execute(select(func.count(Document.id))).scalar_one()
+        aggregated = db.execute(select(func.coalesce(func.sum(SourceAggregate.doc_count), 0))).scalar_one()
+        if doc_total != aggregated:
+            rebuild_sources(db)
+            db.commit()
+    finally:
+        db.close()
     
     # 每次啟動時重置機器人配置為默認值
     db = SessionLocal()
@@ -75,9 +332,12 @@ def init_db():
             config.role_description = default_role_description
             config.updated_at = datetime.now()
         
+        # 配置被重置，通知其他 worker 的配置快取失效
+        bump_generation(BOT_CONFIG_GENERATION, db)
         db.commit()
     finally:
         db.close()
+    bot_config_cache.invalidate()
     
     # 不再需要 embedding 列，已移除向量搜索功能
     
@@ -103,6 +363,7 @@ def get_answer_from_db(question: str) -> Optional[str]:
     finally:
         db.close()
 
+@traced("db.search_documents")
 def search_documents(question: str, limit: int = None, use_embedding: bool = True) -> List[Dict]:
     """
     從資料庫搜尋相關文檔段落（僅使用向量相似度搜索）
@@ -225,9 +486,93 @@ def search_documents(question: str, limit: int = None, use_embedding: bool = Tru
     finally:
         db.close()
 
+def _document_row(title: str, content: str, category: str, source: str) -> Dict:
+    return {
+        "title": title or f"資料-{source}",
+        "content": content,
+        "category": category or "general",
+        "source": source,
+        "embedding": None,  # 不再生成 embedding
+        "content_hash": content_hash(content),
+    }
+
+def _insert_document_rows(db, rows: List[Dict], want_ids: bool = False) -> Tuple[List[int], int]:
+    """
+    在呼叫端的交易中寫入一批文檔列（_document_row 的結果），並更新來源彙總
+    同分類內正規化內容相同的列不會重複寫入（INSERT ... ON CONFLICT DO NOTHING），而是連結到既有文檔
+
+    Returns:
+        (依輸入順序的文檔 ID，重複的列為既有文檔的 ID；want_ids=False 時為空列表, 實際新增筆數)
+    """
+    table = Document.__table__
+    hashed: List[Dict] = []
+    unhashed: List[Dict] = []
+    seen = set()
+    for row in rows:
+        if row["content_hash"] is None:
+            unhashed.append(row)  # 正規化後沒有內容，不參與去重
+            continue
+        key = (row["category"], row["content_hash"])
+        if key not in seen:
+            seen.add(key)
+            hashed.append(row)
+
+    deltas: Dict = {}
+
+    def add_delta(category, source, chars):
+        key = (category, source or "")
+        count, total = deltas.get(key, (0, 0))
+        deltas[key] = (count + 1, total + (chars or 0))
+
+    key_to_id: Dict[Tuple[str, str], int] = {}
+    inserted = 0
+    if hashed:
+        stmt = sqlite_insert(table).on_conflict_do_nothing().returning(
+            table.c.id, table.c.category, table.c.source, table.c.content_hash,
+            func.length(table.c.content).label("chars"),
+        )
+        for row in db.execute(stmt, hashed):
+            key_to_id[(row.category, row.content_hash)] = row.id
+            add_delta(row.category, row.source, row.chars)
+            inserted += 1
+
+    unhashed_ids: List[int] = []
+    if unhashed:
+        stmt = insert(table)
+        if want_ids:
+            stmt = stmt.returning(table.c.id, sort_by_parameter_order=True)
+            unhashed_ids = db.execute(stmt, unhashed).scalars().all()
+        else:
+            db.execute(stmt, unhashed)
+        for row in unhashed:
+            add_delta(row["category"], row["source"], len(row["content"] or ""))
+        inserted += len(unhashed)
+
+    if deltas:
+        _apply_source_deltas(db, deltas)
+
+    if not want_ids:
+        return [], inserted
+
+    missing = list({(row["category"], row["content_hash"]) for row in hashed} - key_to_id.keys())
+    for offset in range(0, len(missing), 500):
+        batch = missing[offset:offset + 500]
+        for row in db.execute(
+            select(Document.id, Document.category, Document.content_hash)
+            .where(tuple_(Document.category, Document.content_hash).in_(batch))
+        ):
+            key_to_id[(row.category, row.content_hash)] = row.id
+    unhashed_iter = iter(unhashed_ids)
+    ids = [
+        key_to_id.get((row["category"], row["content_hash"])) if row["content_hash"] else next(unhashed_iter)
+        for row in rows
+    ]
+    return ids, inserted
+
+@traced("db.add_document")
 def add_document(title: str, content: str, category: str = "general", source: str = ""):
     """
-    新增文檔到資料庫
+    新增文檔到資料庫（同分類已有相同內容時不重複新增，回傳既有文檔的 ID）
     
     Args:
         title: 文檔標題
@@ -240,22 +585,133 @@ def add_document(title: str, content: str, category: str = "general", source: st
     """
     db = SessionLocal()
     try:
-        doc = Document(
-            title=title or f"資料-{source}",
-            content=content,
-            category=category,
-            source=source,
-            embedding=None  # 不再生成 embedding
-        )
-        db.add(doc)
+        ids, inserted = _insert_document_rows(db, [_document_row(title, content, category, source)], want_ids=True)
+        if inserted:
+            bump_generation(CORPUS_GENERATION, db)
         db.commit()
-        return doc.id
+        return ids[0]
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+@traced("db.find_duplicate_document")
+def find_duplicate_document(content: str, category: str = "general") -> Optional[int]:
+    """同分類中正規化內容相同的文檔 ID（沒有時回傳 None）"""
+    digest = content_hash(content)
+    if digest is None:
+        return None
+    db = SessionLocal()
+    try:
+        return db.execute(
+            select(Document.id).where(Document.category == category, Document.content_hash == digest)
+        ).scalar()
     finally:
         db.close()
 
+# 大量匯入時暫時移除的索引（主鍵索引保留）
+BULK_DEFERRED_INDEXES = ("ix_documents_title", "ix_documents_source")
+
+@traced("db.bulk_insert_documents")
+def bulk_insert_documents(
+    docs: Iterable[Dict],
+    chunk_size: int = BULK_CHUNK_SIZE,
+    atomic: bool = False,
+    rebuild_indexes: Optional[bool] = None,
+    return_ids: bool = False,
+    on_chunk: Optional[Callable[[int], None]] = None,
+) -> Dict:
+    """
+    以 Core executemany 批量新增文檔（不經過 ORM 物件）
+    同分類內正規化內容相同的文檔會略過（計入 duplicates），ID 連結到既有文檔
+
+    Args:
+        docs: [{"title": str, "content": str, "category": str, "source": str}, ...]
+              也可以是產生器（例如串流解析 CSV），一次只會取出 chunk_size 筆
+        chunk_size: 每個交易寫入的筆數
+        atomic: True 時所有分塊在同一個交易中（任何一塊失敗就全部回滾）；
+                False 時每塊各自 commit，失敗只影響當前與之後的分塊
+        rebuild_indexes: 是否在匯入前移除 title/source 索引、匯入後重建；
+                         None 時筆數超過 BULK_REBUILD_INDEX_THRESHOLD 才啟用（產生器無法預知筆數，不啟用）
+        return_ids: 是否回傳文檔 ID（依輸入順序；重複內容為既有文檔的 ID）
+        on_chunk: 每寫入一塊後呼叫 on_chunk(累計筆數)，用來回報進度
+
+    Returns:
+        {"inserted": int, "duplicates": int, "seconds": float, "rows_per_sec": float, "indexes_rebuilt": bool,
+         "chunks": [{"rows": int, "inserted": int, "seconds": float, "rows_per_sec": float}, ...], "ids": [...]}
+    """
+    chunk_size = max(1, chunk_size)
+    if rebuild_indexes is None:
+        rebuild_indexes = isinstance(docs, list) and len(docs) >= BULK_REBUILD_INDEX_THRESHOLD
+    if isinstance(docs, list) and not docs:
+        rebuild_indexes = False
+    docs = iter(docs)
+
+    deferred = [index for index in Document.__table__.indexes if index.name in BULK_DEFERRED_INDEXES]
+
+    stats = {"inserted": 0, "duplicates": 0, "chunks": [], "indexes_rebuilt": False}
+    ids: List[int] = []
+    started = time.perf_counter()
+
+    if rebuild_indexes:
+        with engine.begin() as conn:
+            for index in deferred:
+                index.drop(conn, checkfirst=True)
+    try:
+        db = SessionLocal()
+        try:
+            while True:
+                chunk_started = time.perf_counter()
+                rows = [
+                    _document_row(doc.get("title"), doc.get("content", ""), doc.get("category"), doc.get("source", ""))
+                    for doc in islice(docs, chunk_size)
+                ]
+                if not rows:
+                    break
+                chunk_ids, inserted = _insert_document_rows(db, rows, want_ids=return_ids)
+                ids.extend(chunk_ids)
+                if inserted and not atomic:
+                    bump_generation(CORPUS_GENERATION, db)
+                if not atomic:
+                    db.commit()
+
+                elapsed = time.perf_counter() - chunk_started
+                stats["inserted"] += inserted
+                stats["duplicates"] += len(rows) - inserted
+                stats["chunks"].append({
+                    "rows": len(rows),
+                    "inserted": inserted,
+                    "seconds": round(elapsed, 4),
+                    "rows_per_sec": round(len(rows) / elapsed, 1) if elapsed > 0 else None,
+                })
+                if on_chunk:
+                    on_chunk(stats["inserted"])
+            if atomic and stats["inserted"]:
+                bump_generation(CORPUS_GENERATION, db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    finally:
+        if rebuild_indexes:
+            with engine.begin() as conn:
+                for index in deferred:
+                    index.create(conn, checkfirst=True)
+            stats["indexes_rebuilt"] = True
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 4)
+    stats["rows_per_sec"] = round(stats["inserted"] / elapsed, 1) if elapsed > 0 else None
+    if return_ids:
+        stats["ids"] = ids
+    return stats
+
 def batch_add_documents_from_csv(rows: List[Dict[str, str]], generate_embeddings: bool = False) -> int:
     """
-    批量從 CSV 資料新增文檔
+    批量從 CSV 資料新增文檔（整份 CSV 在同一個交易中匯入）
     
     Args:
         rows: [{"id": "doc_title", "source": "source_id", "text": "content"}, ...]
@@ -267,131 +723,442 @@ def batch_add_documents_from_csv(rows: List[Dict[str, str]], generate_embeddings
     Returns:
         新增的文檔數量
     """
-    db = SessionLocal()
-    try:
-        count = 0
-        
-        # 準備文檔數據並直接添加到資料庫
-        for row in rows:
-            doc_title = row.get("id", "").strip()
-            source_id = row.get("source", "").strip()
-            text = row.get("text", "").strip()
-            
-            if doc_title and text and source_id:
-                doc = Document(
-                    title=doc_title,
-                    content=text,
-                    category="CSV導入",
-                    source=source_id,
-                    embedding=None  # 不再生成 embedding
-                )
-                db.add(doc)
-                count += 1
+    docs = []
+    for row in rows:
+        doc_title = row.get("id", "").strip()
+        source_id = row.get("source", "").strip()
+        text = row.get("text", "").strip()
         
+        if doc_title and text and source_id:
+            docs.append({
+                "title": doc_title,
+                "content": text,
+                "category": "CSV導入",
+                "source": source_id,
+            })
+    
+    if not docs:
+        return 0
+    return bulk_insert_documents(docs, atomic=True)["inserted"]
+
+# ============== embedding 佇列 ==============
+
+@traced("db.enqueue_stale_embeddings")
+def enqueue_stale_embeddings(model: str, reset_failed: bool = False) -> int:
+    """
+    把 embedding_model 與目前模型不同（含尚未嵌入）的文檔排入佇列，回傳排入（或重設）數量
+    reset_failed=True 時，已在佇列中的文檔也重設重試次數
+    """
+    on_conflict = "DO UPDATE SET attempts = 0, not_before = 0" if reset_failed else "DO NOTHING"
+    with engine.begin() as conn:
+        result = conn.execute(
+            text(
+                "INSERT INTO embedding_queue (doc_id, version, attempts, not_before) "
+                "SELECT id, 1, 0, 0 FROM documents WHERE embedding_model IS NOT :model "
+                f"ON CONFLICT(doc_id) {on_conflict}"
+            ),
+            {"model": model},
+        )
+        return result.rowcount
+
+@traced("db.claim_embedding_batch")
+def claim_embedding_batch(limit: int, lease_seconds: float, max_attempts: int) -> List[Dict]:
+    """
+    取走一批待處理文檔（設定租約，期間其他 worker 不會重複處理）
+
+    Returns:
+        [{"doc_id": int, "version": int, "text": str}, ...]
+    """
+    now = time.time()
+    with engine.begin() as conn:
+        claimed = conn.execute(
+            text(
+                "UPDATE embedding_queue SET not_before = :lease_until "
+                "WHERE doc_id IN (SELECT doc_id FROM embedding_queue "
+                "WHERE not_before <= :now AND attempts < :max_attempts ORDER BY doc_id LIMIT :limit) "
+                "RETURNING doc_id, version"
+            ),
+            {"lease_until": now + lease_seconds, "now": now, "max_attempts": max_attempts, "limit": limit},
+        ).all()
+        if not claimed:
+            return []
+        versions = {row.doc_id: row.version for row in claimed}
+        docs = conn.execute(
+            select(Document.id, Document.title, Document.content).where(Document.id.in_(versions))
+        ).all()
+    return [
+        {"doc_id": doc.id, "version": versions[doc.id], "text": f"{doc.title or ''} {doc.content or ''}".strip()}
+        for doc in docs
+    ]
+
+@traced("db.complete_embedding_batch")
+def complete_embedding_batch(results: List[Dict], model: str) -> int:
+    """
+    以 executemany 批量寫回 embedding 並移出佇列
+    results: [{"doc_id": int, "version": int, "embedding": Optional[List[float]]}, ...]
+    （embedding 為 None 代表沒有內容可嵌入，仍記錄模型以免重複排入）
+    只有佇列中的 version 仍相同時才寫入；處理期間文檔又被修改的話留待下一輪
+    """
+    if not results:
+        return 0
+    params = [
+        {
+            "doc_id": item["doc_id"],
+            "version": item["version"],
+            "embedding": json.dumps(item["embedding"]) if item["embedding"] is not None else None,
+            "model": model,
+        }
+        for item in results
+    ]
+    with engine.begin() as conn:
+        updated = conn.execute(
+            text(
+                "UPDATE documents SET embedding = :embedding, embedding_model = :model "
+                "WHERE id = :doc_id AND EXISTS (SELECT 1 FROM embedding_queue "
+                "WHERE doc_id = :doc_id AND version = :version)"
+            ),
+            params,
+        ).rowcount
+        conn.execute(
+            text("DELETE FROM embedding_queue WHERE doc_id = :doc_id AND version = :version"),
+            [{"doc_id": p["doc_id"], "version": p["version"]} for p in params],
+        )
+    return updated
+
+def release_embedding_batch(items: List[Dict], retry_at: float, error: str, count_attempt: bool = True):
+    """處理失敗：設定下次重試時間（count_attempt=False 時不計入失敗次數，例如服務暫時無法連線）"""
+    if not items:
+        return
+    attempts = "attempts + 1" if count_attempt else "attempts"
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                f"UPDATE embedding_queue SET attempts = {attempts}, not_before = :retry_at, last_error = :error "
+                "WHERE doc_id = :doc_id AND version = :version"
+            ),
+            [
+                {"doc_id": item["doc_id"], "version": item["version"], "retry_at": retry_at, "error": error[:500]}
+                for item in items
+            ],
+        )
+
+def embedding_queue_stats(max_attempts: int) -> Dict[str, int]:
+    """佇列統計：pending 待處理、failed 已達重試上限"""
+    with engine.connect() as conn:
+        pending, failed = conn.execute(
+            select(
+                func.count().filter(EmbeddingQueue.attempts < max_attempts),
+                func.count().filter(EmbeddingQueue.attempts >= max_attempts),
+            )
+        ).one()
+    return {"pending": pending, "failed": failed}
+
+# ============== 來源彙總 ==============
+
+def _source_criteria(category: str, source: str) -> List:
+    """對應彙總表的 (category, source)；空字串來源同時涵蓋 NULL"""
+    if source:
+        return [Document.category == category, Document.source == source]
+    return [Document.category == category, or_(Document.source.is_(None), Document.source == "")]
+
+def _source_delta_upsert():
+    table = SourceAggregate.__table__
+    stmt = sqlite_insert(table)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.category, table.c.source],
+        set_={
+            "doc_count": table.c.doc_count + stmt.excluded.doc_count,
+            "total_chars": table.c.total_chars + stmt.excluded.total_chars,
+            "titles": None,
+            "content": None,
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+# 以 executemany 一次套用所有來源的增量（固定的語句可重用編譯快取）
+_SOURCE_DELTA_UPSERT = _source_delta_upsert()
+
+def _apply_source_deltas(db, deltas: Dict) -> None:
+    """
+    在呼叫端的交易中套用彙總增量：deltas = {(category, source): (文檔數增量, 字元數增量)}
+    受影響的來源會把 titles/content 設為 NULL，等下次讀取時重新產生
+    （不在寫入端重建：每個分塊都讀回整個來源會讓串流匯入變成二次方）
+    """
+    if not deltas:
+        return
+    now = datetime.now()
+    db.execute(_SOURCE_DELTA_UPSERT, [
+        {"category": category, "source": source, "doc_count": count, "total_chars": chars, "updated_at": now}
+        for (category, source), (count, chars) in deltas.items()
+    ])
+    if any(count < 0 for count, _ in deltas.values()):
+        db.execute(delete(SourceAggregate).where(SourceAggregate.doc_count <= 0))
+
+def rebuild_sources(db) -> None:
+    """由 documents 表整個重建彙總表（只計算數量，titles/content 讀取時再產生）"""
+    db.execute(delete(SourceAggregate))
+    source_key = func.coalesce(Document.source, "")
+    grouped = select(
+        Document.category,
+        source_key,
+        func.count(Document.id),
+        func.coalesce(func.sum(func.length(Document.content)), 0),
+    ).group_by(Document.category, source_key)
+    db.execute(
+        insert(SourceAggregate).from_select(["category", "source", "doc_count", "total_chars"], grouped)
+    )
+
+def _build_source(db, category: str, source: str) -> Tuple[List[str], str]:
+    """產生單一來源的標題列表與合併內容（只讀取）"""
+    docs = db.execute(
+        select(Document.title, Document.content)
+        .where(*_source_criteria(category, source))
+        .order_by(Document.id)
+    ).all()
+    titles = [doc.title for doc in docs if doc.title]
+    content = "\n\n".join(
+        f"{doc.title}\n{doc.content}" if doc.title else doc.content
+        for doc in docs
+        if doc.content
+    )
+    return titles, content
+
+def _write_back_sources(db, built: List[Tuple]) -> None:
+    """
+    把讀取時產生的 titles/content 寫回彙總表（在自己的短交易中）
+    只更新 updated_at 仍與讀取時相同的列：期間有寫入的來源維持 NULL，由下一次讀取重新產生；
+    其他連線正在寫入（例如整份 CSV 的匯入交易）時直接放棄，不影響這次讀取的結果
+    """
+    try:
+        for aggregate_id, stamp, titles, content in built:
+            db.execute(
+                update(SourceAggregate)
+                .where(SourceAggregate.id == aggregate_id, SourceAggregate.updated_at == stamp)
+                .values(titles=json.dumps(titles, ensure_ascii=False), content=content)
+            )
         db.commit()
-        return count
-    except Exception as e:
+    except OperationalError as e:
         db.rollback()
-        raise e
+        print(f"[SOURCES] 略過合併內容的寫回（資料庫忙碌中）：{e}")
+
+@traced("db.get_source_documents")
+def get_source_documents(category: Optional[str] = None) -> List[Dict]:
+    """
+    以來源為單位回傳合併後的文檔（給 AI 使用）
+    category 為 None 時包含所有分類（同名來源跨分類時合併為一筆）
+
+    Returns:
+        [{"source": str, "title": str, "content": str, "doc_titles": List[str]}, ...]
+    """
+    db = SessionLocal()
+    try:
+        stmt = select(SourceAggregate).order_by(SourceAggregate.id)
+        if category is not None:
+            stmt = stmt.where(SourceAggregate.category == category)
+        aggregates = db.execute(stmt).scalars().all()
+
+        merged: Dict[str, Dict] = {}
+        built: List[Tuple] = []
+        for aggregate in aggregates:
+            if aggregate.titles is None or aggregate.content is None:
+                titles, content = _build_source(db, aggregate.category, aggregate.source)
+                built.append((aggregate.id, aggregate.updated_at, titles, content))
+            else:
+                titles, content = json.loads(aggregate.titles), aggregate.content
+            source_id = aggregate.source or "unknown"
+            entry = merged.setdefault(source_id, {"source": source_id, "content": "", "doc_titles": []})
+            entry["doc_titles"].extend(titles)
+            if content:
+                entry["content"] = f"{entry['content']}\n\n{content}" if entry["content"] else content
+        if built:
+            _write_back_sources(db, built)
+
+        for entry in merged.values():
+            all_titles = entry["doc_titles"]
+            entry["title"] = ", ".join(all_titles[:5]) if all_titles else "無標題"
+        return list(merged.values())
     finally:
         db.close()
 
-def get_all_documents():
-    """獲取所有文檔列表"""
+@traced("db.list_sources")
+def list_sources(category: Optional[str] = None) -> List[Dict]:
+    """來源清單與統計（不含內容）"""
     db = SessionLocal()
     try:
-        docs = db.query(Document).all()
-        return [{
-            "id": doc.id,
-            "title": doc.title,
-            "category": doc.category,
-            "source": doc.source,
-            "created_at": doc.created_at.isoformat() if doc.created_at else None
-        } for doc in docs]
+        stmt = select(
+            SourceAggregate.category, SourceAggregate.source, SourceAggregate.doc_count, SourceAggregate.total_chars
+        ).order_by(SourceAggregate.id)
+        if category is not None:
+            stmt = stmt.where(SourceAggregate.category == category)
+        return [
+            {"category": row.category, "source": row.source, "doc_count": row.doc_count, "total_chars": row.total_chars}
+            for row in db.execute(stmt)
+        ]
     finally:
         db.close()
 
-def get_all_documents_with_content():
-    """獲取所有文檔及其內容（用於 Gemini API）"""
+# ============== 刪除 ==============
+
+# 文檔刪除時在同一個交易內呼叫的鉤子：hook(db, rows)
+# rows 為被刪除文檔的 [(id, category, source, chars), ...]；清空全部時為 None
+# 衍生的索引/彙總表以此依被刪除的 ID 增量更新，而不是整個重建
+DOCUMENT_DELETE_HOOKS: List[Callable] = []
+
+def register_document_delete_hook(hook: Callable) -> Callable:
+    DOCUMENT_DELETE_HOOKS.append(hook)
+    return hook
+
+@register_document_delete_hook
+def _update_sources_on_delete(db, rows) -> None:
+    if rows is None:
+        db.execute(delete(SourceAggregate))
+        return
+    deltas: Dict = {}
+    for row in rows:
+        key = (row.category, row.source or "")
+        count, chars = deltas.get(key, (0, 0))
+        deltas[key] = (count - 1, chars - (row.chars or 0))
+    _apply_source_deltas(db, deltas)
+
+def _delete_documents_where(db, *criteria) -> List:
+    """以單一 DELETE ... RETURNING 刪除符合條件的文檔（不載入 content/embedding），回傳被刪除的列"""
+    stmt = delete(Document).where(*criteria).returning(
+        Document.id, Document.category, Document.source, func.length(Document.content).label("chars")
+    )
+    rows = db.execute(stmt).all()
+    if rows:
+        for hook in DOCUMENT_DELETE_HOOKS:
+            hook(db, rows)
+        bump_generation(CORPUS_GENERATION, db)
+    return rows
+
+@traced("db.delete_document")
+def delete_document(doc_id: int) -> bool:
+    """刪除指定文檔，回傳是否有刪除"""
     db = SessionLocal()
     try:
-        docs = db.query(Document).all()
-        # 按來源分組
-        source_map = {}
-        for doc in docs:
-            source_id = doc.source or "unknown"
-            if source_id not in source_map:
-                source_map[source_id] = []
-            source_map[source_id].append({
-                "title": doc.title,
-                "content": doc.content or ""
-            })
-        
-        # 轉換為列表格式
-        result = []
-        for source_id, doc_list in source_map.items():
-            # 合併同一來源的所有內容
-            all_titles = [d["title"] for d in doc_list if d["title"]]
-            all_content = "\n\n".join([
-                f"{d['title']}\n{d['content']}" if d['title'] else d['content']
-                for d in doc_list
-                if d['content']
-            ])
-            
-            result.append({
-                "source": source_id,
-                "title": ", ".join(all_titles[:5]) if all_titles else "無標題",
-                "content": all_content,
-                "doc_titles": all_titles
-            })
-        
-        return result
+        rows = _delete_documents_where(db, Document.id == doc_id)
+        db.commit()
+        return bool(rows)
+    except Exception:
+        db.rollback()
+        raise
     finally:
         db.close()
 
+@traced("db.delete_documents_by_source")
+def delete_documents_by_source(source_id: str) -> int:
+    """刪除某個來源的所有文檔，回傳刪除數量"""
+    db = SessionLocal()
+    try:
+        rows = _delete_documents_where(db, Document.source == source_id)
+        db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
-def get_elderly_documents_with_content():
-    """只獲取老人訪談文檔（category=elderly_interview），按來源合併內容"""
+@traced("db.clear_all_documents")
+def clear_all_documents() -> Dict[str, int]:
+    """清空所有文檔和問答對，回傳 {"doc_count": int, "qa_count": int}"""
     db = SessionLocal()
     try:
-        docs = db.query(Document).filter(Document.category == "elderly_interview").all()
-        if not docs:
-            return []
+        # 全部刪除時不需要逐筆 RETURNING，直接取 rowcount
+        doc_count = db.execute(delete(Document)).rowcount
+        qa_count = db.execute(delete(QAPair)).rowcount
+        if doc_count:
+            for hook in DOCUMENT_DELETE_HOOKS:
+                hook(db, None)
+        bump_generation(CORPUS_GENERATION, db)
+        db.commit()
+        return {"doc_count": doc_count, "qa_count": qa_count}
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
 
-        source_map: Dict[str, List[Dict[str, str]]] = {}
-        for doc in docs:
-            source_id = doc.source or "unknown"
-            if source_id not in source_map:
-                source_map[source_id] = []
-            source_map[source_id].append(
-                {
-                    "title": doc.title,
-                    "content": doc.content or "",
-                }
-            )
+DOCUMENT_LIST_COLUMNS = (Document.id, Document.title, Document.category, Document.source, Document.created_at)
 
-        result = []
-        for source_id, doc_list in source_map.items():
-            all_titles = [d["title"] for d in doc_list if d["title"]]
-            all_content = "\n\n".join(
-                f"{d['title']}\n{d['content']}" if d["title"] else d["content"]
-                for d in doc_list
-                if d["content"]
-            )
+def _document_filters(category: Optional[str], source: Optional[str], search: Optional[str] = None) -> List:
+    criteria = []
+    if category is not None:
+        criteria.append(Document.category == category)
+    if source is not None:
+        criteria.append(Document.source == source)
+    if search:
+        # 標題或來源的部分比對（跳脫 LIKE 萬用字元）
+        pattern = "%" + search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        criteria.append(or_(Document.title.like(pattern, escape="\\"), Document.source.like(pattern, escape="\\")))
+    return criteria
 
-            result.append(
-                {
-                    "source": source_id,
-                    "title": ", ".join(all_titles[:5]) if all_titles else "無標題",
-                    "content": all_content,
-                    "doc_titles": all_titles,
-                }
-            )
+@traced("db.list_documents")
+def list_documents(
+    after_id: int = 0,
+    limit: Optional[int] = None,
+    category: Optional[str] = None,
+    source: Optional[str] = None,
+    search: Optional[str] = None,
+) -> List[Dict]:
+    """
+    文檔列表（keyset 分頁，只查詢列表需要的欄位，不載入 content/embedding）
 
-        return result
+    以 id 遞增排序，下一頁傳入本頁最後一筆的 id 作為 after_id；
+    category/source 各有索引（SQLite 索引隱含 rowid），篩選後依 id 掃描不需額外排序；
+    search 為標題/來源的部分比對
+    """
+    stmt = select(*DOCUMENT_LIST_COLUMNS).where(Document.id > after_id, *_document_filters(category, source, search))
+    stmt = stmt.order_by(Document.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    db = SessionLocal()
+    try:
+        return [{
+            "id": row.id,
+            "title": row.title,
+            "category": row.category,
+            "source": row.source,
+            "created_at": row.created_at.isoformat() if row.created_at else None
+        } for row in db.execute(stmt)]
+    finally:
+        db.close()
+
+@traced("db.count_documents")
+def count_documents(category: Optional[str] = None, source: Optional[str] = None,
+                    search: Optional[str] = None) -> int:
+    """符合條件的文檔數（不帶 search 時只掃描索引）"""
+    db = SessionLocal()
+    try:
+        stmt = select(func.count(Document.id)).where(*_document_filters(category, source, search))
+        return db.execute(stmt).scalar_one()
+    finally:
+        db.close()
+
+@traced("db.list_categories")
+def list_categories() -> List[str]:
+    """所有文檔分類（走 ix_documents_category 索引）"""
+    db = SessionLocal()
+    try:
+        return list(db.execute(select(Document.category).distinct().order_by(Document.category)).scalars())
     finally:
         db.close()
 
+def get_all_documents():
+    """獲取所有文檔列表"""
+    return list_documents()
+
+@traced("db.get_all_documents_with_content")
+def get_all_documents_with_content():
+    """獲取所有文檔及其內容（用於 Gemini API），按來源合併"""
+    return get_source_documents()
+
+@traced("db.get_elderly_documents")
+def get_elderly_documents_with_content():
+    """只獲取老人訪談文檔（category=elderly_interview），按來源合併內容"""
+    return get_source_documents("elderly_interview")
+
 def get_document_by_id(doc_id: int) -> Optional[Dict]:
     """根據 ID 獲取單個文檔的詳細內容"""
     db = SessionLocal()
@@ -421,8 +1188,9 @@ def add_qa_pair(question: str, answer: str, category: str = "general"):
     finally:
         db.close()
 
-def get_bot_config() -> Dict:
-    """獲取機器人配置（角色/身份）"""
+@traced("db.get_bot_config")
+def _load_bot_config() -> Dict:
+    """從資料庫讀取機器人配置（角色/身份）"""
     db = SessionLocal()
     try:
         config = db.query(BotConfig).first()
@@ -439,6 +1207,67 @@ def get_bot_config() -> Dict:
     finally:
         db.close()
 
+
+class BotConfigCache:
+    """
+    行程內的機器人配置快取
+
+    - 配置只會透過 update_bot_config / init_db 改變，兩者都會遞增 app_state 的 bot_config 世代戳記
+    - 距離上次確認不到 check_interval 秒時直接回傳快取（不碰資料庫）
+    - 超過後只讀一次世代戳記（主鍵查詢），戳記沒變就沿用快取，變了才重新讀取 BotConfig
+    - 多個 uvicorn worker 之間最多延遲 check_interval 秒看到新配置；本行程的更新則立即生效
+    """
+
+    def __init__(self, check_interval: float = BOT_CONFIG_CHECK_SECONDS):
+        self.check_interval = check_interval
+        self._config: Optional[Dict] = None
+        self._generation = -1
+        self._checked_at = 0.0
+        self._invalidations = 0  # invalidate() 的次數，用來丟棄讀取途中被作廢的結果
+        self._lock = threading.Lock()
+
+    def peek(self) -> Optional[Dict]:
+        """快取仍在確認間隔內時回傳配置副本，否則回傳 None（呼叫端再改用 get）"""
+        with self._lock:
+            if self._config is not None and time.monotonic() - self._checked_at < self.check_interval:
+                return dict(self._config)
+        return None
+
+    def get(self) -> Dict:
+        config = self.peek()
+        if config is not None:
+            return config
+
+        now = time.monotonic()
+        with self._lock:
+            invalidations = self._invalidations
+        # 先讀戳記再讀配置：若兩者之間剛好有更新，記下的是舊戳記，下次確認時會再重新讀取
+        generation = get_generation(BOT_CONFIG_GENERATION)
+        with self._lock:
+            if self._config is not None and generation == self._generation:
+                self._checked_at = now
+                return dict(self._config)
+
+        config = _load_bot_config()
+        with self._lock:
+            # 讀取途中本行程有更新（invalidate）時不寫回，避免舊配置蓋掉作廢狀態
+            if invalidations == self._invalidations:
+                self._config, self._generation, self._checked_at = config, generation, now
+        return dict(config)
+
+    def invalidate(self):
+        with self._lock:
+            self._config = None
+            self._invalidations += 1
+
+
+bot_config_cache = BotConfigCache()
+
+
+def get_bot_config() -> Dict:
+    """獲取機器人配置（角色/身份），經由行程內快取"""
+    return bot_config_cache.get()
+
 def update_bot_config(role_name: str, role_description: str = None):
     """更新機器人配置（角色/身份）"""
     db = SessionLocal()
@@ -452,7 +1281,55 @@ def update_bot_config(role_name: str, role_description: str = None):
             if role_description is not None:
                 config.role_description = role_description
             config.updated_at = datetime.now()
+        bump_generation(BOT_CONFIG_GENERATION, db)
+        db.commit()
+    finally:
+        db.close()
+    bot_config_cache.invalidate()
+
+
+@traced("db.load_chat_session")
+def load_chat_session(session_id: str) -> Optional[Dict]:
+    """讀取對話 Session（不存在時回傳 None）"""
+    db = SessionLocal()
+    try:
+        row = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        if not row:
+            return None
+        return {
+            "session_id": row.session_id,
+            "summary": row.summary or "",
+            "turns": json.loads(row.turns or "[]"),
+            "updated_at": row.updated_at,
+        }
+    finally:
+        db.close()
+
+@traced("db.save_chat_session")
+def save_chat_session(session_id: str, summary: str, turns: List[Dict]):
+    """新增或更新對話 Session"""
+    db = SessionLocal()
+    try:
+        row = db.query(ChatSession).filter(ChatSession.session_id == session_id).first()
+        if not row:
+            row = ChatSession(session_id=session_id)
+            db.add(row)
+        row.summary = summary
+        row.turns = json.dumps(turns, ensure_ascii=False)
+        row.updated_at = datetime.now()
         db.commit()
     finally:
         db.close()
 
+def delete_chat_sessions(older_than: Optional[datetime] = None) -> int:
+    """刪除對話 Session（指定 older_than 時只刪除過期的），回傳刪除數量"""
+    db = SessionLocal()
+    try:
+        query = db.query(ChatSession)
+        if older_than is not None:
+            query = query.filter(ChatSession.updated_at < older_than)
+        count = query.delete(synchronize_session=False)
+        db.commit()
+        return count
+    finally:
+        db.close()
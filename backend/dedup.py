@@ -0,0 +1,94 @@
+"""
+內容去重工具
+
+- normalize_text / content_hash：去除空白、標點與全半形差異後取 SHA-1，
+  用於 documents.content_hash（同分類內唯一），重新上傳同一份 CSV 或換檔名的 PDF 不會產生重複文檔
+- simhash / SimHashIndex：片段層級的近似重複偵測（字元 shingle + 64 位元 SimHash），
+  逐字稿中重複出現的段落在組 prompt 時只保留一次
+"""
+import hashlib
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3  # 以 3 個字元為一個 shingle（中文不需要斷詞）
+DEFAULT_MAX_DISTANCE = 3  # 漢明距離 <= 3 視為近似重複
+
+_NON_WORD_RE = re.compile(r"[\W_]+")  # 空白、標點、符號（Unicode 文字與數字以外的字元）
+
+
+def normalize_text(text: Optional[str]) -> str:
+    """全半形統一（NFKC）、轉小寫，並移除所有空白、標點與符號"""
+    if not text:
+        return ""
+    return _NON_WORD_RE.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def content_hash(text: Optional[str]) -> Optional[str]:
+    """正規化後內容的 SHA-1；正規化後為空（只有空白或標點）時回傳 None，不參與去重"""
+    normalized = normalize_text(text)
+    if not normalized:
+        return None
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def _shingles(normalized: str, size: int = SHINGLE_SIZE) -> List[str]:
+    if len(normalized) <= size:
+        return [normalized] if normalized else []
+    return [normalized[i:i + size] for i in range(len(normalized) - size + 1)]
+
+
+def simhash(text: Optional[str]) -> Optional[int]:
+    """64 位元 SimHash；內容正規化後為空時回傳 None"""
+    shingles = _shingles(normalize_text(text))
+    if not shingles:
+        return None
+    # 每個 shingle 的雜湊轉成 64 字元的 0/1 字串，逐欄統計 1 的個數（zip/count 在 C 中執行，比逐位元迴圈快）
+    rows = [
+        format(int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"), "064b")
+        for shingle in shingles
+    ]
+    half = len(rows) / 2
+    value = 0
+    for position, column in enumerate(zip(*rows)):
+        if column.count("1") > half:
+            value |= 1 << (SIMHASH_BITS - 1 - position)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex:
+    """
+    近似重複查詢：將 64 位元切成 (max_distance + 1) 段，
+    距離 <= max_distance 的兩個值至少有一段完全相同（鴿籠原理），只需比對同段的候選
+    """
+
+    def __init__(self, max_distance: int = DEFAULT_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = SIMHASH_BITS // self.bands
+        self._buckets: Dict[Tuple[int, int], List[Tuple[int, object]]] = {}
+
+    def _band_keys(self, value: int):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            shift = band * self.band_bits
+            # 最後一段包含剩餘的位元
+            band_mask = mask if band < self.bands - 1 else (1 << (SIMHASH_BITS - shift)) - 1
+            yield band, (value >> shift) & band_mask
+
+    def find(self, value: int) -> Optional[object]:
+        """回傳第一個距離在 max_distance 內的已加入項目的 key，沒有則回傳 None"""
+        for band_key in self._band_keys(value):
+            for other, key in self._buckets.get(band_key, ()):
+                if hamming_distance(value, other) <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, value: int, key: object):
+        for band_key in self._band_keys(value):
+            self._buckets.setdefault(band_key, []).append((value, key))
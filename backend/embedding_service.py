@@ -1,15 +1,17 @@
 import requests
 import os
 import json
-import numpy as np
 from typing import List, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from tracing import traced
+
 # Ollama API 端點（預設本地）
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 # 使用 nomic-embed-text 模型（專為中文優化，體積小，效果好）
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
 
+@traced("embedding.get_embedding")
 def get_embedding(text: str) -> Optional[List[float]]:
     """
     使用 Ollama 生成文本的向量嵌入
@@ -64,6 +66,8 @@ def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
     Returns:
         相似度分數（0-1之間，1表示完全相同）
     """
+    import numpy as np
+
     vec1 = np.array(vec1)
     vec2 = np.array(vec2)
     
@@ -102,6 +106,7 @@ def _get_embedding_with_retry(text: str, max_retries: int = 3, retry_delay: floa
     
     return embedding
 
+@traced("embedding.batch_get_embeddings")
 def batch_get_embeddings(texts: List[str], batch_size: int = 5, max_workers: int = 5, show_progress: bool = True) -> List[Optional[List[float]]]:
     """
     批量生成向量嵌入（並行處理，失敗自動重試）
@@ -140,6 +145,7 @@ def batch_get_embeddings(texts: List[str], batch_size: int = 5, max_workers: int
     
     return embeddings
 
+@traced("embedding.search_by_similarity")
 def search_by_similarity(
     query_embedding: List[float],
     document_embeddings: List[tuple],  # [(doc_id, embedding), ...]
@@ -0,0 +1,132 @@
+"""
+背景 embedding worker
+
+- 文檔新增/修改時，documents 上的觸發器會把文檔 ID 排入 embedding_queue（見 database.py）
+- 啟動時把 embedding_model 與目前 EMBEDDING_MODEL 不同的文檔也排入佇列（換模型後自動重新嵌入）
+- worker 以租約方式一次取走一批，呼叫 Ollama 產生向量，再以 executemany 批量寫回
+- Ollama 無法連線（整批失敗）時不計入重試次數，以指數退避等待服務恢復
+
+由 main.py 的 lifespan 啟動；也可以用 migrate_embeddings.py 手動一次處理完整個佇列
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+from database import (
+    enqueue_stale_embeddings,
+    claim_embedding_batch,
+    complete_embedding_batch,
+    release_embedding_batch,
+    embedding_queue_stats,
+)
+from embedding_service import EMBEDDING_MODEL, batch_get_embeddings
+from tracing import inc, span
+
+EMBEDDING_WORKER_ENABLED = os.getenv("EMBEDDING_WORKER", "true").lower() == "true"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))  # 每批處理的文檔數
+EMBEDDING_CONCURRENCY = int(os.getenv("EMBEDDING_CONCURRENCY", "4"))  # 同時呼叫 Ollama 的請求數
+EMBEDDING_POLL_SECONDS = float(os.getenv("EMBEDDING_POLL_SECONDS", "5"))  # 佇列為空時的輪詢間隔
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", "5"))  # 單一文檔最多重試次數
+EMBEDDING_LEASE_SECONDS = 300  # 取走的文檔多久沒寫回就視為 worker 中斷，可被重新取走
+MAX_BACKOFF_SECONDS = 300
+EMBEDDING_TEXT_LIMIT = 2000  # 嵌入文字的長度上限（與舊版 migrate_embeddings.py 相同）
+
+
+class EmbeddingWorker:
+    """從 embedding_queue 取出文檔、產生向量並寫回"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL, batch_size: int = EMBEDDING_BATCH_SIZE,
+                 poll_seconds: float = EMBEDDING_POLL_SECONDS, max_attempts: int = EMBEDDING_MAX_ATTEMPTS,
+                 concurrency: int = EMBEDDING_CONCURRENCY):
+        self.model = model
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self._task: Optional[asyncio.Task] = None
+        self._backoff = 0.0
+
+    def process_batch(self) -> int:
+        """處理一批（同步，會呼叫 Ollama），回傳取走的文檔數；佇列為空時回傳 0"""
+        items = claim_embedding_batch(self.batch_size, EMBEDDING_LEASE_SECONDS, self.max_attempts)
+        if not items:
+            return 0
+
+        with_text = [item for item in items if item["text"]]
+        with span("embedding.worker.embed"):
+            vectors = batch_get_embeddings(
+                [item["text"][:EMBEDDING_TEXT_LIMIT] for item in with_text],
+                max_workers=self.concurrency,
+                show_progress=False,
+            )
+
+        done = [{**item, "embedding": None} for item in items if not item["text"]]
+        failed = []
+        for item, vector in zip(with_text, vectors):
+            if vector:
+                done.append({**item, "embedding": vector})
+            else:
+                failed.append(item)
+
+        complete_embedding_batch(done, self.model)
+        inc("embedding_documents_total", len(done), "Documents embedded by the background worker", result="ok")
+
+        if failed:
+            inc("embedding_documents_total", len(failed), "Documents embedded by the background worker", result="error")
+            if len(failed) == len(with_text):
+                # 整批失敗多半是 Ollama 沒有啟動，不計入重試次數，退避後再試
+                self._backoff = min(MAX_BACKOFF_SECONDS, max(self.poll_seconds, self._backoff * 2))
+                release_embedding_batch(failed, time.time() + self._backoff, "embedding service unavailable",
+                                        count_attempt=False)
+                print(f"⚠️  embedding 服務無法使用，{self._backoff:.0f} 秒後重試（{len(failed)} 筆待處理）")
+            else:
+                release_embedding_batch(failed, time.time() + self.poll_seconds, "embedding failed")
+        if len(failed) < len(with_text) or not with_text:
+            self._backoff = 0.0
+        return len(items)
+
+    def drain(self) -> int:
+        """同步處理到佇列為空（或只剩退避中的文檔），回傳處理的文檔數"""
+        total = 0
+        while True:
+            processed = self.process_batch()
+            if processed == 0 or self._backoff:
+                return total + processed
+            total += processed
+
+    async def run(self):
+        queued = await asyncio.to_thread(enqueue_stale_embeddings, self.model)
+        if queued:
+            print(f"  embedding worker：{queued} 筆文檔需要以 {self.model} 產生 embedding")
+        while True:
+            try:
+                processed = await asyncio.to_thread(self.process_batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  embedding worker 錯誤：{e}")
+                processed = 0
+            if self._backoff:
+                await asyncio.sleep(self._backoff)
+            elif not processed:
+                await asyncio.sleep(self.poll_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {"model": self.model, "running": self._task is not None, **embedding_queue_stats(self.max_attempts)}
+
+
+embedding_worker = EmbeddingWorker()
@@ -5,6 +5,7 @@
 - category 固定為 "elderly_interview"
 - source 使用檔名（含副檔名），方便之後追蹤
 - 可以重複執行，已存在相同 source 的資料會被略過
+- 內容與既有逐字稿相同（即使檔名不同）也會略過
 """
 
 from pathlib import Path
@@ -12,7 +13,7 @@ from typing import List
 
 from pypdf import PdfReader
 
-from database import add_document, SessionLocal, Document
+from database import add_document, find_duplicate_document, list_sources
 
 
 BASE_DIR = Path(__file__).resolve().parent
@@ -39,42 +40,42 @@ def import_elderly_interviews() -> None:
         print(f"資料夾不存在：{TRANSCRIPTS_DIR}")
         return
 
-    db = SessionLocal()
-    try:
-        # 收集已經存在的來源，避免重複匯入
-        existing_sources = {
-            (doc.source or "").strip()
-            for doc in db.query(Document)
-            .filter(Document.category == ELDERLY_CATEGORY)
-            .all()
-        }
-
-        count_new = 0
-        for pdf_path in TRANSCRIPTS_DIR.glob("*.pdf"):
-            source_id = pdf_path.name  # 直接以檔名當作來源 ID
-            if source_id in existing_sources:
-                print(f"已存在，略過：{source_id}")
-                continue
-
-            print(f"匯入：{source_id}")
-            text = extract_text_from_pdf(pdf_path)
-            if not text.strip():
-                print(f"  無文字內容，略過：{source_id}")
-                continue
-
-            title = pdf_path.stem  # 去掉副檔名的檔名
-
-            add_document(
-                title=title,
-                content=text,
-                category=ELDERLY_CATEGORY,
-                source=source_id,
-            )
-            count_new += 1
-
-        print(f"完成，新增 {count_new} 筆老人訪談資料")
-    finally:
-        db.close()
+    # 收集已經存在的來源，避免重複匯入（讀取來源彙總表，不載入文檔內容）
+    existing_sources = {
+        (row["source"] or "").strip()
+        for row in list_sources(ELDERLY_CATEGORY)
+    }
+
+    count_new = 0
+    for pdf_path in TRANSCRIPTS_DIR.glob("*.pdf"):
+        source_id = pdf_path.name  # 直接以檔名當作來源 ID
+        if source_id in existing_sources:
+            print(f"已存在，略過：{source_id}")
+            continue
+
+        print(f"匯入：{source_id}")
+        text = extract_text_from_pdf(pdf_path)
+        if not text.strip():
+            print(f"  無文字內容，略過：{source_id}")
+            continue
+
+        # 同一份逐字稿換了檔名也不要重複匯入
+        duplicate_id = find_duplicate_document(text, ELDERLY_CATEGORY)
+        if duplicate_id is not None:
+            print(f"  內容與既有文檔（ID {duplicate_id}）相同，略過：{source_id}")
+            continue
+
+        title = pdf_path.stem  # 去掉副檔名的檔名
+
+        add_document(
+            title=title,
+            content=text,
+            category=ELDERLY_CATEGORY,
+            source=source_id,
+        )
+        count_new += 1
+
+    print(f"完成，新增 {count_new} 筆老人訪談資料")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,530 @@
+"""
+LLM 供應商抽象層
+
+- LLMProvider：統一介面（generate / generate_stream / create_prefix_cache）
+- GeminiProvider：Google Gemini（google.generativeai，首次使用時才載入 SDK）
+- OllamaProvider：本地 Ollama chat 模型（與 embedding 共用 OLLAMA_BASE_URL）
+- StubProvider：決定性的離線假模型，用於壓力測試 /api/ask（不需網路）
+- ProviderRouter：依 LLM_PROVIDERS 設定的順序嘗試，遇到速率限制自動切換到下一個，
+  並記錄每個供應商的延遲與錯誤次數
+
+環境變數：
+- LLM_PROVIDERS：逗號分隔的供應商順序，例如 "gemini,ollama" 或 "stub"（預設 "gemini"）
+- LLM_RATE_LIMIT_COOLDOWN：供應商被限速後暫停使用的秒數（預設 30）
+- OLLAMA_CHAT_MODEL：Ollama 對話模型（預設 "qwen2.5:7b"）
+- STUB_LLM_MS_PER_1K：Stub 每 1K 個未快取輸入 token 的模擬延遲（毫秒，預設 0）
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import requests
+
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash-lite")
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = 1024  # 低於此長度的前綴不值得（也不允許）建立供應商快取
+
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_CHAT_MODEL = os.getenv("OLLAMA_CHAT_MODEL", "qwen2.5:7b")
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+
+STUB_LLM_MS_PER_1K = float(os.getenv("STUB_LLM_MS_PER_1K", "0"))
+
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "gemini")
+LLM_RATE_LIMIT_COOLDOWN = float(os.getenv("LLM_RATE_LIMIT_COOLDOWN", "30"))
+
+
+class LLMError(Exception):
+    """供應商呼叫失敗"""
+
+
+class RateLimitError(LLMError):
+    """供應商回報配額或速率限制（會觸發切換到下一個供應商）"""
+
+
+class ProviderNotConfiguredError(LLMError):
+    """沒有任何可用的供應商（例如未設定 GEMINI_API_KEY）"""
+
+
+class LLMResponse:
+    """供應商回應"""
+
+    def __init__(self, text: str, provider: str, prompt_tokens: Optional[int] = None,
+                 output_tokens: Optional[int] = None, cached_tokens: int = 0):
+        self.text = text
+        self.provider = provider
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.cached_tokens = cached_tokens
+
+
+def _is_rate_limit_message(message: str) -> bool:
+    message = message.lower()
+    return "quota" in message or "rate limit" in message or "429" in message or "resource exhausted" in message
+
+
+class LLMProvider(ABC):
+    """LLM 供應商基底類別（子類別至少要實作 generate）"""
+
+    name = "base"
+    supports_prefix_cache = False  # 是否支援供應商端的前綴快取
+    prefix_cache_ttl_seconds = 0
+    prefix_cache_min_tokens = 0
+
+    def is_available(self) -> bool:
+        """是否已完成設定（例如有 API Key）"""
+        return True
+
+    def create_prefix_cache(self, system_prompt: str, context_text: str) -> Any:
+        """在供應商端註冊靜態前綴，回傳快取 handle（不支援時回傳 None）"""
+        return None
+
+    @abstractmethod
+    def generate(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                 cached_prefix: Any = None) -> LLMResponse:
+        """
+        生成回答
+
+        Args:
+            prompt: 完整提示；若提供 cached_prefix，則只是前綴之後的部分
+            cached_prefix: create_prefix_cache 回傳的 handle
+        """
+
+    def generate_stream(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                        cached_prefix: Any = None) -> Iterator[str]:
+        """串流生成，逐段回傳文字（不支援串流的供應商一次回傳完整答案）"""
+        yield self.generate(prompt, temperature=temperature, max_output_tokens=max_output_tokens,
+                            cached_prefix=cached_prefix).text
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini（google.generativeai）"""
+
+    name = "gemini"
+    supports_prefix_cache = True
+    prefix_cache_ttl_seconds = GEMINI_CONTEXT_CACHE_TTL_SECONDS
+    prefix_cache_min_tokens = GEMINI_CONTEXT_CACHE_MIN_TOKENS
+
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, model: str = GEMINI_MODEL):
+        self.api_key = api_key
+        self.model = model
+        self._genai = None
+        self._lock = threading.Lock()
+
+    def is_available(self) -> bool:
+        return bool(self.api_key)
+
+    def _sdk(self):
+        # 延遲載入 SDK，避免拖慢後端啟動
+        if self._genai is None:
+            with self._lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._genai = genai
+        return self._genai
+
+    def create_prefix_cache(self, system_prompt: str, context_text: str) -> Any:
+        genai = self._sdk()
+        caching = getattr(genai, "caching", None)  # google-generativeai >= 0.7 才有 caching 模組
+        if caching is None:
+            return None
+        return caching.CachedContent.create(
+            model=f"models/{self.model}",
+            system_instruction=system_prompt,
+            contents=[context_text],
+            ttl=timedelta(seconds=self.prefix_cache_ttl_seconds),
+        )
+
+    def _model_and_config(self, temperature: float, max_output_tokens: int, cached_prefix: Any):
+        genai = self._sdk()
+        generation_config = genai.types.GenerationConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+        )
+        if cached_prefix is not None:
+            model = genai.GenerativeModel.from_cached_content(cached_content=cached_prefix)
+        else:
+            model = genai.GenerativeModel(self.model)
+        return model, generation_config
+
+    def generate_stream(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                        cached_prefix: Any = None) -> Iterator[str]:
+        try:
+            model, generation_config = self._model_and_config(temperature, max_output_tokens, cached_prefix)
+            for chunk in model.generate_content(prompt, generation_config=generation_config, stream=True):
+                text = chunk.text if chunk.parts else ""
+                if text:
+                    yield text
+        except Exception as e:
+            if _is_rate_limit_message(str(e)):
+                raise RateLimitError(str(e)) from e
+            raise LLMError(str(e)) from e
+
+    def generate(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                 cached_prefix: Any = None) -> LLMResponse:
+        try:
+            model, generation_config = self._model_and_config(temperature, max_output_tokens, cached_prefix)
+            response = model.generate_content(prompt, generation_config=generation_config)
+            text = response.text
+        except Exception as e:
+            if _is_rate_limit_message(str(e)):
+                raise RateLimitError(str(e)) from e
+            raise LLMError(str(e)) from e
+
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(
+            text=text,
+            provider=self.name,
+            prompt_tokens=getattr(usage, "prompt_token_count", None),
+            output_tokens=getattr(usage, "candidates_token_count", None),
+            cached_tokens=getattr(usage, "cached_content_token_count", 0) or 0,
+        )
+
+
+class OllamaProvider(LLMProvider):
+    """本地 Ollama chat 模型（/api/chat）"""
+
+    name = "ollama"
+
+    def __init__(self, base_url: str = OLLAMA_BASE_URL, model: str = OLLAMA_CHAT_MODEL,
+                 timeout: float = OLLAMA_TIMEOUT):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+
+    def generate(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                 cached_prefix: Any = None) -> LLMResponse:
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/chat",
+                json={
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "stream": False,
+                    "options": {"temperature": temperature, "num_predict": max_output_tokens},
+                },
+                timeout=self.timeout,
+            )
+        except requests.exceptions.RequestException as e:
+            raise LLMError(f"無法連接到 Ollama ({self.base_url})：{e}") from e
+
+        if response.status_code in (429, 503):
+            raise RateLimitError(f"Ollama 忙碌中（狀態碼 {response.status_code}）")
+        if response.status_code != 200:
+            raise LLMError(f"Ollama 返回錯誤 {response.status_code}: {response.text[:200]}")
+
+        result = response.json()
+        return LLMResponse(
+            text=(result.get("message") or {}).get("content", ""),
+            provider=self.name,
+            prompt_tokens=result.get("prompt_eval_count"),
+            output_tokens=result.get("eval_count"),
+        )
+
+
+    def generate_stream(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                        cached_prefix: Any = None) -> Iterator[str]:
+        try:
+            response = requests.post(
+                f"{self.base_url}/api/chat",
+                json={
+                    "model": self.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "stream": True,
+                    "options": {"temperature": temperature, "num_predict": max_output_tokens},
+                },
+                timeout=self.timeout,
+                stream=True,
+            )
+        except requests.exceptions.RequestException as e:
+            raise LLMError(f"無法連接到 Ollama ({self.base_url})：{e}") from e
+
+        with response:
+            if response.status_code in (429, 503):
+                raise RateLimitError(f"Ollama 忙碌中（狀態碼 {response.status_code}）")
+            if response.status_code != 200:
+                raise LLMError(f"Ollama 返回錯誤 {response.status_code}: {response.text[:200]}")
+            try:
+                # 每一行是一個 JSON 物件，最後一行 done=true
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    text = (data.get("message") or {}).get("content", "")
+                    if text:
+                        yield text
+                    if data.get("done"):
+                        break
+            except requests.exceptions.RequestException as e:
+                raise LLMError(f"Ollama 串流中斷：{e}") from e
+
+
+class StubProvider(LLMProvider):
+    """
+    決定性的離線假模型
+
+    - 相同提示永遠得到相同回答（以提示的雜湊挑選句子）
+    - 延遲依未快取的輸入 token 數模擬（STUB_LLM_MS_PER_1K）
+    - 支援前綴快取，可用來量測前綴快取的效果
+    """
+
+    name = "stub"
+    supports_prefix_cache = True
+    prefix_cache_ttl_seconds = 3600
+
+    _ANSWERS = [
+        "我記得那時候生活很辛苦，但大家都很互相幫忙。",
+        "這件事我印象很深，以前我們常常在廟口聊天。",
+        "說起來有點久了，我只記得那時候天天都要早起做工。",
+        "你問得好，這個我在訪談裡也提過，改天再慢慢跟你說。",
+    ]
+
+    def __init__(self, ms_per_1k: float = STUB_LLM_MS_PER_1K):
+        self.ms_per_1k = ms_per_1k
+
+    @staticmethod
+    def _count_tokens(text: str) -> int:
+        from ai_service import estimate_tokens
+        return estimate_tokens(text)
+
+    def create_prefix_cache(self, system_prompt: str, context_text: str) -> Any:
+        return {"tokens": self._count_tokens(f"{system_prompt}\n{context_text}")}
+
+    def generate(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                 cached_prefix: Any = None) -> LLMResponse:
+        uncached = self._count_tokens(prompt)
+        cached = cached_prefix["tokens"] if cached_prefix else 0
+        if self.ms_per_1k:
+            time.sleep(uncached / 1000 * self.ms_per_1k / 1000)
+        digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+        text = self._ANSWERS[digest[0] % len(self._ANSWERS)]
+        return LLMResponse(text=text, provider=self.name, prompt_tokens=uncached + cached,
+                           output_tokens=self._count_tokens(text), cached_tokens=cached)
+
+    def generate_stream(self, prompt: str, *, temperature: float, max_output_tokens: int,
+                        cached_prefix: Any = None) -> Iterator[str]:
+        text = self.generate(prompt, temperature=temperature, max_output_tokens=max_output_tokens,
+                             cached_prefix=cached_prefix).text
+        for i in range(0, len(text), 4):  # 模擬逐 token 輸出
+            yield text[i:i + 4]
+
+
+PROVIDER_CLASSES = {
+    "gemini": GeminiProvider,
+    "ollama": OllamaProvider,
+    "stub": StubProvider,
+}
+
+
+class ProviderStats:
+    """單一供應商的呼叫統計"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_error: Optional[str] = None
+        self.cooldown_until = 0.0
+
+    def as_dict(self) -> Dict:
+        ok = self.requests - self.errors
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "rate_limited": self.rate_limited,
+            "avg_latency_ms": round(self.total_latency / ok * 1000, 1) if ok else None,
+            "max_latency_ms": round(self.max_latency * 1000, 1),
+            "last_error": self.last_error,
+            "cooling_down": time.monotonic() < self.cooldown_until,
+        }
+
+
+_PREFIX_CACHE_FAILED = object()  # 供應商無法建立前綴快取的標記
+
+
+class ProviderRouter:
+    """依序嘗試供應商，遇到速率限制或錯誤時自動切換，並記錄每個供應商的統計"""
+
+    def __init__(self, providers: List[LLMProvider], cooldown: float = LLM_RATE_LIMIT_COOLDOWN):
+        self.providers = providers
+        self.cooldown = cooldown
+        self.stats: Dict[str, ProviderStats] = {p.name: ProviderStats() for p in providers}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, spec: str = LLM_PROVIDERS) -> "ProviderRouter":
+        providers = []
+        for name in (n.strip().lower() for n in spec.split(",")):
+            if not name:
+                continue
+            if name not in PROVIDER_CLASSES:
+                print(f"警告：未知的 LLM 供應商 '{name}'，已略過（可用：{', '.join(PROVIDER_CLASSES)}）")
+                continue
+            providers.append(PROVIDER_CLASSES[name]())
+        return cls(providers)
+
+    def _prefix_handle(self, provider: LLMProvider, prefix, use_prefix_cache: bool):
+        """取得（必要時建立）該供應商的前綴快取 handle"""
+        if not (use_prefix_cache and provider.supports_prefix_cache) or prefix is None:
+            return None
+        if prefix.tokens < provider.prefix_cache_min_tokens:
+            return None
+        entry = prefix.provider_caches.get(provider.name)
+        if entry is _PREFIX_CACHE_FAILED:
+            return None
+        if entry is not None and time.monotonic() < entry[1]:
+            return entry[0]
+        try:
+            handle = provider.create_prefix_cache(prefix.system_prompt, prefix.context_text)
+        except Exception as e:
+            print(f"[PREFIX] 無法在 {provider.name} 建立前綴快取，改送完整提示：{e}")
+            handle = None
+        if handle is None:
+            prefix.provider_caches[provider.name] = _PREFIX_CACHE_FAILED
+            return None
+        # 提早一分鐘視為過期，避免剛好在請求途中失效
+        prefix.provider_caches[provider.name] = (handle, time.monotonic() + max(provider.prefix_cache_ttl_seconds - 60, 0))
+        return handle
+
+    def _ordered_providers(self) -> List[LLMProvider]:
+        available = [p for p in self.providers if p.is_available()]
+        if not available:
+            raise ProviderNotConfiguredError("沒有可用的 LLM 供應商，請檢查 LLM_PROVIDERS 與對應的設定（例如 GEMINI_API_KEY）")
+
+        # 冷卻中的供應商排到最後（全部都在冷卻時仍然會嘗試）
+        now = time.monotonic()
+        return [p for p in available if self.stats[p.name].cooldown_until <= now] + \
+               [p for p in available if self.stats[p.name].cooldown_until > now]
+
+    def _drop_stale_prefix(self, provider: LLMProvider, prefix, handle, error: Exception) -> bool:
+        """
+        供應商端快取失效（過期或被刪除）時丟棄該 handle，下次請求會重新建立
+
+        Returns:
+            是否為前綴快取失效（呼叫端應以完整提示重試同一個供應商，而不是切換供應商）
+        """
+        if handle is None or isinstance(error, RateLimitError) or "cache" not in str(error).lower():
+            return False
+        prefix.provider_caches.pop(provider.name, None)
+        print(f"[PREFIX] {provider.name} 的前綴快取已失效，改送完整提示重試：{str(error)[:200]}")
+        return True
+
+    def _record_error(self, provider: LLMProvider, error: Exception) -> LLMError:
+        stats = self.stats[provider.name]
+        if isinstance(error, RateLimitError):
+            with self._lock:
+                stats.errors += 1
+                stats.rate_limited += 1
+                stats.last_error = str(error)[:200]
+                stats.cooldown_until = time.monotonic() + self.cooldown
+            print(f"[LLM] {provider.name} 達到速率限制，切換到下一個供應商")
+            return error
+        with self._lock:
+            stats.errors += 1
+            stats.last_error = str(error)[:200]
+        print(f"[LLM] {provider.name} 呼叫失敗：{str(error)[:200]}")
+        return error if isinstance(error, LLMError) else LLMError(str(error))
+
+    def open_stream(self, prefix, suffix: str, *, temperature: float = 0.7, max_output_tokens: int = 512,
+                    use_prefix_cache: bool = True) -> Tuple[str, Iterator[str]]:
+        """
+        串流版的 generate：依序嘗試供應商直到取得第一段文字（此前失敗可切換到下一個供應商），
+        回傳 (供應商名稱, 文字片段 iterator)；開始輸出後的錯誤會直接拋出 LLMError
+        （同步且會阻塞，請在執行緒中呼叫，iterator 也一樣）
+        """
+        last_error: Optional[LLMError] = None
+        for provider in self._ordered_providers():
+            stats = self.stats[provider.name]
+            handle = self._prefix_handle(provider, prefix, use_prefix_cache)
+            prompt = suffix if handle is not None else prefix.text + suffix
+            start = time.perf_counter()
+            with self._lock:
+                stats.requests += 1
+            try:
+                try:
+                    chunks = provider.generate_stream(prompt, temperature=temperature,
+                                                      max_output_tokens=max_output_tokens, cached_prefix=handle)
+                    first = next(chunks, "")
+                except Exception as e:
+                    if not self._drop_stale_prefix(provider, prefix, handle, e):
+                        raise
+                    handle = None
+                    chunks = provider.generate_stream(prefix.text + suffix, temperature=temperature,
+                                                      max_output_tokens=max_output_tokens)
+                    first = next(chunks, "")
+            except Exception as e:
+                last_error = self._record_error(provider, e)
+                continue
+            return provider.name, self._finish_stream(provider, prefix, handle, first, chunks, start)
+
+        raise last_error
+
+    def _finish_stream(self, provider: LLMProvider, prefix, handle, first: str, chunks: Iterator[str],
+                       start: float) -> Iterator[str]:
+        stats = self.stats[provider.name]
+        try:
+            if first:
+                yield first
+            yield from chunks
+        except Exception as e:
+            # 已經開始輸出，無法重試；只丟棄失效的前綴快取
+            self._drop_stale_prefix(provider, prefix, handle, e)
+            raise self._record_error(provider, e) from e
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            stats.total_latency += elapsed
+            stats.max_latency = max(stats.max_latency, elapsed)
+
+    def generate(self, prefix, suffix: str, *, temperature: float = 0.7, max_output_tokens: int = 512,
+                 use_prefix_cache: bool = True) -> LLMResponse:
+        """
+        依序嘗試可用的供應商
+
+        Args:
+            prefix: 靜態前綴（ai_service.PromptPrefix：需有 system_prompt、context_text、text、tokens、provider_caches）
+            suffix: 前綴之後的提示內容
+        """
+        last_error: Optional[LLMError] = None
+        for provider in self._ordered_providers():
+            stats = self.stats[provider.name]
+            handle = self._prefix_handle(provider, prefix, use_prefix_cache)
+            prompt = suffix if handle is not None else prefix.text + suffix
+            start = time.perf_counter()
+            with self._lock:
+                stats.requests += 1
+            try:
+                try:
+                    response = provider.generate(prompt, temperature=temperature,
+                                                 max_output_tokens=max_output_tokens, cached_prefix=handle)
+                except Exception as e:
+                    if not self._drop_stale_prefix(provider, prefix, handle, e):
+                        raise
+                    response = provider.generate(prefix.text + suffix, temperature=temperature,
+                                                 max_output_tokens=max_output_tokens)
+            except Exception as e:
+                last_error = self._record_error(provider, e)
+                continue
+
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats.total_latency += elapsed
+                stats.max_latency = max(stats.max_latency, elapsed)
+            return response
+
+        raise last_error
+
+    def stats_snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+
+router = ProviderRouter.from_env()
@@ -1,16 +1,18 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import FileResponse, StreamingResponse
-from datetime import datetime
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 from contextlib import asynccontextmanager
-import uvicorn
+import asyncio
+import time
 import csv
 import io
 import os
-import sys
 import base64
+import importlib.util
+import json
 from pathlib import Path
 import httpx
 from dotenv import load_dotenv
@@ -22,40 +24,89 @@ from database import (
     get_answer_from_db,
     add_qa_pair,
     add_document,
-    get_all_documents,
+    find_duplicate_document,
+    list_documents,
+    count_documents,
+    list_categories,
     get_all_documents_with_content,
-    batch_add_documents_from_csv,
+    bulk_insert_documents,
+    delete_document,
+    delete_documents_by_source,
+    clear_all_documents,
     get_bot_config,
+    bot_config_cache,
     update_bot_config,
     init_db,
     get_elderly_documents_with_content,
+    get_generation,
+    CORPUS_GENERATION,
+    run_db,
 )
-from ai_service import generate_answer_with_ai
+from ai_service import generate_answer_with_ai, generate_answer_with_usage, stream_answer, strip_source_info
+from session_store import session_store
+from embedding_worker import embedding_worker, EMBEDDING_WORKER_ENABLED
+from csv_import import job_store, run_csv_import, CSVValidationError
+from llm_providers import router as llm_router
+from tracing import inc, span, start_trace, end_trace, log_trace, metrics
 
-# 導入 TTS 模組（從根目錄）
-ROOT_DIR = Path(__file__).resolve().parent.parent
-TTS_MODULE_PATH = ROOT_DIR / "tts_google.py"
-if TTS_MODULE_PATH.exists():
-    sys.path.insert(0, str(ROOT_DIR))
-    try:
-        from tts_google import tts_text_to_wav
-    except ImportError as e:
-        print(f"警告：無法導入 tts_google 模組：{e}")
-        tts_text_to_wav = None
-else:
-    tts_text_to_wav = None
-    print(f"警告：找不到 tts_google.py 在 {TTS_MODULE_PATH}")
+# TTS（tts_google 與 google.cloud.texttospeech 在第一次使用時才載入，見 tts_service.py）
+from tts_service import (
+    load_tts,
+    tts_unavailable_reason,
+    clean_output_dir,
+    TTS_AUDIO_FORMATS,
+    TTS_OUTPUT_JANITOR_SECONDS,
+)
+from audio_cache import audio_cache, audio_cache_key, etag_matches
+from sage_coalescer import sage_requests, aging_request_key
+from startup import readiness, READY, DEGRADED, FAILED, DISABLED
 
 # SAGE API 配置（如果 SAGE 在遠端機器）
 SAGE_API_URL = os.getenv("SAGE_API_URL", "http://localhost:8001")  # SAGE 預設在 8001 端口
+SAGE_TIMEOUT = float(os.getenv("SAGE_TIMEOUT", "300"))  # 變老處理需要時間（預設最多 5 分鐘）
+SAGE_MAX_CONNECTIONS = int(os.getenv("SAGE_MAX_CONNECTIONS", "20"))  # 連線池大小（保持 keep-alive）
+# HTTP/2 需要 h2 套件（pip install httpx[http2]）；SAGE 為 https 且支援 HTTP/2 時才會實際使用
+SAGE_HTTP2 = os.getenv("SAGE_HTTP2", "true").lower() == "true" and importlib.util.find_spec("h2") is not None
+SAGE_MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 上傳照片大小上限
+SAGE_UPLOAD_READ_CHUNK = 256 * 1024  # 讀取上傳照片的分塊大小
 
-# 啟動和關閉事件處理
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # 啟動時
-    init_db()
-    
-    # 自動導入訪談資料
+_sage_client: Optional[httpx.AsyncClient] = None
+
+
+def get_sage_client() -> httpx.AsyncClient:
+    """整個應用共用的 SAGE API 連線池（第一次使用時建立，lifespan 結束時關閉）"""
+    global _sage_client
+    if _sage_client is None or _sage_client.is_closed:
+        _sage_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(SAGE_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=SAGE_MAX_CONNECTIONS,
+                max_keepalive_connections=SAGE_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+            http2=SAGE_HTTP2,
+        )
+    return _sage_client
+
+
+async def close_sage_client():
+    global _sage_client
+    if _sage_client is not None:
+        await _sage_client.aclose()
+        _sage_client = None
+
+# 快速啟動：訪談資料導入、SAGE 連線檢查與 TTS 預熱在背景執行，不阻塞啟動
+# 設為 false 時恢復舊行為（全部完成後才開始接受請求）
+FAST_START = os.getenv("FAST_START", "true").lower() == "true"
+TTS_PRELOAD = os.getenv("TTS_PRELOAD", "true").lower() == "true"  # 啟動後在背景預先載入 TTS SDK
+
+for _name, _required in (("database", True), ("interviews_import", False), ("sage", False),
+                         ("tts", False), ("embedding_worker", False)):
+    readiness.register(_name, required=_required)
+
+
+def import_interviews():
+    """自動導入訪談資料（同步，會讀取 PDF）"""
     print("\n" + "=" * 60)
     print("  檢查並導入訪談資料...")
     print("=" * 60)
@@ -77,28 +128,34 @@ async def lifespan(app: FastAPI):
         else:
             if not transcripts_dir.exists():
                 print(f"  ⚠️  訪談資料夾不存在: {transcripts_dir}")
-            else:
-                print(f"  ⚠️  導入腳本不存在: {import_script}")
+                return DISABLED, f"訪談資料夾不存在: {transcripts_dir}"
+            print(f"  ⚠️  導入腳本不存在: {import_script}")
+            return DISABLED, f"導入腳本不存在: {import_script}"
     except Exception as e:
         print(f"  ⚠️  導入訪談資料時發生錯誤: {str(e)}")
         print("     可以手動執行: python import_elderly_interviews.py")
-    print("=" * 60)
-    
-    # 檢查 SAGE API 連接
+        return DEGRADED, str(e)
+    finally:
+        print("=" * 60)
+    return READY, None
+
+
+async def probe_sage():
+    """檢查 SAGE API 連接"""
     print("\n" + "=" * 60)
     print("  檢查 SAGE API 連接...")
     print("=" * 60)
     print(f"  SAGE API URL: {SAGE_API_URL}")
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"{SAGE_API_URL}/status")
-            if response.status_code == 200:
-                data = response.json()
-                print(f"  ✅ SAGE API 連接成功")
-                print(f"     狀態: {data.get('status', 'unknown')}")
-                print(f"     GPU: {'可用' if data.get('gpu_available') else '不可用'}")
-            else:
-                print(f"  ⚠️  SAGE API 響應異常 (狀態碼: {response.status_code})")
+        response = await get_sage_client().get(f"{SAGE_API_URL}/status", timeout=5.0)
+        if response.status_code == 200:
+            data = response.json()
+            print(f"  ✅ SAGE API 連接成功")
+            print(f"     狀態: {data.get('status', 'unknown')}")
+            print(f"     GPU: {'可用' if data.get('gpu_available') else '不可用'}")
+            return READY, f"GPU: {'可用' if data.get('gpu_available') else '不可用'}"
+        print(f"  ⚠️  SAGE API 響應異常 (狀態碼: {response.status_code})")
+        return DEGRADED, f"狀態碼 {response.status_code}"
     except httpx.ConnectError:
         print(f"  ❌ 無法連接到 SAGE API ({SAGE_API_URL})")
         print(f"     請確認：")
@@ -106,13 +163,76 @@ async def lifespan(app: FastAPI):
         print(f"     2. SAGE_API_URL 配置是否正確")
         print(f"     3. 如果 SAGE 在遠端，確認網路連接")
         print(f"     提示：執行 'python test_sage_connection.py' 進行詳細診斷")
+        return DEGRADED, f"無法連接到 SAGE API ({SAGE_API_URL})"
     except Exception as e:
         print(f"  ⚠️  檢查 SAGE API 時發生錯誤: {str(e)}")
-    print("=" * 60 + "\n")
+        return DEGRADED, str(e)
+    finally:
+        print("=" * 60 + "\n")
+
+
+def warm_tts():
+    if load_tts() is None:
+        return DEGRADED, tts_unavailable_reason()
+    return READY, None
+
+
+async def warm_up():
+    """依序執行較慢的啟動工作（背景任務，或 FAST_START=false 時在啟動期間執行）"""
+    await readiness.run("interviews_import", import_interviews)
+    await readiness.run("sage", probe_sage)
+    if TTS_PRELOAD:
+        await readiness.run("tts", warm_tts)
+    else:
+        readiness.mark("tts", DISABLED, "第一次使用時載入（TTS_PRELOAD=false）")
+
+
+async def output_janitor():
+    """定期清除 output/ 中舊版程式留下的語音檔"""
+    while True:
+        try:
+            await asyncio.to_thread(clean_output_dir)
+        except Exception as e:
+            print(f"⚠️  清理 output/ 時發生錯誤：{e}")
+        await asyncio.sleep(TTS_OUTPUT_JANITOR_SECONDS)
+
+
+# 啟動和關閉事件處理
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 啟動時（資料庫是唯一必須在接受請求前完成的步驟）
+    await readiness.run("database", init_db, on_error=FAILED)
+    if not readiness.is_ready():
+        raise RuntimeError(f"資料庫初始化失敗：{readiness.snapshot()['subsystems']['database']['detail']}")
+    session_store.purge_expired()
+    
+    warm_up_task = None
+    if FAST_START:
+        warm_up_task = asyncio.create_task(warm_up())
+    else:
+        await warm_up()
+    
+    janitor_task = asyncio.create_task(output_janitor())
+    
+    # 背景 embedding worker（處理新增/修改文檔與更換 EMBEDDING_MODEL 後的重新嵌入）
+    if EMBEDDING_WORKER_ENABLED:
+        embedding_worker.start()
+        readiness.mark("embedding_worker", READY)
+    else:
+        readiness.mark("embedding_worker", DISABLED, "EMBEDDING_WORKER=false")
     
     yield
     
-    # 關閉時（如果需要清理資源）
+    # 關閉時
+    for task in (warm_up_task, janitor_task):
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    await embedding_worker.stop()
+    await close_sage_client()
 
 app = FastAPI(title="歷史系 AI 對話機器人", lifespan=lifespan)
 
@@ -133,11 +253,93 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "Server-Timing", "X-Request-ID", "ETag"],
 )
 
+# 請求追蹤：每個請求記錄各階段耗時，回傳 Server-Timing 標頭並輸出 JSON 日誌
+# 串流回應（/api/tts/stream、/api/ask/speak、CSV 匯出）的標頭在內容產生前就送出，
+# 因此 Server-Timing 只涵蓋到送出標頭為止；日誌與延遲指標則在回應內容送完後才記錄
+TRACE_EXCLUDED_PATHS = {"/metrics"}
+
+def _finish_request_trace(request: Request, trace, status_code: int, headers_ms: Optional[float] = None):
+    # 以路由樣板（例如 /api/documents/{doc_id}）作為標籤，避免標籤數量爆炸
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    metrics.observe("http_request_duration", trace.elapsed_ms() / 1000, method=request.method, path=path)
+    fields = {"method": request.method, "path": path, "status": status_code}
+    if headers_ms is not None:
+        fields["headers_ms"] = round(headers_ms, 1)
+    log_trace(trace, **fields)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    if request.url.path in TRACE_EXCLUDED_PATHS:
+        return await call_next(request)
+    trace, token = start_trace(f"{request.method} {request.url.path}", request.headers.get("x-request-id"))
+    try:
+        response = await call_next(request)
+    except Exception:
+        _finish_request_trace(request, trace, 500)
+        raise
+    finally:
+        end_trace(token)
+
+    response.headers["Server-Timing"] = trace.server_timing()
+    response.headers["X-Request-ID"] = trace.request_id
+    headers_ms = trace.elapsed_ms()
+    body_iterator = response.body_iterator
+
+    async def traced_body():
+        # 內容（包含串流的每一段）送完或客戶端中斷時才結束追蹤
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            _finish_request_trace(request, trace, response.status_code, headers_ms)
+
+    response.body_iterator = traced_body()
+    return response
+
+def _llm_provider_metrics():
+    for name, stats in llm_router.stats_snapshot().items():
+        yield "llm_provider_requests_total", "counter", "LLM provider calls", {"provider": name}, stats["requests"]
+        yield "llm_provider_errors_total", "counter", "LLM provider failed calls", {"provider": name}, stats["errors"]
+        yield "llm_provider_rate_limited_total", "counter", "LLM provider rate-limit responses", {"provider": name}, stats["rate_limited"]
+
+metrics.register_collector(_llm_provider_metrics)
+
+def _embedding_queue_metrics():
+    stats = embedding_worker.stats()
+    yield "embedding_queue_documents", "gauge", "Documents waiting in the embedding queue", {"state": "pending"}, stats["pending"]
+    yield "embedding_queue_documents", "gauge", "Documents waiting in the embedding queue", {"state": "failed"}, stats["failed"]
+
+metrics.register_collector(_embedding_queue_metrics)
+
+def _audio_cache_metrics():
+    stats = audio_cache.stats()
+    yield "tts_cache_hit_ratio", "gauge", "TTS audio cache hit ratio since start", {}, stats["hit_ratio"]
+    yield "tts_cache_bytes", "gauge", "Bytes stored in the TTS audio cache", {}, stats["bytes"]
+    yield "tts_cache_entries", "gauge", "Files stored in the TTS audio cache", {}, stats["entries"]
+    yield "tts_cache_evictions_total", "counter", "Files evicted from the TTS audio cache", {}, stats["evictions"]
+
+metrics.register_collector(_audio_cache_metrics)
+
+def _sage_request_metrics():
+    stats = sage_requests.stats()
+    yield "sage_requests_in_flight", "gauge", "Distinct SAGE aging requests in flight", {}, stats["in_flight"]
+    yield "sage_result_cache_entries", "gauge", "SAGE aging results held for retries", {}, stats["cached_entries"]
+
+metrics.register_collector(_sage_request_metrics)
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    """Prometheus 文字格式的效能指標（span 直方圖、p50/p95/p99、計數器）"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 class QuestionRequest(BaseModel):
     question: str
     use_ai: bool = True  # 是否使用 AI 增強回答
+    session_id: Optional[str] = None  # 多輪對話 Session ID（不提供時建立新的 Session）
 
 class QuestionResponse(BaseModel):
     answer: str
@@ -145,6 +347,8 @@ class QuestionResponse(BaseModel):
     documents_used: Optional[List[dict]] = None  # 使用的文檔（包含來源 ID）
     source_ids: Optional[List[str]] = None  # 來源 ID 列表
     source_details: Optional[List[dict]] = None  # 來源詳細信息：{"source": "來源ID", "doc_titles": ["資料1", "資料2"]}
+    input_tokens: Optional[int] = None  # 本次請求的輸入 token 數（有 API 回報時為實際值，否則為估算值）
+    session_id: Optional[str] = None  # 多輪對話 Session ID（下次提問時帶回）
 
 class DocumentRequest(BaseModel):
     title: str
@@ -163,11 +367,20 @@ class DocumentResponse(BaseModel):
 def read_root():
     return {"message": "歷史系 AI 對話機器人 API"}
 
+@app.get("/api/ready")
+def ready():
+    """
+    就緒檢查：資料庫初始化完成即回傳 200（否則 503）；
+    warm 表示背景啟動工作（訪談導入、SAGE 檢查、TTS 預熱）是否都已完成
+    """
+    snapshot = readiness.snapshot()
+    return JSONResponse(snapshot, status_code=200 if snapshot["ready"] else 503)
+
 @app.get("/api/bot-config")
 async def get_bot_config_endpoint():
     """獲取機器人配置（角色/身份）"""
     try:
-        config = get_bot_config()
+        config = bot_config_cache.peek() or await run_db(get_bot_config)
         return config
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -199,13 +412,16 @@ async def update_bot_config_endpoint(request: BotConfigRequest):
                 detail=f"角色描述過長，最多 {MAX_ROLE_DESCRIPTION_LENGTH} 字符（目前：{len(request.role_description)} 字符）"
             )
         
-        update_bot_config(
+        await run_db(
+            update_bot_config,
             role_name=request.role_name.strip(),
             role_description=request.role_description.strip() if request.role_description else None
         )
+        # 角色改變後，伺服器端的對話歷史也一併清空
+        await run_db(session_store.clear)
         return {
             "message": "機器人配置已更新，對話歷史已清空", 
-            "config": get_bot_config(),
+            "config": await run_db(get_bot_config),
             "clear_chat": True  # 標記需要清空對話
         }
     except HTTPException:
@@ -221,41 +437,150 @@ class TTSRequest(BaseModel):
     voice_name: Optional[str] = None
     rate: float = 0.9  # 老人聲音稍慢
     pitch: float = -2.0  # 老人聲音較低
+    audio_format: str = "wav"  # wav / mp3 / ogg_opus（壓縮格式約為 wav 的 1/10 大小）
+
+async def synthesize_tts_response(request: TTSRequest, if_none_match: Optional[str]):
+    """
+    文字轉語音（使用 Google TTS），音訊在記憶體中產生後直接回傳，不經過暫存檔
+    相同文字與聲音參數的結果存在 audio_cache，重複請求不再呼叫 Google TTS；
+    ETag 為參數的內容雜湊，請求帶 If-None-Match 時直接回傳 304
+    """
+    if request.audio_format not in TTS_AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"audio_format 只支援 {', '.join(TTS_AUDIO_FORMATS)}")
+    media_type, extension = TTS_AUDIO_FORMATS[request.audio_format]
+    sample_rate = 24000
+    # 快取 key 含實際使用的 engine 名稱，不同 engine 的音訊不會混用
+    tts = await asyncio.to_thread(load_tts)
+    if tts is None:
+        raise HTTPException(status_code=503, detail=f"TTS 服務未配置（{tts_unavailable_reason()}），請確認 tts_google.py 存在且 GOOGLE_APPLICATION_CREDENTIALS 已設定")
+    key = audio_cache_key(request.text, request.lang, request.voice_name, request.rate, request.pitch, sample_rate,
+                          request.audio_format, tts.get_engine().name)
+    etag = f'"{key}"'
+    cache_headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    output_filename = f"tts_{key[:16]}.{extension}"
+
+    if etag_matches(if_none_match, etag):
+        inc("tts_cache_requests_total", help_text="TTS audio cache lookups", result="not_modified")
+        return Response(status_code=304, headers=cache_headers)
+
+    headers = {**cache_headers, "Content-Disposition": f'attachment; filename="{output_filename}"'}
+    # 在快取的鎖內讀進記憶體：回傳檔案路徑的話，送出前可能剛好被淘汰
+    cached = await asyncio.to_thread(audio_cache.read, key, extension)
+    if cached is not None:
+        return Response(content=cached, media_type=media_type, headers=headers)
 
-@app.post("/api/tts")
-async def text_to_speech(request: TTSRequest):
-    """文字轉語音（使用 Google TTS）"""
-    if not tts_text_to_wav:
-        raise HTTPException(status_code=503, detail="TTS 服務未配置，請確認 tts_google.py 存在且 GOOGLE_APPLICATION_CREDENTIALS 已設定")
     
     try:
-        # 生成臨時 WAV 檔案
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        output_filename = f"tts_{timestamp}.wav"
-        output_dir = Path(__file__).resolve().parent / "output"
-        output_dir.mkdir(exist_ok=True)
-        
-        # 調用 TTS
-        wav_path = tts_text_to_wav(
-            text=request.text,
-            out=output_filename,
-            out_dir=output_dir,
+        # 調用 TTS（在執行緒中執行、長文字分段並行合成）
+        audio = await tts.synthesize_audio_async(
+            request.text,
             lang=request.lang,
             voice_name=request.voice_name,
             rate=request.rate,
             pitch=request.pitch,
-            sr=24000
-        )
-        
-        # 返回音訊檔案
-        return FileResponse(
-            str(wav_path),
-            media_type="audio/wav",
-            filename=output_filename
+            sample_rate=sample_rate,
+            audio_format=request.audio_format,
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"TTS 生成失敗：{str(e)}")
 
+    # 先回傳音訊，回應送出後才寫入快取
+    return Response(content=audio, media_type=media_type, headers=headers,
+                    background=BackgroundTask(audio_cache.put_bytes, key, audio, extension))
+
+@app.post("/api/tts")
+async def text_to_speech(request: TTSRequest, http_request: Request):
+    """文字轉語音（POST，適合長文字）"""
+    return await synthesize_tts_response(request, http_request.headers.get("if-none-match"))
+
+@app.get("/api/tts")
+async def text_to_speech_get(http_request: Request, text: str, lang: str = "zh-TW", voice_name: Optional[str] = None,
+                             rate: float = 0.9, pitch: float = -2.0):
+    """文字轉語音（GET，瀏覽器會依 ETag 快取並重新驗證，適合短文字與 <audio src>）"""
+    request = TTSRequest(text=text, lang=lang, voice_name=voice_name, rate=rate, pitch=pitch)
+    return await synthesize_tts_response(request, http_request.headers.get("if-none-match"))
+
+async def stream_tts_response(request: TTSRequest, audio_format: str, if_none_match: Optional[str]):
+    """
+    串流文字轉語音：依句號等標點切句，逐句合成（預先並行合成後面幾句），
+    每句完成就送出，播放可在第一句合成後開始，不必等整段完成
+
+    audio_format：wav（標頭中的長度為最大值，可直接給 <audio> 播放）或 pcm（16-bit mono 原始資料）
+    合成完成後整段音訊寫入 audio_cache，之後相同請求直接回傳快取檔案
+    """
+    if audio_format not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail="format 只支援 wav 或 pcm")
+    sample_rate = 24000
+    tts = await asyncio.to_thread(load_tts)
+    if tts is None:
+        raise HTTPException(status_code=503, detail=f"TTS 服務未配置（{tts_unavailable_reason()}），請確認 tts_google.py 存在且 GOOGLE_APPLICATION_CREDENTIALS 已設定")
+    key = audio_cache_key(request.text, request.lang, request.voice_name, request.rate, request.pitch, sample_rate,
+                          "wav", tts.get_engine().name)
+
+    if audio_format == "wav":
+        etag = f'"{key}"'
+        cache_headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+        if etag_matches(if_none_match, etag):
+            inc("tts_cache_requests_total", help_text="TTS audio cache lookups", result="not_modified")
+            return Response(status_code=304, headers=cache_headers)
+        cached = await asyncio.to_thread(audio_cache.read, key)
+        if cached is not None:
+            return Response(content=cached, media_type="audio/wav", headers=cache_headers)
+
+
+    started = time.perf_counter()
+    chunks = tts.stream_pcm_async(
+        request.text,
+        lang=request.lang,
+        voice_name=request.voice_name,
+        rate=request.rate,
+        pitch=request.pitch,
+        sample_rate=sample_rate,
+    )
+    # 先合成第一句：失敗時還能回傳錯誤狀態碼（開始串流後就無法更改）
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=400, detail="文字為空，無法合成語音")
+    except Exception as e:
+        await chunks.aclose()
+        raise HTTPException(status_code=500, detail=f"TTS 生成失敗：{str(e)}")
+    metrics.observe("tts_stream_first_audio", time.perf_counter() - started)
+
+    async def body():
+        pcm = bytearray(first)
+        try:
+            if audio_format == "wav":
+                yield tts.wav_header(sample_rate)
+            yield first
+            async for chunk in chunks:
+                pcm.extend(chunk)
+                yield chunk
+        except Exception as e:
+            print(f"⚠️  TTS 串流中斷：{e}")
+            return
+        finally:
+            await chunks.aclose()
+        metrics.observe("tts_stream_total", time.perf_counter() - started)
+        await asyncio.to_thread(audio_cache.put_bytes, key, tts.pcm_to_wav_bytes(bytes(pcm), sample_rate))
+
+    media_type = "audio/wav" if audio_format == "wav" else f"audio/L16;rate={sample_rate};channels=1"
+    return StreamingResponse(body(), media_type=media_type, headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+@app.post("/api/tts/stream")
+async def text_to_speech_stream(request: TTSRequest, http_request: Request, format: str = "wav"):
+    """串流文字轉語音（POST）"""
+    return await stream_tts_response(request, format, http_request.headers.get("if-none-match"))
+
+@app.get("/api/tts/stream")
+async def text_to_speech_stream_get(http_request: Request, text: str, lang: str = "zh-TW", voice_name: Optional[str] = None,
+                                    rate: float = 0.9, pitch: float = -2.0, format: str = "wav"):
+    """串流文字轉語音（GET，可直接作為 <audio src> 邊下載邊播放）"""
+    request = TTSRequest(text=text, lang=lang, voice_name=voice_name, rate=rate, pitch=pitch)
+    return await stream_tts_response(request, format, http_request.headers.get("if-none-match"))
+
 # ============== SAGE API 代理 ==============
 
 class AgePhotoRequest(BaseModel):
@@ -263,76 +588,97 @@ class AgePhotoRequest(BaseModel):
     target_age: int = 75
     mock: bool = False  # 預設使用真實模型
 
+def sage_http_exception(e: Exception) -> HTTPException:
+    """把呼叫 SAGE API 時發生的例外轉成回傳給前端的 HTTPException"""
+    if isinstance(e, httpx.ConnectError):
+        print(f"[ERROR] 連接錯誤: {str(e)}")
+        print(f"[ERROR] SAGE API URL: {SAGE_API_URL}")
+        error_msg = (
+            f"無法連接到 SAGE API ({SAGE_API_URL})。"
+            f"請確認：\n"
+            f"1. SAGE API 服務是否正在運行\n"
+            f"2. SAGE_API_URL 配置是否正確（當前：{SAGE_API_URL})\n"
+            f"3. 網路連接是否正常\n"
+            f"4. 防火牆是否允許連接\n"
+            f"錯誤詳情：{str(e)}"
+        )
+        return HTTPException(status_code=503, detail=error_msg)
+    if isinstance(e, httpx.TimeoutException):
+        print(f"[ERROR] 請求超時: {str(e)}")
+        return HTTPException(status_code=504, detail="SAGE API 請求超時，變老處理可能需要較長時間（最多 5 分鐘）")
+    if isinstance(e, httpx.HTTPStatusError):
+        print(f"[ERROR] HTTP 錯誤: {e.response.status_code}")
+        print(f"[ERROR] 響應內容: {e.response.text[:500]}")
+        error_detail = f"SAGE API 返回錯誤 {e.response.status_code}"
+        try:
+            error_json = e.response.json()
+            if "detail" in error_json:
+                error_detail += f": {error_json['detail']}"
+            else:
+                error_detail += f": {error_json}"
+        except:
+            error_detail += f": {e.response.text[:200]}"
+        return HTTPException(status_code=e.response.status_code, detail=error_detail)
+    error_msg = (
+        f"處理請求時發生錯誤：{str(e)}\n"
+        f"SAGE API URL: {SAGE_API_URL}\n"
+        f"請檢查後端日誌以獲取更多資訊"
+    )
+    return HTTPException(status_code=500, detail=error_msg)
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """
+    讀取上傳的照片（需要完整內容計算合併用的雜湊），原樣以 multipart 轉送，不轉成 base64
+    分塊讀取，最多讀到 SAGE_MAX_UPLOAD_BYTES + 1 位元組即判定過大（file.size 不一定可靠）
+    """
+    if file.size is not None and file.size > SAGE_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=400, detail="圖片過大，請使用較小的圖片")
+    contents = bytearray()
+    while len(contents) <= SAGE_MAX_UPLOAD_BYTES:
+        chunk = await file.read(min(SAGE_UPLOAD_READ_CHUNK, SAGE_MAX_UPLOAD_BYTES + 1 - len(contents)))
+        if not chunk:
+            return bytes(contents)
+        contents.extend(chunk)
+    raise HTTPException(status_code=400, detail="圖片過大，請使用較小的圖片")
+
+def _sage_upload_files(file: UploadFile, contents: bytes):
+    return {"file": (file.filename or "upload.jpg", contents, file.content_type or "image/jpeg")}
+
 @app.post("/api/age-photo")
 async def age_photo_proxy(request: AgePhotoRequest):
     """代理 SAGE API：變老照片"""
-    try:
-        # 檢查圖片大小（避免過大）
-        if len(request.image_base64) > 10 * 1024 * 1024:  # 10MB
-            raise HTTPException(status_code=400, detail="圖片過大，請使用較小的圖片")
-        
-        async with httpx.AsyncClient(timeout=300.0) as client:  # 5 分鐘超時（變老處理需要時間）
-            try:
-                # 記錄請求資訊（調試用）
-                print(f"[DEBUG] 發送請求到 SAGE API: {SAGE_API_URL}/age/photo")
-                print(f"[DEBUG] 圖片大小: {len(request.image_base64)} 字符")
-                print(f"[DEBUG] 目標年齡: {request.target_age}, Mock: {request.mock}")
-                
-                response = await client.post(
-                    f"{SAGE_API_URL}/age/photo",
-                    json={
-                        "image_base64": request.image_base64,
-                        "target_age": request.target_age,
-                        "mock": request.mock
-                    },
-                    headers={"Content-Type": "application/json"},
-                    timeout=300.0
-                )
-                
-                print(f"[DEBUG] SAGE API 響應狀態碼: {response.status_code}")
-                response.raise_for_status()
-                
-                result = response.json()
-                print(f"[DEBUG] SAGE API 返回成功: {result.get('success', False)}")
-                return result
-            except httpx.ConnectError as e:
-                print(f"[ERROR] 連接錯誤: {str(e)}")
-                print(f"[ERROR] SAGE API URL: {SAGE_API_URL}")
-                error_msg = (
-                    f"無法連接到 SAGE API ({SAGE_API_URL})。"
-                    f"請確認：\n"
-                    f"1. SAGE API 服務是否正在運行\n"
-                    f"2. SAGE_API_URL 配置是否正確（當前：{SAGE_API_URL})\n"
-                    f"3. 網路連接是否正常\n"
-                    f"4. 防火牆是否允許連接\n"
-                    f"錯誤詳情：{str(e)}"
-                )
-                raise HTTPException(status_code=503, detail=error_msg)
-            except httpx.TimeoutException as e:
-                print(f"[ERROR] 請求超時: {str(e)}")
-                raise HTTPException(status_code=504, detail="SAGE API 請求超時，變老處理可能需要較長時間（最多 5 分鐘）")
-            except httpx.HTTPStatusError as e:
-                print(f"[ERROR] HTTP 錯誤: {e.response.status_code}")
-                print(f"[ERROR] 響應內容: {e.response.text[:500]}")
-                error_detail = f"SAGE API 返回錯誤 {e.response.status_code}"
-                try:
-                    error_json = e.response.json()
-                    if "detail" in error_json:
-                        error_detail += f": {error_json['detail']}"
-                    else:
-                        error_detail += f": {error_json}"
-                except:
-                    error_detail += f": {e.response.text[:200]}"
-                raise HTTPException(status_code=e.response.status_code, detail=error_detail)
-    except HTTPException:
-        raise
-    except Exception as e:
-        error_msg = (
-            f"處理請求時發生錯誤：{str(e)}\n"
-            f"SAGE API URL: {SAGE_API_URL}\n"
-            f"請檢查後端日誌以獲取更多資訊"
-        )
-        raise HTTPException(status_code=500, detail=error_msg)
+    # 檢查圖片大小（避免過大）
+    if len(request.image_base64) > 10 * 1024 * 1024:  # 10MB
+        raise HTTPException(status_code=400, detail="圖片過大，請使用較小的圖片")
+
+    async def forward():
+        try:
+            # 記錄請求資訊（調試用）
+            print(f"[DEBUG] 發送請求到 SAGE API: {SAGE_API_URL}/age/photo")
+            print(f"[DEBUG] 圖片大小: {len(request.image_base64)} 字符")
+            print(f"[DEBUG] 目標年齡: {request.target_age}, Mock: {request.mock}")
+
+            response = await get_sage_client().post(
+                f"{SAGE_API_URL}/age/photo",
+                json={
+                    "image_base64": request.image_base64,
+                    "target_age": request.target_age,
+                    "mock": request.mock
+                },
+            )
+
+            print(f"[DEBUG] SAGE API 響應狀態碼: {response.status_code}")
+            response.raise_for_status()
+
+            result = response.json()
+            print(f"[DEBUG] SAGE API 返回成功: {result.get('success', False)}")
+            return result
+        except Exception as e:
+            raise sage_http_exception(e)
+
+    # 相同照片與參數的請求（連點、逾時重試）合併成一次 SAGE 呼叫
+    key = aging_request_key(request.image_base64.encode(), request.target_age, request.mock, "json")
+    return await sage_requests.run(key, forward)
 
 @app.post("/api/capture-and-age")
 async def capture_and_age_proxy(
@@ -340,58 +686,87 @@ async def capture_and_age_proxy(
     target_age: int = Form(75),
     mock: bool = Form(False)
 ):
-    """代理 SAGE API：上傳照片並變老"""
-    try:
-        # 讀取上傳的檔案
-        contents = await file.read()
-        image_base64 = base64.b64encode(contents).decode('utf-8')
-        
-        # 調用變老 API
-        request = AgePhotoRequest(
-            image_base64=image_base64,
-            target_age=target_age,
-            mock=mock
-        )
-        return await age_photo_proxy(request)
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"處理失敗：{str(e)}")
+    """代理 SAGE API：上傳照片並變老（回傳 JSON，變老照片為 base64）"""
+    contents = await _read_upload(file)
+
+    async def forward():
+        try:
+            response = await get_sage_client().post(
+                f"{SAGE_API_URL}/age/upload",
+                data={"target_age": str(target_age), "mock": str(mock).lower(), "response_format": "json"},
+                files=_sage_upload_files(file, contents),
+            )
+            response.raise_for_status()
+            return response.json()
+        except Exception as e:
+            raise sage_http_exception(e)
+
+    return await sage_requests.run(aging_request_key(contents, target_age, mock, "upload-json"), forward)
+
+@app.post("/api/age/upload")
+async def age_upload_proxy(
+    file: UploadFile = File(...),
+    target_age: int = Form(75),
+    mock: bool = Form(False)
+):
+    """
+    代理 SAGE API：上傳照片並變老（二進位傳輸）
+    照片以 multipart 原樣轉送，SAGE 以 response_format=binary 回傳 JPEG，
+    這裡不解碼、直接回傳給前端（附上 SAGE 計算的 ETag），兩個方向都沒有 base64 的 33% 膨脹
+    相同照片與參數的並行請求只轉送一次（結果需要在請求間共用，因此完整讀取後才回傳，不逐塊串流）
+    """
+    contents = await _read_upload(file)
+
+    async def forward():
+        try:
+            response = await get_sage_client().post(
+                f"{SAGE_API_URL}/age/upload",
+                data={"target_age": str(target_age), "mock": str(mock).lower(), "response_format": "binary"},
+                files=_sage_upload_files(file, contents),
+            )
+            response.raise_for_status()
+        except Exception as e:
+            raise sage_http_exception(e)
+        headers = {name: response.headers[name] for name in ("ETag", "X-Aged-Path", "X-Mock") if name in response.headers}
+        return response.content, response.headers.get("content-type", "image/jpeg"), headers
+
+    image, media_type, headers = await sage_requests.run(
+        aging_request_key(contents, target_age, mock, "upload-binary"), forward
+    )
+    return Response(content=image, media_type=media_type, headers={**headers, "Cache-Control": "private, max-age=86400"})
 
 @app.get("/api/sage-status")
 async def sage_status():
     """檢查 SAGE API 狀態"""
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            try:
-                response = await client.get(f"{SAGE_API_URL}/status")
-                response.raise_for_status()
-                status_data = response.json()
-                status_data["connected"] = True
-                status_data["sage_api_url"] = SAGE_API_URL
-                return status_data
-            except httpx.ConnectError as e:
-                return {
-                    "status": "offline",
-                    "connected": False,
-                    "error": f"無法連接到 SAGE API: {str(e)}",
-                    "sage_api_url": SAGE_API_URL,
-                    "suggestion": "請確認 SAGE API 服務是否正在運行，以及 SAGE_API_URL 配置是否正確"
-                }
-            except httpx.TimeoutException:
-                return {
-                    "status": "timeout",
-                    "connected": False,
-                    "error": "連接超時",
-                    "sage_api_url": SAGE_API_URL
-                }
-            except httpx.HTTPStatusError as e:
-                return {
-                    "status": "error",
-                    "connected": False,
-                    "error": f"SAGE API 返回錯誤 {e.response.status_code}: {e.response.text[:200]}",
-                    "sage_api_url": SAGE_API_URL
-                }
+        response = await get_sage_client().get(f"{SAGE_API_URL}/status", timeout=10.0)
+        response.raise_for_status()
+        status_data = response.json()
+        status_data["connected"] = True
+        status_data["sage_api_url"] = SAGE_API_URL
+        return status_data
+    except httpx.ConnectError as e:
+        return {
+            "status": "offline",
+            "connected": False,
+            "error": f"無法連接到 SAGE API: {str(e)}",
+            "sage_api_url": SAGE_API_URL,
+            "suggestion": "請確認 SAGE API 服務是否正在運行，以及 SAGE_API_URL 配置是否正確"
+        }
+    except httpx.TimeoutException:
+        return {
+            "status": "timeout",
+            "connected": False,
+            "error": "連接超時",
+            "sage_api_url": SAGE_API_URL
+        }
+    except httpx.HTTPStatusError as e:
+        return {
+            "status": "error",
+            "connected": False,
+            "error": f"SAGE API 返回錯誤 {e.response.status_code}: {e.response.text[:200]}",
+            "sage_api_url": SAGE_API_URL
+        }
     except Exception as e:
         return {
             "status": "error",
@@ -409,10 +784,15 @@ async def ask_question(request: QuestionRequest):
     """
     try:
         # 1. 獲取機器人配置（角色/身份）
-        bot_config = get_bot_config()
+        # 配置快取仍新鮮時直接取用，不需切換到 DB 執行緒
+        with span("bot_config"):
+            bot_config = bot_config_cache.peek() or await run_db(get_bot_config)
         
         # 2. 優先獲取「老人訪談」文檔；若沒有，再回退到僅用模型知識
-        elderly_documents = get_elderly_documents_with_content()
+        # （先讀世代戳記再讀文檔，避免把舊內容快取在新世代下）
+        with span("documents"):
+            corpus_generation = await run_db(get_generation, CORPUS_GENERATION)
+            elderly_documents = await run_db(get_elderly_documents_with_content)
         if elderly_documents:
             documents_for_ai = elderly_documents
         else:
@@ -422,13 +802,21 @@ async def ask_question(request: QuestionRequest):
         # 3. 使用 Gemini API 生成答案（即使沒有資料也可以使用 Gemini 基礎能力）
         if request.use_ai:
             try:
-                ai_answer = await generate_answer_with_ai(
+                session_id = request.session_id or session_store.new_session_id()
+                with span("session.history"):
+                    history = await run_db(session_store.history, session_id)
+                ai_answer, usage = await generate_answer_with_usage(
                     question=request.question,
                     # 如果有老人訪談資料就傳入，沒有就傳 None（只用模型知識）
                     documents=documents_for_ai if documents_for_ai else None,
                     role_name=bot_config.get("role_name", "成功大學歷史系的對話機器人"),
-                    role_description=bot_config.get("role_description")
+                    role_description=bot_config.get("role_description"),
+                    history=history,
+                    corpus_generation=corpus_generation
                 )
+                if not ai_answer.startswith("錯誤："):
+                    with span("session.append"):
+                        await run_db(session_store.append_turn, session_id, request.question, ai_answer)
                 
                 # 收集所有來源信息（如果有資料）
                 source_ids = None
@@ -449,7 +837,9 @@ async def ask_question(request: QuestionRequest):
                     source="ai" if not documents_for_ai else "documents+ai",
                     documents_used=documents_for_ai if documents_for_ai else None,
                     source_ids=source_ids,
-                    source_details=source_details
+                    source_details=source_details,
+                    input_tokens=usage.get("prompt_token_count") or usage.get("input_tokens"),
+                    session_id=session_id
                 )
             except Exception as e:
                 # AI 失败时，返回错误信息
@@ -485,22 +875,214 @@ async def ask_question(request: QuestionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+class SpeakRequest(QuestionRequest):
+    lang: str = "zh-TW"
+    voice_name: Optional[str] = None
+    rate: float = 0.9
+    pitch: float = -2.0
+    audio_format: str = "wav"  # wav / mp3 / ogg_opus
+
+def _source_summary(documents: Optional[List[dict]]):
+    """回答使用的來源 ID 與來源詳細信息（與 /api/ask 相同格式）"""
+    if not documents:
+        return None, None
+    source_ids = [doc.get("source", "") for doc in documents if doc.get("source")]
+    source_details = [
+        {"source": doc.get("source", ""), "doc_titles": doc.get("doc_titles", [])}
+        for doc in documents
+        if doc.get("source")
+    ]
+    return source_ids, source_details or None
+
+async def synthesize_sentence(tts, text: str, request: SpeakRequest, sample_rate: int = 24000) -> bytes:
+    """合成一句語音（與 /api/tts 共用 audio_cache，同一句話只合成一次）"""
+    _, extension = TTS_AUDIO_FORMATS[request.audio_format]
+    key = audio_cache_key(text, request.lang, request.voice_name, request.rate, request.pitch, sample_rate,
+                          request.audio_format, tts.get_engine().name)
+    cached = await asyncio.to_thread(audio_cache.read, key, extension)
+    if cached is not None:
+        return cached
+    audio = await tts.synthesize_audio_async(
+        text,
+        lang=request.lang,
+        voice_name=request.voice_name,
+        rate=request.rate,
+        pitch=request.pitch,
+        sample_rate=sample_rate,
+        audio_format=request.audio_format,
+    )
+    await asyncio.to_thread(audio_cache.put_bytes, key, audio, extension)
+    return audio
+
+@app.post("/api/ask/speak")
+async def ask_and_speak(request: SpeakRequest):
+    """
+    問答 + 語音：串流生成答案，每完成一句就送去合成語音，
+    文字與音訊以 NDJSON（每行一個 JSON 事件）交錯送出，第一句的語音不必等整段答案生成完
+
+    事件：
+    {"type": "meta", "session_id", "source", "source_ids", "source_details", "audio"}  audio=false 表示 TTS 無法使用
+    {"type": "text", "delta"}                                 答案的新片段
+    {"type": "audio", "seq", "text", "format", "audio"}       一句的語音（base64），依 seq 順序送出
+    {"type": "audio_error", "seq", "text", "detail"}          該句合成失敗（其他句照常）
+    {"type": "done", "answer", "input_tokens", "provider", "audio_chunks"}
+    {"type": "error", "detail"}                               答案生成失敗（之後仍會送出 done）
+    """
+    if request.audio_format not in TTS_AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"audio_format 只支援 {', '.join(TTS_AUDIO_FORMATS)}")
+    if not request.use_ai:
+        raise HTTPException(status_code=400, detail="/api/ask/speak 只支援 use_ai=true")
+
+    started = time.perf_counter()
+    with span("bot_config"):
+        bot_config = bot_config_cache.peek() or await run_db(get_bot_config)
+    with span("documents"):
+        corpus_generation = await run_db(get_generation, CORPUS_GENERATION)
+        documents_for_ai = await run_db(get_elderly_documents_with_content) or None
+    session_id = request.session_id or session_store.new_session_id()
+    with span("session.history"):
+        history = await run_db(session_store.history, session_id)
+    tts = await asyncio.to_thread(load_tts)
+    source_ids, source_details = _source_summary(documents_for_ai)
+
+    events: asyncio.Queue = asyncio.Queue()  # 送給客戶端的事件，None 表示結束
+    speech_jobs: asyncio.Queue = asyncio.Queue()  # (句子, 合成 task)，依句子順序；None 表示答案已結束
+    result = {"answer": "", "usage": {}, "audio_chunks": 0}
+
+    def schedule_sentence(sentence: str):
+        speech = strip_source_info(sentence)
+        if speech:
+            speech_jobs.put_nowait((speech, asyncio.create_task(synthesize_sentence(tts, speech, request))))
+
+    async def produce_answer():
+        splitter = tts.SentenceBuffer() if tts is not None else None
+        parts = []
+        first_text = True
+        try:
+            async for delta in stream_answer(
+                question=request.question,
+                documents=documents_for_ai,
+                role_name=bot_config.get("role_name", "成功大學歷史系的對話機器人"),
+                role_description=bot_config.get("role_description"),
+                history=history,
+                corpus_generation=corpus_generation,
+                usage=result["usage"],
+            ):
+                if first_text:
+                    metrics.observe("ask_speak_first_text", time.perf_counter() - started)
+                    first_text = False
+                parts.append(delta)
+                await events.put({"type": "text", "delta": delta})
+                if splitter is not None:
+                    for sentence in splitter.feed(delta):
+                        schedule_sentence(sentence)
+            if splitter is not None:
+                for sentence in splitter.flush():
+                    schedule_sentence(sentence)
+            result["answer"] = "".join(parts)
+            with span("session.append"):
+                await run_db(session_store.append_turn, session_id, request.question, result["answer"])
+        except Exception as e:
+            result["answer"] = "".join(parts)
+            await events.put({"type": "error", "detail": f"AI 服務錯誤：{str(e)}"})
+        finally:
+            speech_jobs.put_nowait(None)
+
+    async def emit_audio():
+        seq = 0
+        while True:
+            job = await speech_jobs.get()
+            if job is None:
+                return
+            text, task = job
+            try:
+                audio = await task
+            except Exception as e:
+                await events.put({"type": "audio_error", "seq": seq, "text": text, "detail": str(e)})
+            else:
+                if seq == 0:
+                    metrics.observe("ask_speak_first_audio", time.perf_counter() - started)
+                await events.put({
+                    "type": "audio",
+                    "seq": seq,
+                    "text": text,
+                    "format": request.audio_format,
+                    "audio": base64.b64encode(audio).decode("ascii"),
+                })
+                result["audio_chunks"] += 1
+            seq += 1
+
+    async def run_pipeline():
+        await asyncio.gather(produce_answer(), emit_audio())
+        usage = result["usage"]
+        await events.put({
+            "type": "done",
+            "answer": result["answer"],
+            "input_tokens": usage.get("prompt_token_count") or usage.get("input_tokens"),
+            "provider": usage.get("provider"),
+            "audio_chunks": result["audio_chunks"],
+        })
+        metrics.observe("ask_speak_total", time.perf_counter() - started)
+        await events.put(None)
+
+    async def body():
+        yield json.dumps({
+            "type": "meta",
+            "session_id": session_id,
+            "source": "documents+ai" if documents_for_ai else "ai",
+            "source_ids": source_ids,
+            "source_details": source_details,
+            "audio": tts is not None,
+        }, ensure_ascii=False) + "\n"
+        pipeline = asyncio.create_task(run_pipeline())
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            # 客戶端中斷時停止生成與尚未完成的合成
+            pipeline.cancel()
+            while not speech_jobs.empty():
+                job = speech_jobs.get_nowait()
+                if job is not None:
+                    job[1].cancel()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+@app.get("/api/embeddings/status")
+async def embeddings_status():
+    """背景 embedding worker 狀態與佇列長度"""
+    return await run_db(embedding_worker.stats)
+
+@app.get("/api/llm/stats")
+async def llm_stats():
+    """各 LLM 供應商的呼叫次數、錯誤、限速與延遲統計"""
+    return {
+        "providers": [p.name for p in llm_router.providers],
+        "stats": llm_router.stats_snapshot()
+    }
+
 @app.post("/api/add-qa")
 async def add_qa(request: QuestionRequest):
     """新增問答對到資料庫（管理用）"""
     try:
         # 獲取機器人配置
-        bot_config = get_bot_config()
+        bot_config = bot_config_cache.peek() or await run_db(get_bot_config)
         
         # 獲取所有文檔並使用 AI 生成答案
-        documents = get_elderly_documents_with_content() or None
+        corpus_generation = await run_db(get_generation, CORPUS_GENERATION)
+        documents = await run_db(get_elderly_documents_with_content) or None
         answer = await generate_answer_with_ai(
             request.question, 
             documents=documents if documents else None,
             role_name=bot_config.get("role_name", "成功大學歷史系的對話機器人"),
-            role_description=bot_config.get("role_description")
+            role_description=bot_config.get("role_description"),
+            corpus_generation=corpus_generation
         )
-        add_qa_pair(request.question, answer)
+        await run_db(add_qa_pair, request.question, answer)
         return {"message": "問答對已新增"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -521,24 +1103,37 @@ async def create_document(doc: DocumentRequest):
                 detail=f"文檔內容過長，最多 {MAX_DOCUMENT_CONTENT_LENGTH} 字符（目前：{len(doc.content)} 字符）"
             )
         
-        doc_id = add_document(
+        # 同分類內容相同的文檔不會重複寫入（標題不同也一樣），明確告知呼叫端已略過
+        duplicate_id = await run_db(find_duplicate_document, doc.content.strip(), doc.category or "general")
+        if duplicate_id is not None:
+            return {"message": "內容與既有文檔重複，已略過", "id": duplicate_id, "duplicate": True}
+        doc_id = await run_db(
+            add_document,
             title=doc.title.strip(),
             content=doc.content.strip(),
             category=doc.category,
             source=doc.source.strip()
         )
-        return {"message": "文檔已新增", "id": doc_id}
+        return {"message": "文檔已新增", "id": doc_id, "duplicate": False}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/documents/categories", response_model=List[str])
+async def list_categories_endpoint():
+    """文檔分類列表（供資料管理頁的分類篩選使用）"""
+    try:
+        return await run_db(list_categories)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/api/documents/{doc_id}")
 async def get_document(doc_id: int):
     """獲取單個文檔的詳細內容"""
     try:
         from database import get_document_by_id
-        doc = get_document_by_id(doc_id)
+        doc = await run_db(get_document_by_id, doc_id)
         if not doc:
             raise HTTPException(status_code=404, detail="文檔不存在")
         return doc
@@ -547,79 +1142,75 @@ async def get_document(doc_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+DOCUMENT_PAGE_MAX = 1000  # 單頁最多筆數
+
 @app.get("/api/documents", response_model=List[DocumentResponse])
-async def list_documents():
-    """獲取所有文檔列表"""
+async def list_documents_endpoint(
+    response: Response,
+    after_id: int = 0,
+    limit: Optional[int] = None,
+    category: Optional[str] = None,
+    source: Optional[str] = None,
+    q: Optional[str] = None,
+    include_total: bool = False
+):
+    """
+    獲取文檔列表（keyset 分頁）
+
+    - 不帶 limit 時回傳全部（與舊版相同）；帶 limit 時最多 DOCUMENT_PAGE_MAX 筆
+    - q 為標題/來源的關鍵字搜尋，可與 category/source 篩選並用
+    - 回應本體維持為列表；還有下一頁時以 X-Next-Cursor 標頭回傳下一頁的 after_id
+    - include_total=true 時以 X-Total-Count 標頭回傳符合篩選條件的總筆數
+    """
     try:
-        docs = get_all_documents()
+        if limit is not None:
+            limit = max(1, min(limit, DOCUMENT_PAGE_MAX))
+        search = q.strip() if q else None
+        docs = await run_db(list_documents, after_id=after_id, limit=limit, category=category, source=source,
+                            search=search)
+        if limit is not None and len(docs) == limit:
+            response.headers["X-Next-Cursor"] = str(docs[-1]["id"])
+        if include_total:
+            response.headers["X-Total-Count"] = str(
+                await run_db(count_documents, category=category, source=source, search=search)
+            )
         return docs
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.delete("/api/documents/clear")
-async def clear_all_documents():
+async def clear_all_documents_endpoint():
     """清空所有文檔和問答對（刪除所有資料）"""
     try:
-        from database import SessionLocal, Document, QAPair
-        db = SessionLocal()
-        try:
-            doc_count = db.query(Document).count()
-            qa_count = db.query(QAPair).count()
-            # 刪除所有文檔
-            db.query(Document).delete(synchronize_session=False)
-            # 刪除所有問答對
-            db.query(QAPair).delete(synchronize_session=False)
-            db.commit()
-            return {
-                "message": f"已清空所有資料，共刪除 {doc_count} 筆文檔和 {qa_count} 筆問答對",
-                "doc_count": doc_count,
-                "qa_count": qa_count
-            }
-        except Exception as e:
-            db.rollback()
-            raise
-        finally:
-            db.close()
+        counts = await run_db(clear_all_documents)
+        return {
+            "message": f"已清空所有資料，共刪除 {counts['doc_count']} 筆文檔和 {counts['qa_count']} 筆問答對",
+            "doc_count": counts["doc_count"],
+            "qa_count": counts["qa_count"]
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清空失敗：{str(e)}")
 
 @app.delete("/api/documents/{doc_id}")
-async def delete_document(doc_id: int):
+async def delete_document_endpoint(doc_id: int):
     """刪除指定文檔"""
     try:
-        from database import SessionLocal, Document
-        db = SessionLocal()
-        try:
-            doc = db.query(Document).filter(Document.id == doc_id).first()
-            if not doc:
-                raise HTTPException(status_code=404, detail="文檔不存在")
-            db.delete(doc)
-            db.commit()
-            return {"message": "文檔已刪除", "id": doc_id}
-        finally:
-            db.close()
+        if not await run_db(delete_document, doc_id):
+            raise HTTPException(status_code=404, detail="文檔不存在")
+        return {"message": "文檔已刪除", "id": doc_id}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"刪除失敗：{str(e)}")
 
 @app.delete("/api/documents/source/{source_id}")
-async def delete_documents_by_source(source_id: str):
+async def delete_documents_by_source_endpoint(source_id: str):
     """根據來源 ID 批量刪除文檔"""
     try:
-        from database import SessionLocal, Document
-        db = SessionLocal()
-        try:
-            docs = db.query(Document).filter(Document.source == source_id).all()
-            if not docs:
-                raise HTTPException(status_code=404, detail=f"找不到來源 '{source_id}' 的文檔")
-            count = len(docs)
-            for doc in docs:
-                db.delete(doc)
-            db.commit()
-            return {"message": f"已刪除 {count} 筆來源為 '{source_id}' 的文檔", "count": count}
-        finally:
-            db.close()
+        count = await run_db(delete_documents_by_source, source_id)
+        if not count:
+            raise HTTPException(status_code=404, detail=f"找不到來源 '{source_id}' 的文檔")
+        return {"message": f"已刪除 {count} 筆來源為 '{source_id}' 的文檔", "count": count}
     except HTTPException:
         raise
     except Exception as e:
@@ -627,99 +1218,105 @@ async def delete_documents_by_source(source_id: str):
 
 
 @app.post("/api/documents/batch")
-async def batch_import_documents(documents: List[DocumentRequest]):
-    """批量導入文檔"""
+async def batch_import_documents(
+    documents: List[DocumentRequest],
+    atomic: bool = False,
+    rebuild_indexes: Optional[bool] = None
+):
+    """
+    批量導入文檔（Core executemany，分塊交易）
+
+    - atomic=true：全部成功或全部回滾
+    - rebuild_indexes：大量匯入時先移除 title/source 索引、匯入後重建（預設依筆數自動決定）
+    """
     try:
-        imported = []
-        for doc in documents:
-            doc_id = add_document(
-                title=doc.title,
-                content=doc.content,
-                category=doc.category,
-                source=doc.source
-            )
-            imported.append(doc_id)
-        return {"message": f"成功導入 {len(imported)} 個文檔", "ids": imported}
+        stats = await run_db(
+            bulk_insert_documents,
+            [doc.model_dump() for doc in documents],
+            atomic=atomic,
+            rebuild_indexes=rebuild_indexes,
+            return_ids=True
+        )
+        imported = stats.pop("ids")
+        message = f"成功導入 {stats['inserted']} 個文檔"
+        if stats["duplicates"]:
+            message += f"（{stats['duplicates']} 個內容重複，已連結到既有文檔）"
+        return {"message": message, "ids": imported, "stats": stats}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/documents/upload-csv")
-async def upload_csv(file: UploadFile = File(...)):
-    """上傳 CSV 文件並批量導入資料
+def upload_csv(background_tasks: BackgroundTasks, file: UploadFile = File(...), background: bool = False):
+    """上傳 CSV 文件並批量導入資料（串流解析，記憶體用量與檔案大小無關）
     
     CSV 格式要求：
     - 必須有 'id' 和 'text' 兩個欄位
     - id: 資料名稱（每行的 id 字段會作為該筆資料的標題）
     - text: 內容
     - 整個 CSV 文件會作為一個來源，來源名稱是文件名（不含擴展名）
+    
+    background=true 時立即回傳 202 與 job_id，進度以 GET /api/jobs/{job_id} 查詢；
+    預設則等匯入完成後回傳結果（與舊版回應格式相同）
+    （同步函數：解析與寫入都是阻塞操作，交給 threadpool 執行）
     """
+    # 獲取文件名（不含擴展名）作為來源 ID
+    filename = file.filename or "unknown"
+    # 移除 .csv 擴展名
+    source_id = filename.replace('.csv', '').replace('.CSV', '')
+    job = job_store.create(source_id, filename)
+    
+    if background:
+        # 背景工作在回應送出後執行，上傳的暫存檔要到背景工作結束才會關閉
+        background_tasks.add_task(_run_csv_import_job, file, job)
+        return JSONResponse(status_code=202, content={
+            "message": f"已開始匯入 CSV 文件「{source_id}」",
+            "job_id": job.job_id,
+            "status_url": f"/api/jobs/{job.job_id}"
+        })
+    
     try:
-        # 獲取文件名（不含擴展名）作為來源 ID
-        filename = file.filename or "unknown"
-        # 移除 .csv 擴展名
-        source_id = filename.replace('.csv', '').replace('.CSV', '')
-        
-        # 讀取文件內容
-        contents = await file.read()
-        text = contents.decode('utf-8-sig')  # 處理 BOM
-        
-        # 解析 CSV
-        csv_reader = csv.DictReader(io.StringIO(text))
-        rows = []
-        for idx, row in enumerate(csv_reader, 1):
-            # 檢查必要欄位
-            if 'id' not in row or 'text' not in row:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="CSV 文件必須包含 'id' 和 'text' 兩個欄位"
-                )
-            # id 作為資料名稱，source 使用文件名
-            doc_id = row['id'].strip()
-            if not doc_id:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"CSV 文件第 {idx} 行的 'id' 欄位不能為空"
-                )
-            
-            text_content = row['text'].strip()
-            
-            # 驗證數據上限
-            if len(doc_id) > MAX_DOCUMENT_TITLE_LENGTH:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"CSV 文件第 {idx} 行的標題過長，最多 {MAX_DOCUMENT_TITLE_LENGTH} 字符（目前：{len(doc_id)} 字符）"
-                )
-            if len(text_content) > MAX_DOCUMENT_CONTENT_LENGTH:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"CSV 文件第 {idx} 行的內容過長，最多 {MAX_DOCUMENT_CONTENT_LENGTH} 字符（目前：{len(text_content)} 字符）"
-                )
-            
-            rows.append({
-                "id": doc_id,  # CSV 中的 id 作為資料名稱（title）
-                "source": source_id,  # 文件名作為來源 ID
-                "text": text_content
-            })
-        
-        if not rows:
-            raise HTTPException(status_code=400, detail="CSV 文件為空或格式錯誤")
-        
-        # 批量導入（所有資料都屬於同一個來源）
-        # 不再生成 embedding，直接導入
-        count = batch_add_documents_from_csv(rows, generate_embeddings=False)
-        
+        run_csv_import(
+            file.file, job,
+            max_title_length=MAX_DOCUMENT_TITLE_LENGTH,
+            max_content_length=MAX_DOCUMENT_CONTENT_LENGTH
+        )
+        duplicates = job.duplicates
+        message = f"成功從 CSV 文件「{source_id}」導入 {job.inserted} 筆資料"
+        if duplicates:
+            message += f"（略過 {duplicates} 筆重複內容）"
         return {
-            "message": f"成功從 CSV 文件「{source_id}」導入 {count} 筆資料",
-            "count": count,
+            "message": message,
+            "count": job.inserted,
+            "duplicates": duplicates,
             "source": source_id,
-            "source_count": 1  # 只有一個來源（文件名）
+            "source_count": 1,  # 只有一個來源（文件名）
+            "job_id": job.job_id
         }
-    except HTTPException:
-        raise
+    except CSVValidationError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"導入失敗：{str(e)}")
 
+def _run_csv_import_job(file: UploadFile, job):
+    try:
+        run_csv_import(
+            file.file, job,
+            max_title_length=MAX_DOCUMENT_TITLE_LENGTH,
+            max_content_length=MAX_DOCUMENT_CONTENT_LENGTH
+        )
+        print(f"CSV 匯入完成：{job.source}（{job.inserted} 筆，略過 {job.duplicates} 筆重複內容）")
+    except Exception as e:
+        print(f"CSV 匯入失敗：{job.source}：{e}")
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """查詢匯入工作的進度"""
+    job = job_store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="找不到此匯入工作")
+    return job.to_dict()
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,94 @@
+"""
+SAGE 變老請求的合併（single-flight）與短期結果快取
+
+Kiosk 上的連點、逾時後的重試都會送出相同的照片與年齡，每一次都是 GPU 上一次完整的擴散運算：
+- key 為 (照片內容的 SHA-256, target_age, mock, 回應種類)
+- 相同 key 的請求正在進行時，後到的請求等待同一個上游 task，不再轉送給 SAGE
+- 上游 task 與發起的請求分開執行：第一個請求的客戶端中斷時，其他等待者仍會拿到結果
+- 成功的結果保留 SAGE_RESULT_TTL_SECONDS 秒（最多 SAGE_RESULT_CACHE_ENTRIES 筆），立即重試直接回傳；
+  失敗不快取，所有等待者收到同一個例外
+- 計數器 sage_requests_total{result="upstream|coalesced|cached"}
+
+注意：狀態存在行程記憶體中，多個 uvicorn worker 之間不會合併
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from tracing import inc
+
+SAGE_RESULT_TTL_SECONDS = float(os.getenv("SAGE_RESULT_TTL_SECONDS", "120"))  # 結果快取秒數（0 = 只合併進行中的請求）
+SAGE_RESULT_CACHE_ENTRIES = int(os.getenv("SAGE_RESULT_CACHE_ENTRIES", "32"))  # 快取筆數上限（每筆為一張結果照片）
+
+
+def aging_request_key(image: bytes, target_age: int, mock: bool, kind: str) -> str:
+    """照片內容 + 參數的雜湊（kind 區分回應格式，例如 json / binary）"""
+    digest = hashlib.sha256(image).hexdigest()
+    return f"{kind}:{digest}:{int(target_age)}:{int(bool(mock))}"
+
+
+class SingleFlightCache:
+    """合併相同 key 的並行請求，並短暫快取成功結果（只在 event loop 中使用，不需要鎖）"""
+
+    def __init__(self, ttl: float = SAGE_RESULT_TTL_SECONDS, max_entries: int = SAGE_RESULT_CACHE_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._results: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  # key -> (到期時間, 結果)
+        self._counts = {"upstream": 0, "coalesced": 0, "cached": 0}
+
+    def _count(self, result: str):
+        self._counts[result] += 1
+        inc("sage_requests_total", help_text="SAGE aging requests at the proxy", result=result)
+
+    def _cached(self, key: str):
+        entry = self._results.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._results[key]
+            return None
+        self._results.move_to_end(key)
+        return entry
+
+    def _finish(self, key: str, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.ttl > 0 and self.max_entries > 0:
+            self._results[key] = (time.monotonic() + self.ttl, task.result())
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """回傳 fn() 的結果；相同 key 已有結果或正在執行時不再呼叫 fn"""
+        entry = self._cached(key)
+        if entry is not None:
+            self._count("cached")
+            return entry[1]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count("coalesced")
+        else:
+            self._count("upstream")
+            task = asyncio.create_task(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        # shield：等待者被取消時不會取消共用的上游 task
+        return await asyncio.shield(task)
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        return {
+            **self._counts,
+            "in_flight": len(self._inflight),
+            "cached_entries": sum(1 for expires, _ in self._results.values() if expires > now),
+        }
+
+
+sage_requests = SingleFlightCache()
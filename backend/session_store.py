@@ -0,0 +1,148 @@
+"""
+多輪對話 Session 管理
+
+- 以 session_id 為 key，記憶體中保留最近使用的 Session（LRU + TTL 淘汰）
+- 每次新增對話都寫入 SQLite（chat_sessions 表），重啟或換 worker 後仍可接續
+- 近期對話超過 token 預算時，最舊的對話會被壓縮進「摘要」，
+  摘要本身也有 token 上限，因此每次送出的歷史長度固定，不會隨對話輪數線性成長
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from ai_service import estimate_tokens, truncate_to_tokens
+from database import load_chat_session, save_chat_session, delete_chat_sessions
+
+SESSION_MAX_ACTIVE = int(os.getenv("SESSION_MAX_ACTIVE", "256"))  # 記憶體中最多保留的 Session 數
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "3600"))  # 閒置超過此秒數的 Session 會被淘汰
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))  # 近期對話（原文）的 token 上限
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "300"))  # 較早對話摘要的 token 上限
+TURN_SNIPPET_TOKENS = 60  # 壓縮時每輪對話保留的長度
+
+
+class ConversationSession:
+    """單一對話 Session：summary 為較早對話的摘要，turns 為近期對話原文"""
+
+    def __init__(self, session_id: str, summary: str = "", turns: Optional[List[Dict]] = None):
+        self.session_id = session_id
+        self.summary = summary
+        self.turns: List[Dict] = turns or []
+        self.last_access = time.monotonic()
+
+    def history_tokens(self) -> int:
+        return sum(estimate_tokens(t["question"]) + estimate_tokens(t["answer"]) for t in self.turns)
+
+    def compact(self, history_budget: int = HISTORY_TOKEN_BUDGET, summary_budget: int = SUMMARY_TOKEN_BUDGET):
+        """將超出預算的最舊對話壓縮進摘要（至少保留最近一輪原文）"""
+        while len(self.turns) > 1 and self.history_tokens() > history_budget:
+            turn = self.turns.pop(0)
+            self.summary = _append_to_summary(self.summary, turn, summary_budget)
+
+    def render(self) -> str:
+        """輸出給 prompt 使用的歷史區塊（沒有歷史時回傳空字串）"""
+        if not self.summary and not self.turns:
+            return ""
+        parts = ["=== 先前的對話 ==="]
+        if self.summary:
+            parts.append("（較早的對話摘要）")
+            parts.append(self.summary)
+        for turn in self.turns:
+            parts.append(f"你：{turn['question']}")
+            parts.append(f"我：{turn['answer']}")
+        return "\n".join(parts)
+
+
+def _first_sentence(text: str) -> str:
+    text = re.sub(r"\s+", " ", text or "").strip()
+    match = re.search(r"[。！？!?]", text)
+    if match:
+        text = text[: match.end()]
+    return truncate_to_tokens(text, TURN_SNIPPET_TOKENS)
+
+
+def _append_to_summary(summary: str, turn: Dict, summary_budget: int) -> str:
+    """把一輪對話濃縮成一行並接到摘要後面；超過預算時捨棄最舊的行"""
+    line = f"你問「{_first_sentence(turn['question'])}」，我說「{_first_sentence(turn['answer'])}」"
+    lines = summary.split("\n") if summary else []
+    lines.append(line)
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > summary_budget:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), summary_budget)
+
+
+class SessionStore:
+    """記憶體 LRU/TTL 快取 + SQLite 持久化的 Session 儲存"""
+
+    def __init__(self, max_active: int = SESSION_MAX_ACTIVE, ttl_seconds: int = SESSION_TTL_SECONDS):
+        self.max_active = max_active
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    def get(self, session_id: str) -> ConversationSession:
+        """取得 Session（記憶體 -> SQLite -> 新建）"""
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session and now - session.last_access <= self.ttl_seconds:
+                session.last_access = now
+                self._sessions.move_to_end(session_id)
+                return session
+            self._sessions.pop(session_id, None)
+
+        session = ConversationSession(session_id)
+        row = load_chat_session(session_id)
+        if row and row["updated_at"] and datetime.now() - row["updated_at"] <= timedelta(seconds=self.ttl_seconds):
+            session = ConversationSession(session_id, row["summary"], row["turns"])
+
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self._evict_locked()
+        return session
+
+    def append_turn(self, session_id: str, question: str, answer: str) -> ConversationSession:
+        """新增一輪對話，必要時壓縮，並寫入 SQLite"""
+        session = self.get(session_id)
+        with self._lock:
+            session.turns.append({
+                "question": truncate_to_tokens(question, HISTORY_TOKEN_BUDGET // 2),
+                "answer": truncate_to_tokens(answer, HISTORY_TOKEN_BUDGET // 2),
+            })
+            session.compact()
+            summary, turns = session.summary, list(session.turns)
+        save_chat_session(session_id, summary, turns)
+        return session
+
+    def history(self, session_id: str) -> str:
+        return self.get(session_id).render()
+
+    def clear(self):
+        """清空所有 Session（例如角色設定更新時）"""
+        with self._lock:
+            self._sessions.clear()
+        delete_chat_sessions()
+
+    def purge_expired(self) -> int:
+        """刪除 SQLite 中過期的 Session，回傳刪除數量"""
+        return delete_chat_sessions(older_than=datetime.now() - timedelta(seconds=self.ttl_seconds))
+
+    def _evict_locked(self):
+        now = time.monotonic()
+        expired = [sid for sid, s in self._sessions.items() if now - s.last_access > self.ttl_seconds]
+        for sid in expired:
+            del self._sessions[sid]
+        while len(self._sessions) > self.max_active:
+            self._sessions.popitem(last=False)
+
+
+session_store = SessionStore()
@@ -0,0 +1,94 @@
+"""
+啟動狀態與就緒檢查
+
+lifespan 只同步執行必要的 init_db，其餘較慢的工作（訪談 PDF 導入、SAGE 連線檢查、
+TTS SDK 預熱）以背景任務執行，服務可以立即開始接受請求。
+各子系統的狀態記錄在 readiness，由 GET /api/ready 回報。
+
+狀態：pending（尚未開始）、starting（進行中）、ready（完成）、
+      degraded（失敗但不影響其他功能，例如 SAGE 離線）、failed（必要子系統失敗）、disabled（未啟用）
+"""
+import asyncio
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+PENDING = "pending"
+STARTING = "starting"
+READY = "ready"
+DEGRADED = "degraded"
+FAILED = "failed"
+DISABLED = "disabled"
+
+_SETTLED = {READY, DEGRADED, FAILED, DISABLED}
+
+
+class Readiness:
+    """記錄各子系統的啟動狀態"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._states: Dict[str, Dict] = {}
+        self._required = set()
+        self._lock = threading.Lock()
+
+    def register(self, name: str, required: bool = False):
+        with self._lock:
+            self._states[name] = {"status": PENDING, "detail": None, "seconds": None}
+            if required:
+                self._required.add(name)
+
+    def mark(self, name: str, status: str, detail: Optional[str] = None, seconds: Optional[float] = None):
+        with self._lock:
+            state = self._states.setdefault(name, {"status": PENDING, "detail": None, "seconds": None})
+            state["status"] = status
+            state["detail"] = detail
+            if seconds is not None:
+                state["seconds"] = round(seconds, 3)
+
+    async def run(self, name: str, fn: Callable, *args, on_error: str = DEGRADED):
+        """
+        執行 fn（同步函數在執行緒中執行，協程函數直接 await）並記錄狀態與耗時
+        fn 回傳 (status, detail) 時使用該狀態，否則視為 ready；拋出例外時標記為 on_error
+        """
+        self.mark(name, STARTING)
+        start = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                result = await fn(*args)
+            else:
+                result = await asyncio.to_thread(fn, *args)
+        except asyncio.CancelledError:
+            self.mark(name, PENDING, "啟動被取消")
+            raise
+        except Exception as e:
+            self.mark(name, on_error, str(e), time.perf_counter() - start)
+            return
+        status, detail = result if isinstance(result, tuple) else (READY, None)
+        self.mark(name, status, detail, time.perf_counter() - start)
+
+    def is_ready(self) -> bool:
+        """所有必要子系統都已就緒（可以處理請求）"""
+        with self._lock:
+            return all(self._states[name]["status"] == READY for name in self._required)
+
+    def is_warm(self) -> bool:
+        """所有子系統都已完成啟動（包含背景任務）"""
+        with self._lock:
+            return all(state["status"] in _SETTLED for state in self._states.values())
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            subsystems = {
+                name: {**state, "required": name in self._required}
+                for name, state in self._states.items()
+            }
+        return {
+            "ready": self.is_ready(),
+            "warm": self.is_warm(),
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "subsystems": subsystems,
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,26 @@
+"""
+後端測試配置 - pytest fixtures 和共用設定
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+# 加入專案路徑（後端模組為平面結構，例如 from database import ...）
+BACKEND_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_ROOT))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """以暫存目錄中的 SQLite 檔案取代 history_qa.db，回傳已初始化的 database 模組"""
+    import database
+
+    test_engine = database.make_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(database, "engine", test_engine)
+    monkeypatch.setattr(database, "SessionLocal",
+                        sessionmaker(autocommit=False, autoflush=False, bind=test_engine))
+    database.Base.metadata.create_all(bind=test_engine)
+    yield database
+    test_engine.dispose()
@@ -0,0 +1,136 @@
+"""
+來源彙總表（sources）與批量匯入的測試
+"""
+import time
+
+from sqlalchemy import event
+
+
+def _docs(count: int, source: str = "big.csv"):
+    for i in range(count):
+        yield {"title": f"第 {i} 筆", "content": f"內容 {i} " + "口述歷史" * 20, "category": "CSV導入", "source": source}
+
+
+class _Statements:
+    """計算執行的 SQL 語句數"""
+
+    def __init__(self, engine):
+        self.count = 0
+        self.engine = engine
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+class _DocumentReads:
+    """計算讀取 documents.content 的 SELECT 次數（依來源整批讀取內容即為此類查詢）"""
+
+    def __init__(self, engine):
+        self.count = 0
+        self.engine = engine
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        normalized = " ".join(statement.split()).lower()
+        if normalized.startswith("select") and "documents.content" in normalized:
+            self.count += 1
+
+
+class TestBulkImport:
+    """bulk_insert_documents 寫入路徑"""
+
+    def test_import_does_not_read_source_content(self, db):
+        """測試匯入（含串流、單筆新增與刪除）不會依來源讀回全部內容"""
+        with _DocumentReads(db.engine) as reads:
+            db.bulk_insert_documents(_docs(500), chunk_size=50, atomic=True)
+            db.bulk_insert_documents(list(_docs(200, "batch")), chunk_size=50)
+            doc_id = db.add_document("單筆", "單筆內容", "CSV導入", "big.csv")
+            db.delete_document(doc_id)
+        assert reads.count == 0
+
+    def test_batch_cost_independent_of_source_size(self, db):
+        """測試 /api/documents/batch 的寫入路徑：語句數只與批次大小有關，與來源既有筆數無關"""
+        def batch_statements(source: str) -> int:
+            batch = [
+                {"title": f"批次 {i}", "content": f"{source} 的批次內容 {i}", "category": "CSV導入", "source": source}
+                for i in range(50)
+            ]
+            with _Statements(db.engine) as statements, _DocumentReads(db.engine) as reads:
+                stats = db.bulk_insert_documents(batch, atomic=True, return_ids=True)
+            assert stats["inserted"] == 50
+            assert reads.count == 0
+            return statements.count
+
+        db.bulk_insert_documents(_docs(100, "small"), chunk_size=100)
+        db.bulk_insert_documents(_docs(5000, "large"), chunk_size=1000)
+
+        assert batch_statements("small") == batch_statements("large")
+
+    def test_import_time_stays_linear(self, db):
+        """測試同一來源的匯入時間隨筆數線性成長（4 倍筆數不應接近 16 倍時間）"""
+        def timed(count: int, source: str) -> float:
+            started = time.perf_counter()
+            db.bulk_insert_documents(_docs(count, source), chunk_size=100, atomic=True)
+            return time.perf_counter() - started
+
+        timed(200, "warmup")
+        small = min(timed(2000, "small-a"), timed(2000, "small-b"))
+        large = timed(8000, "large")
+        assert large < small * 4 * 2  # 容許 2 倍誤差；二次方成長約為 16 倍
+
+
+class TestSourceDocuments:
+    """get_source_documents 讀取路徑"""
+
+    def test_source_content_matches_documents(self, db):
+        """測試匯入與刪除後，合併內容與文檔表一致（依文檔 id 排序）"""
+        db.bulk_insert_documents(_docs(30), chunk_size=7)
+        first_id = db.list_documents(source="big.csv", limit=1)[0]["id"]
+        db.delete_document(first_id)
+
+        sources = db.get_source_documents("CSV導入")
+
+        assert len(sources) == 1
+        assert sources[0]["doc_titles"] == [f"第 {i} 筆" for i in range(1, 30)]
+        assert sources[0]["content"].startswith("第 1 筆\n內容 1 ")
+
+    def test_materialized_content_is_reused(self, db):
+        """測試第一次讀取後寫回合併內容，之後的讀取不再依來源讀取文檔"""
+        db.bulk_insert_documents(_docs(20), chunk_size=5)
+        first = db.get_source_documents()
+
+        with _DocumentReads(db.engine) as reads:
+            second = db.get_source_documents()
+
+        assert reads.count == 0
+        assert second == first
+
+    def test_stale_write_back_is_discarded(self, db, monkeypatch):
+        """測試讀取期間有寫入時，不會把舊的合併內容寫回"""
+        db.bulk_insert_documents(_docs(5), chunk_size=5)
+        original_build = db._build_source
+
+        def build_then_write(session, category, source):
+            result = original_build(session, category, source)
+            db.add_document("期間新增", "讀取期間寫入的內容", category, source)
+            return result
+
+        monkeypatch.setattr(db, "_build_source", build_then_write)
+        db.get_source_documents()
+        monkeypatch.setattr(db, "_build_source", original_build)
+
+        titles = db.get_source_documents()[0]["doc_titles"]
+        assert titles[-1] == "期間新增"
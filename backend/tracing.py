@@ -0,0 +1,286 @@
+"""
+輕量的請求追蹤與效能指標（不需外部 collector）
+
+用法：
+    from tracing import span, traced
+
+    with span("db.bot_config"):
+        ...
+
+    @traced("ai.build_prompt")
+    def build_prompt(...): ...
+
+- 每個 HTTP 請求由 main.py 的 middleware 建立一個 Trace（存放在 contextvars，
+  asyncio.to_thread 也會帶過去），請求結束時輸出 Server-Timing 標頭與一行 JSON 日誌
+- 所有 span 的耗時都會累計到直方圖，/metrics 以 Prometheus 文字格式輸出
+  （histogram 桶 + p50/p95/p99 摘要）
+- 其他模組可用 inc() 累加計數器，或用 register_collector() 註冊自訂指標
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+TRACE_LOG = os.getenv("TRACE_LOG", "true").lower() == "true"  # 是否輸出每個請求的 JSON 日誌
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+RESERVOIR_SIZE = 1024  # 每個 span 保留最近幾筆樣本用來計算分位數
+
+
+class Trace:
+    """單一請求的 span 紀錄"""
+
+    def __init__(self, name: str, request_id: Optional[str] = None):
+        self.name = name
+        self.request_id = request_id or uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []  # (span 名稱, 毫秒)
+        self.parents: Dict[str, str] = {}  # 巢狀 span 名稱 -> 外層 span 路徑（例如 "documents > db.list"）
+
+    def add(self, name: str, duration_ms: float, parent: Optional[str] = None):
+        self.spans.append((name, duration_ms))
+        if parent:
+            self.parents.setdefault(name, parent)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    def totals(self) -> Dict[str, float]:
+        """同名 span 加總（例如多次 DB 查詢）"""
+        totals: Dict[str, float] = {}
+        for name, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration
+        return totals
+
+    def server_timing(self) -> str:
+        """
+        Server-Timing 標頭內容，例如 "documents;dur=3.1, db.list;desc="documents > db.list";dur=2.8, total;dur=840.1"
+
+        巢狀 span 的耗時已包含在外層 span 中，以 desc 標示所在路徑，避免被當成並列的階段相加
+        """
+        parts = []
+        for name, duration in self.totals().items():
+            parent = self.parents.get(name)
+            desc = f';desc="{parent} > {name}"' if parent else ""
+            parts.append(f"{name}{desc};dur={duration:.1f}")
+        parts.append(f"total;dur={self.elapsed_ms():.1f}")
+        return ", ".join(parts)
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_span", default=None)  # 外層 span 路徑
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def start_trace(name: str, request_id: Optional[str] = None):
+    """開始一個新的 Trace，回傳 (trace, token)；結束時呼叫 end_trace(token)"""
+    trace = Trace(name, request_id)
+    return trace, _current_trace.set(trace)
+
+
+def end_trace(token):
+    _current_trace.reset(token)
+
+
+# ============== 指標 ==============
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items())) + "}"
+
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return float("nan")
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return ordered[index]
+
+
+class MetricsRegistry:
+    """span 耗時直方圖 + 計數器"""
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._help: Dict[str, str] = {}
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]] = []
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1.0, help_text: str = "", **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+            if help_text:
+                self._help[name] = help_text
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0.0)
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]):
+        """註冊自訂指標：collector() 回傳 [(名稱, 類型 gauge/counter, 說明, labels, 值), ...]"""
+        self._collectors.append(collector)
+
+    def quantiles(self, name: str, **labels) -> Dict[float, float]:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            return {q: histogram.quantile(q) for q in QUANTILES} if histogram else {}
+
+    def render_prometheus(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+            help_texts = dict(self._help)
+
+        by_name: Dict[str, List] = {}
+        for (name, labels), histogram in histograms:
+            by_name.setdefault(name, []).append((dict(labels), histogram))
+        for name, series in by_name.items():
+            lines.append(f"# HELP {name}_seconds Duration of {name} in seconds")
+            lines.append(f"# TYPE {name}_seconds histogram")
+            for labels, histogram in series:
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    lines.append(f"{name}_seconds_bucket{_format_labels({**labels, 'le': str(bound)})} {count}")
+                lines.append(f"{name}_seconds_bucket{_format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+                lines.append(f"{name}_seconds_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_seconds_count{_format_labels(labels)} {histogram.count}")
+            lines.append(f"# HELP {name}_quantile_seconds Recent p50/p95/p99 of {name} (last {RESERVOIR_SIZE} samples)")
+            lines.append(f"# TYPE {name}_quantile_seconds summary")
+            for labels, histogram in series:
+                for q in QUANTILES:
+                    lines.append(f"{name}_quantile_seconds{_format_labels({**labels, 'quantile': str(q)})} {histogram.quantile(q):.6f}")
+                lines.append(f"{name}_quantile_seconds_sum{_format_labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_quantile_seconds_count{_format_labels(labels)} {histogram.count}")
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {help_texts.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(dict(labels))} {value:g}")
+
+        for collector in self._collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                lines.append(f"# collector error: {_escape(e)}")
+                continue
+            declared = set()
+            for name, metric_type, help_text, labels, value in samples:
+                if name not in declared:
+                    declared.add(name)
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def inc(name: str, value: float = 1.0, help_text: str = "", **labels):
+    """累加計數器（輸出到 /metrics）"""
+    metrics.inc(name, value, help_text, **labels)
+
+
+# ============== span API ==============
+
+@contextmanager
+def span(name: str):
+    """量測一段程式碼的耗時，記錄到目前請求的 Trace 與全域直方圖"""
+    parent = _current_span.get()
+    token = _current_span.set(f"{parent} > {name}" if parent else name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        try:
+            _current_span.reset(token)
+        except ValueError:  # 在 generator 中跨 context 結束的 span
+            _current_span.set(parent)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(name, elapsed * 1000, parent)
+        metrics.observe("span_duration", elapsed, span=name)
+
+
+def traced(name: Optional[str] = None):
+    """span 的裝飾器版本（支援一般函數與 async 函數）"""
+
+    def decorator(func):
+        span_name = name or f"{func.__module__}.{func.__name__}"
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def log_trace(trace: Trace, **fields):
+    """輸出一行結構化 JSON 日誌"""
+    if not TRACE_LOG:
+        return
+    record = {
+        "event": "request",
+        "request_id": trace.request_id,
+        "name": trace.name,
+        "duration_ms": round(trace.elapsed_ms(), 1),
+        "spans": {k: round(v, 1) for k, v in trace.totals().items()},
+    }
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False), flush=True)
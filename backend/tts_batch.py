@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+批次預先合成語音（展覽前把訪談摘錄、常見回答先合成好）
+
+- 輸入：JSONL 清單（每行 {"id", "text"} 或 {"id", "text_file"}，可另外指定 lang / voice_name / rate /
+  pitch / audio_format 覆寫預設值）或一個 .txt 目錄（id 為相對路徑去掉副檔名）
+- 以 worker pool 並行合成，QuotaLimiter 限制每分鐘的請求數與字數（Google TTS 的配額以分鐘計）
+- 合成結果寫入 audio_cache（預設參數與 /api/tts 相同，之後線上請求直接命中快取），
+  並複製一份到輸出目錄 <id>.<副檔名>；已在快取中的項目不會再呼叫 TTS
+- 每完成一項就追加一行到 manifest（JSONL：狀態、時長、大小、耗時），中斷後重新執行同樣的指令，
+  manifest 中已完成且文字未變的項目直接跳過；結束時 manifest 整理成每個 id 一行
+
+用法：
+python tts_batch.py --dir narration_texts --out_dir output/narration
+python tts_batch.py --manifest items.jsonl --workers 8 --requests_per_minute 300 --audio_format mp3
+TTS_ENGINE=local python tts_batch.py --dir narration_texts    # 離線測試
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from audio_cache import AudioCache, audio_cache, TTS_CACHE_DIR, audio_cache_key
+from tts_service import load_tts, tts_unavailable_reason, TTS_AUDIO_FORMATS
+
+DEFAULT_VOICE = {"lang": "zh-TW", "voice_name": None, "rate": 0.9, "pitch": -2.0, "audio_format": "wav"}  # 與 /api/tts 相同
+SAMPLE_RATE = 24000
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class QuotaLimiter:
+    """每分鐘配額（token bucket，容量為一分鐘的配額，依時間平均補充）；per_minute <= 0 表示不限制"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """取得 amount 單位的配額，不足時等待（超過整分鐘配額的請求等到配額全滿後放行）"""
+        if self.per_minute <= 0:
+            return
+        amount = min(amount, self.per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.per_minute, self._tokens + (now - self._updated) * self.per_minute / 60)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) * 60 / self.per_minute
+            time.sleep(wait)
+
+
+def load_items(source: Path, defaults: Optional[Dict] = None) -> List[Dict]:
+    """讀取 JSONL 清單或 .txt 目錄，回傳 [{"id", "text", "lang", "voice_name", "rate", "pitch", "audio_format"}]"""
+    defaults = {**DEFAULT_VOICE, **(defaults or {})}
+    items = []
+    if source.is_dir():
+        for path in sorted(source.rglob("*.txt")):
+            item_id = path.relative_to(source).with_suffix("").as_posix()
+            items.append({**defaults, "id": item_id, "text": path.read_text(encoding="utf-8")})
+    else:
+        with open(source, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "text_file" in entry and "text" not in entry:
+                    entry["text"] = (source.parent / entry.pop("text_file")).read_text(encoding="utf-8")
+                if not entry.get("id") or not entry.get("text"):
+                    raise ValueError(f"{source} 第 {line_number} 行缺少 id 或 text")
+                items.append({**defaults, **entry, "id": str(entry["id"])})
+
+    seen = set()
+    for item in items:
+        if item["id"] in seen:
+            raise ValueError(f"id 重複：{item['id']}")
+        seen.add(item["id"])
+        if item["audio_format"] not in TTS_AUDIO_FORMATS:
+            raise ValueError(f"{item['id']}：audio_format 只支援 {', '.join(TTS_AUDIO_FORMATS)}")
+        if Path(item["id"]).is_absolute() or ".." in Path(item["id"]).parts:
+            raise ValueError(f"id 不能是絕對路徑或包含 ..：{item['id']}")
+    return items
+
+
+def read_manifest(manifest_path: Path) -> Dict[str, Dict]:
+    """讀取既有 manifest（同一個 id 以最後一行為準；最後一行可能因中斷而不完整，直接略過）"""
+    entries = {}
+    if not manifest_path.exists():
+        return entries
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            entries[entry["id"]] = entry
+    return entries
+
+
+def _write_output(out_path: Path, data: bytes):
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out_path.with_name(out_path.name + ".tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, out_path)
+
+
+def render_batch(
+    items: List[Dict],
+    out_dir: Path,
+    manifest_path: Optional[Path] = None,
+    workers: int = 4,
+    requests_per_minute: float = 0,
+    chars_per_minute: float = 0,
+    retries: int = 2,
+    cache: AudioCache = audio_cache,
+    progress: bool = True,
+) -> Dict[str, int]:
+    """
+    批次合成 items，回傳各狀態的數量：
+    done（上次已完成，跳過）、cached（快取命中，只複製檔案）、rendered（新合成）、failed
+    """
+    tts = load_tts()
+    if tts is None:
+        raise RuntimeError(f"TTS 無法使用：{tts_unavailable_reason()}")
+    engine_name = tts.get_engine().name
+    out_dir = Path(out_dir)
+    manifest_path = Path(manifest_path) if manifest_path else out_dir / MANIFEST_NAME
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = read_manifest(manifest_path)
+    request_quota = QuotaLimiter(requests_per_minute)
+    char_quota = QuotaLimiter(chars_per_minute)
+    counts = {"done": 0, "cached": 0, "rendered": 0, "failed": 0}
+
+    def render(item: Dict, key: str) -> Dict:
+        _, extension = TTS_AUDIO_FORMATS[item["audio_format"]]
+        out_path = out_dir / f"{item['id']}.{extension}"
+        entry = {"id": item["id"], "key": key, "format": item["audio_format"], "path": str(out_path),
+                 "chars": len(item["text"])}
+        started = time.perf_counter()
+        cached = cache.get(key, extension)
+        data = None
+        if cached is not None:
+            try:
+                data = cached.read_bytes()
+                entry["status"] = "cached"
+            except FileNotFoundError:
+                data = None  # 剛好被淘汰
+        if data is None:
+            # 批次不需要低延遲，用最大分段減少請求數（並行由 worker pool 提供）
+            chunk_chars = tts.MAX_CHUNK_CHARS
+            request_count = len(tts.split_text(item["text"], limit=chunk_chars))
+            for attempt in range(retries + 1):
+                request_quota.acquire(request_count)
+                char_quota.acquire(len(item["text"]))
+                try:
+                    data = tts.synthesize_audio(
+                        item["text"],
+                        lang=item["lang"],
+                        voice_name=item["voice_name"],
+                        rate=item["rate"],
+                        pitch=item["pitch"],
+                        sample_rate=SAMPLE_RATE,
+                        audio_format=item["audio_format"],
+                        chunk_chars=chunk_chars,
+                    )
+                    break
+                except ValueError as e:
+                    return {**entry, "status": "failed", "error": str(e)}
+                except Exception as e:
+                    if attempt == retries:
+                        return {**entry, "status": "failed", "error": str(e)}
+                    time.sleep(2 ** attempt)
+            cache.put_bytes(key, data, extension)
+            entry["status"] = "rendered"
+        _write_output(out_path, data)
+        duration = tts.audio_duration(data, item["audio_format"])
+        entry.update({
+            "bytes": len(data),
+            "duration_seconds": round(duration, 3) if duration is not None else None,
+            "seconds": round(time.perf_counter() - started, 3),
+        })
+        return entry
+
+    latest: Dict[str, Dict] = {}
+    pending = []
+    for item in items:
+        key = audio_cache_key(item["text"], item["lang"], item["voice_name"], item["rate"], item["pitch"],
+                              SAMPLE_RATE, item["audio_format"], engine_name)
+        entry = previous.get(item["id"])
+        if entry and entry.get("key") == key and entry.get("status") in ("rendered", "cached") \
+                and Path(entry["path"]).exists():
+            latest[item["id"]] = entry
+            counts["done"] += 1
+        else:
+            pending.append((item, key))
+
+    bar = None
+    if progress and pending:
+        from tqdm import tqdm
+        bar = tqdm(total=len(pending), desc="Narration", unit="item")
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts-batch")
+    try:
+        with open(manifest_path, "a", encoding="utf-8") as manifest:
+            futures = [executor.submit(render, item, key) for item, key in pending]
+            for future in as_completed(futures):
+                entry = future.result()
+                latest[entry["id"]] = entry
+                counts[entry["status"]] += 1
+                manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                manifest.flush()
+                if entry["status"] == "failed":
+                    print(f"  ⚠️  {entry['id']} 合成失敗：{entry['error']}", file=sys.stderr)
+                if bar is not None:
+                    bar.update(1)
+    finally:
+        # 中斷時不再開始新的項目（進行中的項目完成後才結束）
+        executor.shutdown(wait=True, cancel_futures=True)
+        if bar is not None:
+            bar.close()
+        # 整理 manifest：每個 id 只保留最新一行，依輸入順序排列
+        order = {item["id"]: index for index, item in enumerate(items)}
+        compacted = sorted({**previous, **latest}.values(), key=lambda e: order.get(e["id"], len(order)))
+        tmp = manifest_path.with_name(manifest_path.name + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for entry in compacted:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp, manifest_path)
+    return counts
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    source = ap.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", type=str, help="JSONL 清單（每行 {id, text} 或 {id, text_file}）")
+    source.add_argument("--dir", type=str, help="文字檔目錄（*.txt，包含子目錄）")
+    ap.add_argument("--out_dir", type=str, default="output/narration", help="輸出目錄")
+    ap.add_argument("--report", type=str, default=None, help=f"manifest 路徑（預設為 out_dir/{MANIFEST_NAME}）")
+    ap.add_argument("--workers", type=int, default=4, help="同時合成的項目數")
+    ap.add_argument("--requests_per_minute", type=float, default=0, help="每分鐘 TTS 請求數上限（0 = 不限制）")
+    ap.add_argument("--chars_per_minute", type=float, default=0, help="每分鐘送出的字數上限（0 = 不限制）")
+    ap.add_argument("--retries", type=int, default=2, help="單一項目失敗時重試次數")
+    ap.add_argument("--lang", type=str, default=DEFAULT_VOICE["lang"])
+    ap.add_argument("--voice_name", type=str, default=None)
+    ap.add_argument("--rate", type=float, default=DEFAULT_VOICE["rate"])
+    ap.add_argument("--pitch", type=float, default=DEFAULT_VOICE["pitch"])
+    ap.add_argument("--audio_format", choices=sorted(TTS_AUDIO_FORMATS), default=DEFAULT_VOICE["audio_format"])
+    ap.add_argument("--cache_dir", type=str, default=str(TTS_CACHE_DIR), help="audio_cache 目錄（與後端相同才能共用）")
+    args = ap.parse_args()
+
+    defaults = {"lang": args.lang, "voice_name": args.voice_name, "rate": args.rate, "pitch": args.pitch,
+                "audio_format": args.audio_format}
+    items = load_items(Path(args.manifest or args.dir), defaults)
+    cache = audio_cache if Path(args.cache_dir) == TTS_CACHE_DIR else AudioCache(Path(args.cache_dir))
+
+    started = time.perf_counter()
+    try:
+        counts = render_batch(
+            items, Path(args.out_dir), Path(args.report) if args.report else None,
+            workers=args.workers, requests_per_minute=args.requests_per_minute,
+            chars_per_minute=args.chars_per_minute, retries=args.retries, cache=cache,
+        )
+    except KeyboardInterrupt:
+        print("\n已中斷，重新執行相同指令即可從中斷處繼續")
+        sys.exit(130)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    print(f"完成 {len(items)} 項（{time.perf_counter() - started:.1f} 秒）：新合成 {counts['rendered']}、"
+          f"快取 {counts['cached']}、先前已完成 {counts['done']}、失敗 {counts['failed']}")
+    if counts["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
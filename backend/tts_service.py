@@ -0,0 +1,89 @@
+"""
+TTS 服務（Google Cloud Text-to-Speech，透過專案根目錄的 tts_google.py）
+
+tts_google 會導入 google.cloud.texttospeech 與 tqdm，載入需要不少時間，
+因此不在 main.py 導入時載入，而是第一次使用（或啟動後的背景預熱）時才導入
+
+/api/tts 的音訊在記憶體中產生，不再寫入 output/；clean_output_dir 定期清掉
+舊版程式或命令列工具留在 output/ 的 tts_* 檔案
+"""
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+TTS_MODULE_PATH = ROOT_DIR / "tts_google.py"
+TTS_OUTPUT_DIR = Path(__file__).resolve().parent / "output"
+TTS_OUTPUT_MAX_AGE_HOURS = float(os.getenv("TTS_OUTPUT_MAX_AGE_HOURS", "24"))  # output/ 中的舊檔保留時數
+TTS_OUTPUT_JANITOR_SECONDS = int(os.getenv("TTS_OUTPUT_JANITOR_SECONDS", "3600"))  # 清理間隔
+
+# 輸出格式 -> (MIME type, 副檔名)，與 tts_google.AUDIO_FORMATS 對應
+TTS_AUDIO_FORMATS = {
+    "wav": ("audio/wav", "wav"),
+    "mp3": ("audio/mpeg", "mp3"),
+    "ogg_opus": ("audio/ogg", "ogg"),
+}
+
+_lock = threading.Lock()
+_loaded = False
+_tts_module = None
+_load_error: Optional[str] = None
+
+
+def load_tts():
+    """
+    導入 tts_google（只嘗試一次，之後直接回傳結果）
+    無法使用時回傳 None，原因可從 tts_unavailable_reason() 取得
+    """
+    global _loaded, _tts_module, _load_error
+    if _loaded:
+        return _tts_module
+    with _lock:
+        if _loaded:
+            return _tts_module
+        if not TTS_MODULE_PATH.exists():
+            _load_error = f"找不到 tts_google.py 在 {TTS_MODULE_PATH}"
+        else:
+            if str(ROOT_DIR) not in sys.path:
+                sys.path.insert(0, str(ROOT_DIR))
+            try:
+                import tts_google
+                tts_google.get_engine()  # google engine 在這裡載入 google.cloud.texttospeech
+                _tts_module = tts_google
+            except ImportError as e:
+                _load_error = f"無法導入 tts_google 模組：{e}"
+            except ValueError as e:
+                _load_error = str(e)
+        if _load_error:
+            print(f"警告：{_load_error}")
+        _loaded = True
+        return _tts_module
+
+
+def tts_unavailable_reason() -> Optional[str]:
+    return _load_error
+
+
+def is_tts_loaded() -> bool:
+    return _loaded
+
+
+def clean_output_dir(directory: Path = TTS_OUTPUT_DIR, max_age_hours: float = TTS_OUTPUT_MAX_AGE_HOURS) -> int:
+    """刪除 output/ 中超過 max_age_hours 的 tts_* 檔案（不處理子目錄，例如 tts_cache），回傳刪除數量"""
+    if not directory.is_dir():
+        return 0
+    cutoff = time.time() - max_age_hours * 3600
+    removed = 0
+    for path in directory.glob("tts_*"):
+        try:
+            if path.is_file() and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except FileNotFoundError:
+            continue
+    if removed:
+        print(f"  已清除 output/ 中 {removed} 個過期的語音檔")
+    return removed
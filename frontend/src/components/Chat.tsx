@@ -8,6 +8,18 @@ import './Chat.css';
 // Vite 使用 import.meta.env 而不是 process.env
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 
+// /api/ask/speak 回傳的語音格式對應的 MIME type
+const AUDIO_MIME_TYPES: Record<string, string> = {
+  wav: 'audio/wav',
+  mp3: 'audio/mpeg',
+  ogg_opus: 'audio/ogg'
+};
+
+const base64ToBlob = (data: string, type: string): Blob => {
+  const bytes = Uint8Array.from(atob(data), (c) => c.charCodeAt(0));
+  return new Blob([bytes], { type });
+};
+
 interface SourceDetail {
   source: string;
   doc_titles: string[];
@@ -62,6 +74,9 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
   const videoRef = useRef<HTMLVideoElement>(null);
   const streamRef = useRef<MediaStream | null>(null);
   const audioRef = useRef<HTMLAudioElement | null>(null);
+  // /api/ask/speak 逐句送來的語音，依序播放；speechIdRef 在停止播放時遞增，丟棄舊回答還沒播的句子
+  const speechQueueRef = useRef<{ url: string; text: string }[]>([]);
+  const speechIdRef = useRef(0);
 
   useEffect(() => {
     // 檢查是否需要拍照（如果還沒有變老照片）
@@ -99,6 +114,7 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
     const handleClearChat = () => {
       setMessages([]);
       sessionStorage.removeItem('chatHistory');
+      sessionStorage.removeItem('chatSessionId');
       // 同時清除變老照片
       setAgedPhotoUrl(null);
       sessionStorage.removeItem('agedPhotoUrl');
@@ -141,6 +157,9 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
     }
 
     // 停止之前的語音
+    speechIdRef.current += 1;
+    speechQueueRef.current.forEach((clip) => URL.revokeObjectURL(clip.url));
+    speechQueueRef.current = [];
     if (audioRef.current) {
       audioRef.current.pause();
       audioRef.current = null;
@@ -151,21 +170,41 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
 
     try {
       // 優先使用 Google TTS
-      const response = await axios.post(
-        `${API_BASE_URL}/api/tts`,
-        {
-          text: text,
-          lang: 'zh-TW',
-          rate: 0.9,  // 老人聲音稍慢
-          pitch: -2.0  // 老人聲音較低
-        },
-        {
-          responseType: 'blob'
+      const ttsParams = {
+        text: text,
+        lang: 'zh-TW',
+        rate: 0.9,  // 老人聲音稍慢
+        pitch: -2.0  // 老人聲音較低
+      };
+      // 一般長度的回答用串流端點直接播放（第一句合成完就開始播放，瀏覽器也會依 ETag 快取）；
+      // 過長的文字放不進 URL，改用 POST 下載完整音檔
+      let audioUrl: string;
+      let isObjectUrl = false;
+      if (text.length <= 1000) {
+        const query = new URLSearchParams({
+          text: ttsParams.text,
+          lang: ttsParams.lang,
+          rate: String(ttsParams.rate),
+          pitch: String(ttsParams.pitch)
+        });
+        audioUrl = `${API_BASE_URL}/api/tts/stream?${query.toString()}`;
+      } else {
+        // 完整下載時使用 mp3（約為 wav 的 1/10 大小）
+        const response = await axios.post(
+          `${API_BASE_URL}/api/tts`,
+          { ...ttsParams, audio_format: 'mp3' },
+          { responseType: 'blob' }
+        );
+        audioUrl = URL.createObjectURL(response.data);
+        isObjectUrl = true;
+      }
+      const releaseAudioUrl = () => {
+        if (isObjectUrl) {
+          URL.revokeObjectURL(audioUrl);
         }
-      );
+      };
 
-      // 創建音訊 URL 並播放
-      const audioUrl = URL.createObjectURL(response.data);
+      // 創建音訊並播放
       const audio = new Audio(audioUrl);
       audioRef.current = audio;
 
@@ -177,7 +216,7 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
       audio.onended = () => {
         setIsSpeaking(false);
         setCurrentSubtitle('');
-        URL.revokeObjectURL(audioUrl);
+        releaseAudioUrl();
         audioRef.current = null;
       };
 
@@ -185,7 +224,7 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
         console.error('音訊播放錯誤:', e);
         setIsSpeaking(false);
         setCurrentSubtitle('');
-        URL.revokeObjectURL(audioUrl);
+        releaseAudioUrl();
         audioRef.current = null;
         // 回退到瀏覽器語音合成
         fallbackToBrowserTTS(text);
@@ -203,6 +242,125 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
     }
   };
 
+  const playNextClip = () => {
+    if (audioRef.current) return; // 正在播放，播完會接著播下一句
+    const clip = speechQueueRef.current.shift();
+    if (!clip) return;
+
+    const audio = new Audio(clip.url);
+    audioRef.current = audio;
+    audio.onplay = () => {
+      setIsSpeaking(true);
+      setCurrentSubtitle(clip.text); // 字幕跟著句子更新
+    };
+    const next = () => {
+      URL.revokeObjectURL(clip.url);
+      if (audioRef.current !== audio) return; // 已被停止
+      audioRef.current = null;
+      if (speechQueueRef.current.length === 0) {
+        setIsSpeaking(false);
+        setCurrentSubtitle('');
+      }
+      playNextClip();
+    };
+    audio.onended = next;
+    audio.onerror = next;
+    audio.play().catch(next);
+  };
+
+  // 問答 + 語音一次完成：答案邊生成邊顯示，每完成一句就播放該句語音
+  // 回傳 false 表示端點無法使用（由呼叫端改用 /api/ask）
+  const askAndSpeak = async (question: string, tempMessageId: number): Promise<boolean> => {
+    const response = await fetch(`${API_BASE_URL}/api/ask/speak`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        question,
+        use_ai: true,
+        session_id: sessionStorage.getItem('chatSessionId') || undefined,
+        lang: 'zh-TW',
+        rate: 0.9,  // 老人聲音稍慢
+        pitch: -2.0,  // 老人聲音較低
+        audio_format: 'mp3'
+      })
+    });
+    if (!response.ok || !response.body) return false;
+
+    stopSpeaking();
+    const speechId = speechIdRef.current;
+    const updateMessage = (fields: Partial<Message>) => {
+      setMessages(prev => prev.map(msg => msg.tempId === tempMessageId ? { ...msg, ...fields } : msg));
+    };
+
+    let answer = '';
+    let audioEnabled = true;
+    let audioClips = 0;
+    let errorDetail: string | null = null;
+    const handleEvent = (event: any) => {
+      switch (event.type) {
+        case 'meta':
+          audioEnabled = event.audio;
+          if (event.session_id) {
+            sessionStorage.setItem('chatSessionId', event.session_id);
+          }
+          updateMessage({
+            source: event.source,
+            sourceIds: event.source_ids || [],
+            sourceDetails: event.source_details || []
+          });
+          break;
+        case 'text':
+          answer += event.delta;
+          updateMessage({ answer: removeSourceInfo(answer) });
+          break;
+        case 'audio':
+          audioClips += 1;
+          if (speechIdRef.current === speechId) {
+            const blob = base64ToBlob(event.audio, AUDIO_MIME_TYPES[event.format] || 'audio/mpeg');
+            speechQueueRef.current.push({ url: URL.createObjectURL(blob), text: event.text });
+            playNextClip();
+          }
+          break;
+        case 'audio_error':
+          console.warn('語音合成失敗:', event.text, event.detail);
+          break;
+        case 'error':
+          errorDetail = event.detail;
+          break;
+        case 'done':
+          answer = event.answer || answer;
+          break;
+      }
+    };
+
+    // NDJSON：每行一個事件，一次讀到的資料可能包含半行
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    while (true) {
+      const { done, value } = await reader.read();
+      if (done) break;
+      buffered += decoder.decode(value, { stream: true });
+      let newline: number;
+      while ((newline = buffered.indexOf('\n')) >= 0) {
+        const line = buffered.slice(0, newline).trim();
+        buffered = buffered.slice(newline + 1);
+        if (line) handleEvent(JSON.parse(line));
+      }
+    }
+
+    if (errorDetail && !answer) {
+      throw new Error(errorDetail);
+    }
+    const cleanedAnswer = removeSourceInfo(answer);
+    updateMessage({ answer: cleanedAnswer, timestamp: new Date(), tempId: undefined });
+    // 後端 TTS 無法使用（或每句都合成失敗）時改用瀏覽器語音合成
+    if ((!audioEnabled || audioClips === 0) && speechIdRef.current === speechId) {
+      fallbackToBrowserTTS(cleanedAnswer);
+    }
+    return true;
+  };
+
   const fallbackToBrowserTTS = (text: string) => {
     if (!synth) {
       console.warn('瀏覽器不支援語音合成');
@@ -254,10 +412,21 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
     }]);
 
     try {
+      // 優先使用串流問答 + 語音（第一句答案生成並合成後就開始播放）
+      try {
+        if (await askAndSpeak(question, tempMessageId)) return;
+      } catch (error) {
+        console.warn('串流問答失敗，改用 /api/ask', error);
+      }
+
       const response = await axios.post(`${API_BASE_URL}/api/ask`, {
         question: question,
-        use_ai: true
+        use_ai: true,
+        session_id: sessionStorage.getItem('chatSessionId') || undefined
       });
+      if (response.data.session_id) {
+        sessionStorage.setItem('chatSessionId', response.data.session_id);
+      }
 
       const answer = response.data.answer;
       const sourceIds = response.data.source_ids;
@@ -306,6 +475,9 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
   };
 
   const stopSpeaking = () => {
+    speechIdRef.current += 1;
+    speechQueueRef.current.forEach((clip) => URL.revokeObjectURL(clip.url));
+    speechQueueRef.current = [];
     if (audioRef.current) {
       audioRef.current.pause();
       audioRef.current = null;
@@ -401,26 +573,32 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
     ctx.translate(canvas.width, 0);
     ctx.scale(-1, 1);
     ctx.drawImage(video, 0, 0);
-    const imageBase64 = canvas.toDataURL('image/jpeg', 0.9).split(',')[1]; // 移除 data:image/jpeg;base64, 前綴
+    const imageBlob = await new Promise<Blob | null>((resolve) => canvas.toBlob(resolve, 'image/jpeg', 0.9));
+    if (!imageBlob) {
+      alert('無法擷取照片');
+      return;
+    }
 
     stopCamera();
     setIsProcessingPhoto(true);
 
     try {
-      // 調用變老 API
-      const response = await axios.post(`${API_BASE_URL}/api/age-photo`, {
-        image_base64: imageBase64,
-        target_age: 75,
-        mock: false
+      // 調用變老 API（照片與結果都以二進位傳輸，不經過 base64）
+      const formData = new FormData();
+      formData.append('file', imageBlob, 'capture.jpg');
+      formData.append('target_age', '75');
+      formData.append('mock', 'false');
+      const response = await axios.post(`${API_BASE_URL}/api/age/upload`, formData, { responseType: 'blob' });
+
+      // 轉成 data URL 存入 sessionStorage（重新整理頁面後仍可顯示）
+      const agedPhoto = await new Promise<string>((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result as string);
+        reader.onerror = () => reject(new Error('變老處理失敗'));
+        reader.readAsDataURL(response.data);
       });
-
-      if (response.data.success && response.data.aged_image_base64) {
-        const agedPhoto = `data:image/jpeg;base64,${response.data.aged_image_base64}`;
-        setAgedPhotoUrl(agedPhoto);
-        sessionStorage.setItem('agedPhotoUrl', agedPhoto);
-      } else {
-        throw new Error('變老處理失敗');
-      }
+      setAgedPhotoUrl(agedPhoto);
+      sessionStorage.setItem('agedPhotoUrl', agedPhoto);
     } catch (error: any) {
       console.error('變老處理失敗:', error);
       
@@ -428,8 +606,16 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
       let errorMessage = '變老處理失敗，請稍後再試';
       
       if (error.response) {
-        // 後端返回的錯誤
-        const detail = error.response.data?.detail || error.response.data?.message || '';
+        // 後端返回的錯誤（responseType 為 blob，錯誤內容需要先解析成 JSON）
+        let data = error.response.data;
+        if (data instanceof Blob) {
+          try {
+            data = JSON.parse(await data.text());
+          } catch {
+            data = {};
+          }
+        }
+        const detail = data?.detail || data?.message || '';
         if (detail) {
           errorMessage = `變老處理失敗：\n${detail}`;
         } else {
@@ -450,6 +636,7 @@ const Chat: React.FC<ChatProps> = ({ activeTab, setActiveTab }) => {
       setMessages([]);
       setExpandedSources(new Set());
       sessionStorage.removeItem('chatHistory');
+      sessionStorage.removeItem('chatSessionId');
       
       // 清除變老照片，讓用戶可以重新拍照
       setAgedPhotoUrl(null);
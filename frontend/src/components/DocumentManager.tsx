@@ -3,6 +3,7 @@ import axios from 'axios';
 import './DocumentManager.css';
 
 const API_BASE_URL = 'http://localhost:8000';
+const DOCUMENT_PAGE_SIZE = 100;  // 每次載入的筆數
 
 interface Document {
   id: number;
@@ -41,12 +42,33 @@ const DocumentManager: React.FC<DocumentManagerProps> = ({ activeTab, setActiveT
   const [deletingIds, setDeletingIds] = useState<Set<number>>(new Set());
   const [expandedSources, setExpandedSources] = useState<Set<string>>(new Set());
   const [selectedDocument, setSelectedDocument] = useState<Document | null>(null);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [totalCount, setTotalCount] = useState(0);
+  const [isLoadingMore, setIsLoadingMore] = useState(false);
+  const [searchText, setSearchText] = useState('');
+  const [categoryFilter, setCategoryFilter] = useState('');
+  const [categories, setCategories] = useState<string[]>([]);
 
   useEffect(() => {
-    loadDocuments();
     loadBotConfig();
+    loadCategories();
   }, []);
 
+  // 搜尋與分類篩選交給後端；輸入停頓 300ms 後才重新載入第一頁
+  useEffect(() => {
+    const timer = setTimeout(() => loadDocuments(), 300);
+    return () => clearTimeout(timer);
+  }, [searchText, categoryFilter]);
+
+  const loadCategories = async () => {
+    try {
+      const response = await axios.get(`${API_BASE_URL}/api/documents/categories`);
+      setCategories(response.data);
+    } catch (error) {
+      console.error('載入分類失敗:', error);
+    }
+  };
+
   const loadBotConfig = async () => {
     try {
       const response = await axios.get(`${API_BASE_URL}/api/bot-config`);
@@ -97,39 +119,82 @@ const DocumentManager: React.FC<DocumentManagerProps> = ({ activeTab, setActiveT
     }
   };
 
-  const loadDocuments = async () => {
-    try {
-      const response = await axios.get(`${API_BASE_URL}/api/documents`);
-      const docs = response.data;
-      setDocuments(docs);
-      
-      // 按來源分組
-      const groups: { [key: string]: Document[] } = {};
-      docs.forEach((doc: Document) => {
-        const source = doc.source || '未分類';
-        if (!groups[source]) {
-          groups[source] = [];
+  const groupDocuments = (docs: Document[]) => {
+    // 按來源分組
+    const groups: { [key: string]: Document[] } = {};
+    docs.forEach((doc: Document) => {
+      const source = doc.source || '未分類';
+      if (!groups[source]) {
+        groups[source] = [];
+      }
+      groups[source].push(doc);
+    });
+
+    const grouped: DocumentGroup[] = Object.entries(groups).map(([source, docs]) => ({
+      source,
+      count: docs.length,
+      documents: docs
+    }));
+
+    setDocumentGroups(grouped);
+
+    // 預設展開新出現的來源（包含「載入更多」後才出現的來源），使用者收起的維持收起
+    const knownSources = new Set(documentGroups.map(g => g.source));
+    setExpandedSources(prev => {
+      const newSet = new Set(prev);
+      grouped.forEach(g => {
+        if (!knownSources.has(g.source)) {
+          newSet.add(g.source);
         }
-        groups[source].push(doc);
       });
-      
-      const grouped: DocumentGroup[] = Object.entries(groups).map(([source, docs]) => ({
-        source,
-        count: docs.length,
-        documents: docs
-      }));
-      
-      setDocumentGroups(grouped);
-      
-      // 預設展開所有來源
-      if (expandedSources.size === 0) {
-        setExpandedSources(new Set(grouped.map(g => g.source)));
+      return newSet;
+    });
+  };
+
+  const fetchDocumentPage = async (afterId: string) => {
+    // 分頁載入（後端以 X-Next-Cursor 標頭回傳下一頁的起點，X-Total-Count 回傳符合條件的總筆數）
+    const response = await axios.get(`${API_BASE_URL}/api/documents`, {
+      params: {
+        after_id: afterId,
+        limit: DOCUMENT_PAGE_SIZE,
+        include_total: afterId === '0',
+        q: searchText.trim() || undefined,
+        category: categoryFilter || undefined
       }
+    });
+    const next = response.headers['x-next-cursor'];
+    setNextCursor(next ? String(next) : null);
+    if (afterId === '0') {
+      setTotalCount(Number(response.headers['x-total-count'] || response.data.length));
+    }
+    return response.data as Document[];
+  };
+
+  // 只載入第一頁，其餘由「載入更多」按需載入
+  const loadDocuments = async () => {
+    try {
+      const docs = await fetchDocumentPage('0');
+      setDocuments(docs);
+      groupDocuments(docs);
     } catch (error) {
       console.error('載入文檔失敗:', error);
     }
   };
 
+  const loadMoreDocuments = async () => {
+    if (!nextCursor || isLoadingMore) return;
+    setIsLoadingMore(true);
+    try {
+      const docs = [...documents, ...(await fetchDocumentPage(nextCursor))];
+      setDocuments(docs);
+      groupDocuments(docs);
+    } catch (error) {
+      console.error('載入更多文檔失敗:', error);
+    } finally {
+      setIsLoadingMore(false);
+    }
+  };
+
 
 
   const handleDeleteDocument = async (docId: number) => {
@@ -153,7 +218,7 @@ const DocumentManager: React.FC<DocumentManagerProps> = ({ activeTab, setActiveT
   };
 
   const handleDeleteBySource = async (sourceId: string) => {
-    if (!confirm(`確定要刪除來源「${sourceId}」的所有資料嗎？這將刪除 ${documentGroups.find(g => g.source === sourceId)?.count || 0} 筆資料。`)) return;
+    if (!confirm(`確定要刪除來源「${sourceId}」的所有資料嗎？（包含尚未載入的部分）`)) return;
     
     try {
       const response = await axios.delete(`${API_BASE_URL}/api/documents/source/${encodeURIComponent(sourceId)}`);
@@ -289,9 +354,25 @@ const DocumentManager: React.FC<DocumentManagerProps> = ({ activeTab, setActiveT
         )}
 
         <div className="documents-list">
-        <h3>現有資料（共 {documents.length} 筆，{documentGroups.length} 個來源）</h3>
+        <h3>現有資料（共 {totalCount} 筆，已載入 {documents.length} 筆，{documentGroups.length} 個來源）</h3>
+        <div className="documents-filter">
+          <input
+            type="search"
+            value={searchText}
+            onChange={(e) => setSearchText(e.target.value)}
+            placeholder="搜尋標題或來源"
+          />
+          <select value={categoryFilter} onChange={(e) => setCategoryFilter(e.target.value)}>
+            <option value="">全部分類</option>
+            {categories.map((category) => (
+              <option key={category} value={category}>{category}</option>
+            ))}
+          </select>
+        </div>
         {documents.length === 0 ? (
-          <p className="empty-message">尚無資料，請新增歷史資料或上傳 CSV 文件</p>
+          <p className="empty-message">
+            {searchText.trim() || categoryFilter ? '沒有符合條件的資料' : '尚無資料，請新增歷史資料或上傳 CSV 文件'}
+          </p>
         ) : (
           <div className="documents-by-source">
             {documentGroups.map((group) => {
@@ -362,6 +443,15 @@ const DocumentManager: React.FC<DocumentManagerProps> = ({ activeTab, setActiveT
             })}
           </div>
         )}
+        {nextCursor && (
+          <button
+            onClick={loadMoreDocuments}
+            disabled={isLoadingMore}
+            className="load-more-button"
+          >
+            {isLoadingMore ? '載入中...' : `載入更多（剩餘 ${Math.max(totalCount - documents.length, 0)} 筆）`}
+          </button>
+        )}
         </div>
 
         {selectedDocument && (
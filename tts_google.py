@@ -8,6 +8,8 @@ python tts_google.py --text "你好，這是測試" --out test.wav
 python tts_google.py --text_file input.txt --out book.wav
 # 指定 voice（例如：cmn-TW-Wavenet-A）
 python tts_google.py --text "你好" --voice_name cmn-TW-Wavenet-A --out test_wavenet.wav
+# 離線（不需憑證與網路）的測試用合成音
+python tts_google.py --engine local --text "你好，這是測試" --out local.wav
 
 Usage (Windows PowerShell):
 python tts_google.py --list_voices --lang zh-TW | Out-File -Encoding utf8 output\voices_zh-TW.txt
@@ -19,22 +21,242 @@ Notes:
 from tts_google import tts_text_to_wav, tts_txt_to_wav
 tts_text_to_wav("你好，這是測試", out="test.wav")          # -> output/test.wav
 tts_txt_to_wav("input.txt", out="book.wav")               # -> output/book.wav
+
+# 在 asyncio（例如 FastAPI）中使用，不會阻塞 event loop
+await tts_text_to_wav_async("你好，這是測試", out="test.wav")
+pcm = await synthesize_pcm_async("你好")                   # -> 16-bit mono PCM bytes
+mp3 = await synthesize_audio_async("你好", audio_format="mp3")  # -> 完整的 mp3 檔案內容（不寫入磁碟）
+
+Performance:
+- TextToSpeechClient 建立一次後重複使用（gRPC 連線可同時處理多個請求）
+- 長文字切成多段後並行合成（TTS_MAX_CONCURRENCY），再依原順序串接 PCM
+- TTS_CHUNK_CHARS 控制每段長度（預設 1000 字，以句號等標點切分），段數越多並行效果越明顯
+
+Engines (TTS_ENGINE)：
+- google：Google Cloud Text-to-Speech（預設）
+- local：離線的確定性合成音（每個字一個短音），以 TTS_LOCAL_BASE_MS + TTS_LOCAL_MS_PER_CHAR
+  模擬請求延遲，用於 CI 與負載測試（bench_tts.py）
+- 自訂 engine：繼承 TTSEngine 實作 prepare / synthesize_chunk，再以 set_engine() 設定
 """
 
 import argparse
+import asyncio
+import hashlib
+import io
+import itertools
+import math
 import os
 import re
+import struct
 import sys
+import threading
+import time
 import wave
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Union
+from typing import AsyncIterator, Iterator, List, Optional, Union
 
 from dotenv import load_dotenv
 from tqdm import tqdm
-from google.cloud import texttospeech
+
+MAX_CHUNK_CHARS = 4500  # Google TTS 單次請求上限約 5000 字
+CHUNK_CHARS = min(MAX_CHUNK_CHARS, int(os.getenv("TTS_CHUNK_CHARS", "1000")))
+TTS_MAX_CONCURRENCY = int(os.getenv("TTS_MAX_CONCURRENCY", "4"))  # 同時送出的合成請求數（所有呼叫共用）
+TTS_CLIENT_POOL_SIZE = int(os.getenv("TTS_CLIENT_POOL_SIZE", "1"))  # 共用的 TextToSpeechClient 數量
+TTS_ENGINE = os.getenv("TTS_ENGINE", "google")  # google（Google Cloud TTS）或 local（離線測試用的合成音）
+TTS_LOCAL_BASE_MS = float(os.getenv("TTS_LOCAL_BASE_MS", "150"))  # local engine：每個請求的固定延遲
+TTS_LOCAL_MS_PER_CHAR = float(os.getenv("TTS_LOCAL_MS_PER_CHAR", "3"))  # local engine：每個字增加的延遲
+SENTENCE_MIN_CHARS = 6  # 串流合成時，過短的句子併入下一句（減少請求數，也避免語調斷裂）
+# 輸出格式 -> (Google AudioEncoding, MIME type, 副檔名)
+AUDIO_FORMATS = {
+    "wav": ("LINEAR16", "audio/wav", "wav"),
+    "mp3": ("MP3", "audio/mpeg", "mp3"),
+    "ogg_opus": ("OGG_OPUS", "audio/ogg", "ogg"),
+}
+STREAMING_DATA_SIZE = 0xFFFFFFFF - 36  # 串流 WAV 標頭中的資料長度（長度未知時使用最大值）
+
+_client_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+_credentials_checked = False
+_engine: Optional["TTSEngine"] = None
+
+
+def check_credentials():
+    """Load .env and verify GOOGLE_APPLICATION_CREDENTIALS once per process."""
+    global _credentials_checked
+    if _credentials_checked:
+        return
+    load_dotenv()
+    cred = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+    if not cred:
+        raise RuntimeError("Missing GOOGLE_APPLICATION_CREDENTIALS. Put it in .env and re-run.")
+    if not Path(cred).exists():
+        raise RuntimeError(f"Credential file not found: {cred}")
+    _credentials_checked = True
 
 
-def split_text(text: str, limit: int = 4500):
+class TTSEngine(ABC):
+    """
+    Synthesis backend interface.
+    prepare() validates the per-call parameters once; synthesize_chunk() turns one chunk of
+    text into audio bytes (16-bit mono PCM without header for wav, encoded bytes otherwise).
+    synthesize_chunk() is called concurrently from the shared executor and must be thread-safe.
+    """
+
+    name = "base"
+    formats = ("wav",)
+
+    @abstractmethod
+    def prepare(self, lang: str, voice_name: Optional[str], rate: float, pitch: float,
+                sample_rate: int, audio_format: str = "wav"):
+        """Validate per-call parameters and return an engine-specific object for synthesize_chunk()."""
+
+    @abstractmethod
+    def synthesize_chunk(self, text: str, prepared) -> bytes:
+        """Synthesize one chunk with the object returned by prepare()."""
+
+
+class GoogleTTSEngine(TTSEngine):
+    """Google Cloud Text-to-Speech with shared, long-lived clients."""
+
+    name = "google"
+    formats = ("wav", "mp3", "ogg_opus")
+
+    def __init__(self, pool_size: int = TTS_CLIENT_POOL_SIZE):
+        # Imported here so the module (and the local engine) works without the Google SDK installed
+        from google.cloud import texttospeech
+
+        self.texttospeech = texttospeech
+        self.pool_size = max(1, pool_size)
+        self._clients = []
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def get_client(self):
+        """
+        Round-robin over pool_size TextToSpeechClients.
+        Clients are thread-safe; creating one per call costs a new gRPC channel + auth handshake.
+        """
+        with self._lock:
+            if self._cycle is None:
+                check_credentials()
+                self._clients.extend(self.texttospeech.TextToSpeechClient() for _ in range(self.pool_size))
+                self._cycle = itertools.cycle(self._clients)
+            return next(self._cycle)
+
+    def prepare(self, lang, voice_name, rate, pitch, sample_rate, audio_format="wav"):
+        check_credentials()
+        texttospeech = self.texttospeech
+        if voice_name:
+            voice = texttospeech.VoiceSelectionParams(language_code=lang, name=voice_name)
+        else:
+            voice = texttospeech.VoiceSelectionParams(language_code=lang)
+
+        audio_config = texttospeech.AudioConfig(
+            audio_encoding=getattr(texttospeech.AudioEncoding, AUDIO_FORMATS[audio_format][0]),
+            speaking_rate=rate,
+            pitch=pitch,
+            sample_rate_hertz=sample_rate,
+        )
+        return voice, audio_config
+
+    def synthesize_chunk(self, text, prepared):
+        voice, audio_config = prepared
+        resp = self.get_client().synthesize_speech(
+            input=self.texttospeech.SynthesisInput(text=text), voice=voice, audio_config=audio_config
+        )
+        return _pcm_from_audio_content(resp.audio_content)
+
+
+class LocalToneEngine(TTSEngine):
+    """
+    Offline stand-in for load tests and CI: no credentials, no network.
+    Each character becomes a short deterministic tone (punctuation/spaces become silence),
+    so the output length scales with the text like real speech. Latency is emulated as
+    base_ms + ms_per_char * len(text) per request.
+    """
+
+    name = "local"
+    formats = ("wav",)
+    char_seconds = 0.2  # 每個字約 0.2 秒（rate=1.0 時）
+
+    def __init__(self, base_ms: float = TTS_LOCAL_BASE_MS, ms_per_char: float = TTS_LOCAL_MS_PER_CHAR):
+        self.base_ms = base_ms
+        self.ms_per_char = ms_per_char
+        self._tones = {}
+        self._lock = threading.Lock()
+
+    def prepare(self, lang, voice_name, rate, pitch, sample_rate, audio_format="wav"):
+        if audio_format not in self.formats:
+            raise ValueError(f"The local TTS engine only supports: {', '.join(self.formats)}")
+        samples = max(1, int(sample_rate * self.char_seconds / max(rate, 0.25)))
+        return {"sample_rate": sample_rate, "samples": samples, "pitch_factor": 2 ** (pitch / 12)}
+
+    def _tone(self, char: str, prepared) -> bytes:
+        samples = prepared["samples"]
+        if not char.strip() or re.match(r"[^\w]", char):
+            return b"\x00\x00" * samples
+        bucket = hashlib.blake2b(char.encode("utf-8"), digest_size=1).digest()[0] % 24
+        freq = round(180 * 2 ** (bucket / 24) * prepared["pitch_factor"], 1)
+        key = (freq, samples, prepared["sample_rate"])
+        tone = self._tones.get(key)
+        if tone is None:
+            sr = prepared["sample_rate"]
+            fade = max(1, samples // 10)
+            frames = []
+            for n in range(samples):
+                envelope = min(1.0, n / fade, (samples - n) / fade)
+                frames.append(int(8000 * envelope * math.sin(2 * math.pi * freq * n / sr)))
+            tone = struct.pack(f"<{samples}h", *frames)
+            with self._lock:
+                self._tones[key] = tone
+        return tone
+
+    def synthesize_chunk(self, text, prepared):
+        time.sleep((self.base_ms + self.ms_per_char * len(text)) / 1000)
+        return b"".join(self._tone(char, prepared) for char in text)
+
+
+TTS_ENGINES = {"google": GoogleTTSEngine, "local": LocalToneEngine}
+
+
+def get_engine() -> TTSEngine:
+    """The process-wide engine selected by TTS_ENGINE (created on first use)."""
+    global _engine
+    with _client_lock:
+        if _engine is None:
+            if TTS_ENGINE not in TTS_ENGINES:
+                raise ValueError(f"Unknown TTS_ENGINE: {TTS_ENGINE} (choose from {', '.join(TTS_ENGINES)})")
+            _engine = TTS_ENGINES[TTS_ENGINE]()
+        return _engine
+
+
+def set_engine(engine: TTSEngine):
+    """Replace the process-wide engine (benchmarks, tests)."""
+    global _engine
+    with _client_lock:
+        _engine = engine
+
+
+def get_client():
+    """Shared Google TextToSpeechClient (kept for the CLI and existing callers)."""
+    engine = get_engine()
+    if not isinstance(engine, GoogleTTSEngine):
+        raise RuntimeError(f"get_client() needs the google engine (TTS_ENGINE={engine.name})")
+    return engine.get_client()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _client_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, TTS_MAX_CONCURRENCY), thread_name_prefix="tts")
+        return _executor
+
+
+def split_text(text: str, limit: int = MAX_CHUNK_CHARS):
     """
     Google TTS limit is ~5000 chars/request (varies). Use 4500 as safe margin.
     Split by punctuation/line breaks; fallback hard split.
@@ -75,6 +297,155 @@ def split_text(text: str, limit: int = 4500):
     return fixed
 
 
+def split_sentences(text: str, max_chars: int = MAX_CHUNK_CHARS, min_chars: int = SENTENCE_MIN_CHARS) -> List[str]:
+    """
+    Split at the same sentence punctuation as split_text, one sentence per chunk
+    (used for streaming, so the first sentence can be played as soon as it is ready).
+    Sentences shorter than min_chars are merged into the next one.
+    """
+    text = re.sub(r"\s+", " ", text).strip()
+    if not text:
+        return []
+
+    parts = re.split(r"([。！？!?\n])", text)
+    sentences = []
+    buf = ""
+    for i in range(0, len(parts), 2):
+        piece = (parts[i].strip() + (parts[i + 1] if i + 1 < len(parts) else "")).strip()
+        if not piece:
+            continue
+        buf = (buf + piece) if buf else piece
+        if len(buf) >= min_chars:
+            sentences.append(buf)
+            buf = ""
+    if buf:
+        if sentences and len(sentences[-1]) + len(buf) <= max_chars:
+            sentences[-1] += buf
+        else:
+            sentences.append(buf)
+
+    fixed = []
+    for sentence in sentences:
+        for j in range(0, len(sentence), max_chars):
+            fixed.append(sentence[j : j + max_chars])
+    return fixed
+
+
+class SentenceBuffer:
+    """
+    Incremental sentence cutter for text that arrives in pieces (e.g. a streamed LLM answer).
+    Same punctuation and min length as split_sentences; line breaks also end a sentence.
+    """
+
+    _END = re.compile(r"[。！？!?\n]")
+
+    def __init__(self, min_chars: int = SENTENCE_MIN_CHARS, max_chars: int = MAX_CHUNK_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self._buf = ""
+
+    @staticmethod
+    def _clean(sentence: str) -> str:
+        return re.sub(r"\s+", " ", sentence).strip()
+
+    def feed(self, text: str) -> List[str]:
+        """Add text; return the sentences completed by it."""
+        self._buf += text
+        sentences = []
+        start = 0
+        for match in self._END.finditer(self._buf):
+            sentence = self._clean(self._buf[start:match.end()])
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._buf = self._buf[start:]
+        while len(self._buf) > self.max_chars:
+            sentences.append(self._clean(self._buf[:self.max_chars]))
+            self._buf = self._buf[self.max_chars:]
+        return [sentence for sentence in sentences if sentence]
+
+    def flush(self) -> List[str]:
+        """Return whatever is left (end of the text)."""
+        rest = self._clean(self._buf)
+        self._buf = ""
+        return [rest] if rest else []
+
+
+def wav_header(sample_rate: int, data_size: int = STREAMING_DATA_SIZE) -> bytes:
+    """
+    44-byte header for 16-bit mono PCM.
+    With the default data_size the header can be sent before the length is known (streaming).
+    """
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", min(0xFFFFFFFF, 36 + data_size), b"WAVE",
+        b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", data_size,
+    )
+
+
+def pcm_to_wav_bytes(pcm_bytes: bytes, sample_rate: int) -> bytes:
+    return wav_header(sample_rate, len(pcm_bytes)) + pcm_bytes
+
+
+_MP3_BITRATES = {
+    3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],  # MPEG-1 Layer III
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],  # MPEG-2 Layer III（2.5 相同）
+}
+_MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def _mp3_duration(data: bytes) -> Optional[float]:
+    pos = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        pos = 10 + ((data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9])
+    samples = 0
+    sample_rate = None
+    while pos + 4 <= len(data):
+        header = struct.unpack_from(">I", data, pos)[0]
+        version = (header >> 19) & 3
+        if (header >> 21) & 0x7FF != 0x7FF or version == 1 or (header >> 17) & 3 != 1:
+            break  # 不是 Layer III 的 frame（或檔尾的 tag）
+        bitrate_index = (header >> 12) & 0xF
+        rate_index = (header >> 10) & 3
+        if bitrate_index in (0, 15) or rate_index == 3:
+            break
+        bitrate = _MP3_BITRATES[3 if version == 3 else 2][bitrate_index] * 1000
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        frame_samples = 1152 if version == 3 else 576
+        pos += frame_samples // 8 * bitrate // sample_rate + ((header >> 9) & 1)
+        samples += frame_samples
+    return samples / sample_rate if sample_rate else None
+
+
+def _ogg_opus_duration(data: bytes) -> Optional[float]:
+    last_page = data.rfind(b"OggS")
+    head = data.find(b"OpusHead")
+    if last_page < 0 or head < 0 or last_page + 14 > len(data) or head + 12 > len(data):
+        return None
+    granule = struct.unpack_from("<q", data, last_page + 6)[0]
+    pre_skip = struct.unpack_from("<H", data, head + 10)[0]
+    return max(0, granule - pre_skip) / 48000  # Opus 的 granule position 固定以 48 kHz 計算
+
+
+def audio_duration(data: bytes, audio_format: str = "wav") -> Optional[float]:
+    """
+    Duration in seconds of synthesized audio (wav / mp3 / ogg_opus), read from the container
+    without decoding. Returns None when the data cannot be parsed.
+    """
+    try:
+        if audio_format == "wav":
+            with wave.open(io.BytesIO(data), "rb") as wf:
+                return wf.getnframes() / wf.getframerate()
+        if audio_format == "mp3":
+            return _mp3_duration(data)
+        if audio_format == "ogg_opus":
+            return _ogg_opus_duration(data)
+    except (wave.Error, EOFError, struct.error):
+        return None
+    return None
+
+
 def write_wav(out_path: Path, pcm_bytes: bytes, sample_rate: int):
     out_path.parent.mkdir(parents=True, exist_ok=True)
     with wave.open(str(out_path), "wb") as wf:
@@ -84,7 +455,7 @@ def write_wav(out_path: Path, pcm_bytes: bytes, sample_rate: int):
         wf.writeframes(pcm_bytes)
 
 
-def list_voices(client: texttospeech.TextToSpeechClient, lang: str):
+def list_voices(client, lang: str):
     resp = client.list_voices(language_code=lang)
     for v in resp.voices:
         genders = {1: "MALE", 2: "FEMALE", 3: "NEUTRAL"}.get(v.ssml_gender, str(v.ssml_gender))
@@ -107,23 +478,14 @@ def tts_to_wav(
     - Provide exactly one: text OR text_file
     - Returns the final output wav Path (always forced under out_dir)
     """
-    load_dotenv()
-
     if (text is None) == (text_file is None):
         raise ValueError("Provide exactly one: text OR text_file")
 
-    # Ensure credentials env exists
-    cred = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-    if not cred:
-        raise RuntimeError("Missing GOOGLE_APPLICATION_CREDENTIALS. Put it in .env and re-run.")
-    if not Path(cred).exists():
-        raise RuntimeError(f"Credential file not found: {cred}")
-
     if text_file is not None:
         text = Path(text_file).read_text(encoding="utf-8")
 
     assert text is not None
-    client = texttospeech.TextToSpeechClient()
+    client = None  # synthesize() uses the configured engine (shared Google client or local engine)
 
     out_dir = Path(out_dir)
     out_path = resolve_out_path(out_dir, str(out))
@@ -199,8 +561,88 @@ def resolve_out_path(out_dir: Path, out_name_or_path: str) -> Path:
     return out_dir / p.name
 
 
+def _pcm_from_audio_content(audio_content: bytes) -> bytes:
+    """LINEAR16 responses carry a WAV (RIFF) header; strip it so chunks can be concatenated."""
+    if audio_content[:4] == b"RIFF":
+        with wave.open(io.BytesIO(audio_content), "rb") as wf:
+            return wf.readframes(wf.getnframes())
+    return audio_content
+
+
+def _prepare(lang: str, voice_name: Optional[str], rate: float, pitch: float, sample_rate: int,
+             audio_format: str = "wav"):
+    """Resolve the engine once per call so every chunk of one text uses the same engine."""
+    engine = get_engine()
+    return engine, engine.prepare(lang, voice_name, rate, pitch, sample_rate, audio_format)
+
+
+def _synthesize_chunks(chunks: List[str], engine: TTSEngine, prepared, progress: bool = False) -> bytes:
+    if len(chunks) == 1:
+        return engine.synthesize_chunk(chunks[0], prepared)
+
+    # executor.map keeps results in input order regardless of completion order
+    results = _get_executor().map(lambda c: engine.synthesize_chunk(c, prepared), chunks)
+    if progress:
+        results = tqdm(results, total=len(chunks), desc="TTS", unit="chunk")
+    return b"".join(results)
+
+
+def synthesize_pcm(
+    text: str,
+    lang: str = "zh-TW",
+    voice_name: Optional[str] = None,
+    rate: float = 1.0,
+    pitch: float = 0.0,
+    sample_rate: int = 24000,
+    chunk_chars: int = CHUNK_CHARS,
+    progress: bool = False,
+) -> bytes:
+    """
+    Synthesize text to 16-bit mono PCM.
+    Chunks are synthesized concurrently on the shared executor (TTS_MAX_CONCURRENCY)
+    and concatenated in their original order.
+    """
+    chunks = split_text(text, limit=min(chunk_chars, MAX_CHUNK_CHARS))
+    if not chunks:
+        raise ValueError("Empty text after cleaning; nothing to synthesize.")
+
+    engine, prepared = _prepare(lang, voice_name, rate, pitch, sample_rate)
+    return _synthesize_chunks(chunks, engine, prepared, progress)
+
+
+def synthesize_audio(
+    text: str,
+    lang: str = "zh-TW",
+    voice_name: Optional[str] = None,
+    rate: float = 1.0,
+    pitch: float = 0.0,
+    sample_rate: int = 24000,
+    audio_format: str = "wav",
+    chunk_chars: int = CHUNK_CHARS,
+) -> bytes:
+    """
+    Synthesize text to a complete audio file in memory (no temp file).
+    audio_format: wav (16-bit PCM), mp3 or ogg_opus (encoded by Google, ~10x smaller than wav;
+    not available with the local engine).
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unsupported audio_format: {audio_format} (choose from {', '.join(AUDIO_FORMATS)})")
+    if audio_format == "wav":
+        pcm = synthesize_pcm(text, lang, voice_name, rate, pitch, sample_rate, chunk_chars)
+        return pcm_to_wav_bytes(pcm, sample_rate)
+
+    # MP3 frames can be concatenated as-is. Concatenated Ogg files become a chained
+    # stream that not every player handles, so Ogg uses as few requests as possible.
+    limit = MAX_CHUNK_CHARS if audio_format == "ogg_opus" else min(chunk_chars, MAX_CHUNK_CHARS)
+    chunks = split_text(text, limit=limit)
+    if not chunks:
+        raise ValueError("Empty text after cleaning; nothing to synthesize.")
+    engine, prepared = _prepare(lang, voice_name, rate, pitch, sample_rate, audio_format)
+    return _synthesize_chunks(chunks, engine, prepared)
+
+
 def synthesize(
-    client: texttospeech.TextToSpeechClient,
+    client,
     text: str,
     out_path: Path,
     lang: str,
@@ -209,32 +651,104 @@ def synthesize(
     pitch: float,
     sample_rate: int,
 ):
-    chunks = split_text(text, limit=4500)
+    """Synthesize text and write a WAV file (client is kept for compatibility; the configured engine is used)."""
+    chunks = split_text(text, limit=CHUNK_CHARS)
     if not chunks:
         raise SystemExit("Empty text after cleaning; nothing to synthesize.")
 
-    if voice_name:
-        voice = texttospeech.VoiceSelectionParams(language_code=lang, name=voice_name)
-    else:
-        voice = texttospeech.VoiceSelectionParams(language_code=lang)
+    tqdm.write(f"[INFO] chars={len(text)}  chunks={len(chunks)}  sr={sample_rate}  lang={lang}  voice={voice_name or '(auto)'}  concurrency={TTS_MAX_CONCURRENCY}")
 
-    audio_config = texttospeech.AudioConfig(
-        audio_encoding=texttospeech.AudioEncoding.LINEAR16,
-        speaking_rate=rate,
+    pcm = synthesize_pcm(
+        text,
+        lang=lang,
+        voice_name=voice_name,
+        rate=rate,
         pitch=pitch,
-        sample_rate_hertz=sample_rate,
+        sample_rate=sample_rate,
+        progress=True,
     )
 
-    tqdm.write(f"[INFO] chars={len(text)}  chunks={len(chunks)}  sr={sample_rate}  lang={lang}  voice={voice_name or '(auto)'}")
+    write_wav(out_path, pcm, sample_rate)
+    print(f"Saved: {out_path}  (chunks={len(chunks)}, sr={sample_rate})")
 
-    pcm_all = bytearray()
-    for c in tqdm(chunks, desc="TTS", unit="chunk"):
-        synthesis_input = texttospeech.SynthesisInput(text=c)
-        resp = client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
-        pcm_all.extend(resp.audio_content)
 
-    write_wav(out_path, bytes(pcm_all), sample_rate)
-    print(f"Saved: {out_path}  (chunks={len(chunks)}, sr={sample_rate})")
+def _submit_sentences(text: str, lang: str, voice_name: Optional[str], rate: float, pitch: float,
+                      sample_rate: int, lookahead: Optional[int]):
+    """
+    Yield futures of per-sentence PCM in order, keeping at most `lookahead`
+    sentences in flight (default TTS_MAX_CONCURRENCY).
+    """
+    sentences = iter(split_sentences(text))
+    engine, prepared = _prepare(lang, voice_name, rate, pitch, sample_rate)
+    executor = _get_executor()
+    pending = deque()
+
+    def submit_next() -> bool:
+        sentence = next(sentences, None)
+        if sentence is None:
+            return False
+        pending.append(executor.submit(engine.synthesize_chunk, sentence, prepared))
+        return True
+
+    for _ in range(max(1, lookahead or TTS_MAX_CONCURRENCY)):
+        if not submit_next():
+            break
+    try:
+        while pending:
+            future = pending.popleft()
+            submit_next()
+            yield future
+    finally:
+        # consumer stopped early (e.g. client disconnected): drop sentences not started yet
+        for future in pending:
+            future.cancel()
+
+
+def iter_synthesize_pcm(
+    text: str,
+    lang: str = "zh-TW",
+    voice_name: Optional[str] = None,
+    rate: float = 1.0,
+    pitch: float = 0.0,
+    sample_rate: int = 24000,
+    lookahead: Optional[int] = None,
+) -> Iterator[bytes]:
+    """Synthesize sentence by sentence and yield PCM in order as soon as each sentence is ready."""
+    for future in _submit_sentences(text, lang, voice_name, rate, pitch, sample_rate, lookahead):
+        yield future.result()
+
+
+async def stream_pcm_async(
+    text: str,
+    lang: str = "zh-TW",
+    voice_name: Optional[str] = None,
+    rate: float = 1.0,
+    pitch: float = 0.0,
+    sample_rate: int = 24000,
+    lookahead: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """Async version of iter_synthesize_pcm (waits on the executor futures without blocking the loop)."""
+    futures = _submit_sentences(text, lang, voice_name, rate, pitch, sample_rate, lookahead)
+    try:
+        for future in futures:
+            yield await asyncio.wrap_future(future)
+    finally:
+        futures.close()
+
+
+async def synthesize_audio_async(text: str, **kwargs) -> bytes:
+    """Async wrapper of synthesize_audio (runs in a worker thread)."""
+    return await asyncio.to_thread(synthesize_audio, text, **kwargs)
+
+
+async def synthesize_pcm_async(text: str, **kwargs) -> bytes:
+    """Async wrapper of synthesize_pcm: runs in a worker thread so the event loop is never blocked."""
+    return await asyncio.to_thread(synthesize_pcm, text, **kwargs)
+
+
+async def tts_text_to_wav_async(text: str, **kwargs) -> Path:
+    """Async wrapper of tts_text_to_wav (same keyword arguments)."""
+    return await asyncio.to_thread(tts_text_to_wav, text, **kwargs)
 
 
 def main():
@@ -251,18 +765,26 @@ def main():
     ap.add_argument("--pitch", type=float, default=0.0, help="Pitch")
     ap.add_argument("--sr", type=int, default=24000, help="Sample rate (Hz)")
     ap.add_argument("--list_voices", action="store_true", help="List voices for --lang and exit")
+    ap.add_argument("--engine", choices=sorted(TTS_ENGINES), default=None, help="TTS engine (default: $TTS_ENGINE or google)")
     args = ap.parse_args()
 
-    # Ensure credentials env exists
-    cred = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-    if not cred:
-        raise SystemExit("Missing GOOGLE_APPLICATION_CREDENTIALS. Put it in .env and re-run.")
-    if not Path(cred).exists():
-        raise SystemExit(f"Credential file not found: {cred}")
+    if args.engine:
+        set_engine(TTS_ENGINES[args.engine]())
+
+    client = None
+    if get_engine().name == "google":
+        # Ensure credentials env exists
+        cred = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+        if not cred:
+            raise SystemExit("Missing GOOGLE_APPLICATION_CREDENTIALS. Put it in .env and re-run.")
+        if not Path(cred).exists():
+            raise SystemExit(f"Credential file not found: {cred}")
 
-    client = texttospeech.TextToSpeechClient()
+        client = get_client()
 
     if args.list_voices:
+        if client is None:
+            raise SystemExit("--list_voices needs the google engine")
         list_voices(client, args.lang)
         return
 